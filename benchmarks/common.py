@@ -0,0 +1,128 @@
+"""
+@Author: Daryl Xu
+
+Shared helpers of the benchmarks: timing, the JSON results and the comparison with a baseline
+"""
+import argparse
+import json
+import os
+import platform
+import sys
+import time
+import tracemalloc
+from typing import Callable, Dict, List
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+SOURCE_DIR = os.path.join(ROOT, 'medical_image_viewer')
+RESULTS_DIR = os.path.join(ROOT, 'benchmarks', 'results')
+
+# A result slower than the baseline by this ratio is reported as a regression
+DEFAULT_TOLERANCE = 0.2
+
+
+def add_source_path():
+    if SOURCE_DIR not in sys.path:
+        sys.path.insert(0, SOURCE_DIR)
+
+
+def measure_peak(func: Callable) -> float:
+    """
+    Peak of the memory allocated by Python and numpy while func runs, in MB.
+    Tracing slows everything down, so it is a run of its own, not one of the timed runs
+    """
+    tracemalloc.start()
+    try:
+        func()
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return peak / 1024 / 1024
+
+
+def run_case(func: Callable, repeat: int = 3, setup: Callable = None) -> Dict[str, object]:
+    """
+    Time func and measure its peak memory, setup is called before every run and is not measured
+    """
+    def run():
+        if setup is not None:
+            setup()
+        start = time.perf_counter()
+        func()
+        return time.perf_counter() - start
+
+    seconds = [run() for _ in range(repeat)]
+    if setup is not None:
+        setup()
+    return {'seconds': {'best': min(seconds), 'mean': sum(seconds) / len(seconds)}, 'peak_mb': measure_peak(func)}
+
+
+def create_parser(description: str) -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(description=description)
+    parser.add_argument('--repeat', type=int, default=3, help='runs of every case')
+    parser.add_argument('--out', help='JSON file of the results, default: benchmarks/results/<name>.json')
+    parser.add_argument('--baseline', help='JSON file to compare with, default: benchmarks/results/<name>.baseline.json')
+    parser.add_argument('--save-baseline', action='store_true', help='store the results as the new baseline')
+    parser.add_argument('--tolerance', type=float, default=DEFAULT_TOLERANCE,
+                        help='allowed slowdown relative to the baseline (default: %(default)s)')
+    return parser
+
+
+def compare(results: Dict[str, dict], baseline: Dict[str, dict], tolerance: float) -> List[str]:
+    """
+    :return: the description of the regressions
+    """
+    regressions = []
+    for name, result in results.items():
+        if name not in baseline:
+            continue
+        for key in ('seconds', 'peak_mb'):
+            old, new = baseline[name].get(key), result.get(key)
+            if isinstance(old, dict):
+                old, new = old['best'], new['best']
+            if not old or new is None:
+                continue
+            if new > old * (1 + tolerance):
+                regressions.append('{}: {} {:.4g} -> {:.4g} (+{:.0%})'.format(name, key, old, new, new / old - 1))
+    return regressions
+
+
+def report(name: str, results: Dict[str, dict], args: argparse.Namespace) -> int:
+    """
+    Print and write the results, compare them with the baseline
+
+    :return: exit status, 1 if there is a regression
+    """
+    for case, result in results.items():
+        seconds = result.get('seconds')
+        text = '{:.4f}s'.format(seconds['best']) if isinstance(seconds, dict) else ''
+        if result.get('peak_mb') is not None:
+            text += '  peak {:.1f}MB'.format(result['peak_mb'])
+        print('{:<40} {}'.format(case, text))
+
+    os.makedirs(RESULTS_DIR, exist_ok=True)
+    document = {
+        'name': name,
+        'time': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'results': results,
+    }
+    out = args.out or os.path.join(RESULTS_DIR, name + '.json')
+    with open(out, 'w') as f:
+        json.dump(document, f, indent=2)
+
+    baseline_path = args.baseline or os.path.join(RESULTS_DIR, name + '.baseline.json')
+    if args.save_baseline:
+        with open(baseline_path, 'w') as f:
+            json.dump(document, f, indent=2)
+        print('baseline saved to', baseline_path)
+        return 0
+    if not os.path.exists(baseline_path):
+        print('no baseline at', baseline_path)
+        return 0
+    with open(baseline_path) as f:
+        baseline = json.load(f)['results']
+    regressions = compare(results, baseline, args.tolerance)
+    for regression in regressions:
+        print('REGRESSION', regression)
+    return 1 if regressions else 0
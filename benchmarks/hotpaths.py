@@ -0,0 +1,247 @@
+"""
+@Author: Daryl Xu
+
+Benchmarks of the hot paths on a synthetic series: loading, segmentation, overlay edits and slice rendering.
+The time and the peak memory of every case are compared with the baseline of the same shape.
+
+    python benchmarks/hotpaths.py --shape 64                # 64 x 64 x 64
+    python benchmarks/hotpaths.py --shape 1000,512,512 --repeat 1
+    python benchmarks/hotpaths.py --cases load,render --save-baseline
+
+A case whose dependency is not installed (pydicom, PySide2, lymphangioma_segmentation...) is skipped.
+"""
+import os
+import shutil
+import sys
+import tempfile
+import warnings
+from collections import namedtuple
+from typing import Callable, Dict, List
+
+import numpy as np
+
+from common import add_source_path, create_parser, report, run_case
+import synthetic
+
+add_source_path()
+
+# Stands for lymphangioma_segmentation.image.Pixel, State.update_overlay only reads the attributes
+Position = namedtuple('Position', ['row', 'col', 'height'])
+
+GROUPS = ('load', 'segment', 'overlay', 'render')
+
+
+class Context:
+    """
+    The synthetic input shared by the cases
+    """
+    def __init__(self, shape, directory: str):
+        self.shape = shape
+        self.directory = directory
+        self.lesions = synthetic.plant_lesions(shape)
+        self.volume = synthetic.make_volume(shape, self.lesions)
+        self.seed = self.lesions[0].center
+        self.threshold = (synthetic.BACKGROUND + synthetic.LESION) / 2
+        self._files = None
+        # Qt objects of the render cases, kept alive while the cases run
+        self.widgets = None
+
+    @property
+    def files(self) -> List[str]:
+        # The series is only written when a loading case needs it
+        if self._files is None:
+            self._files = synthetic.write_series(self.volume, os.path.join(self.directory, 'series'))
+        return self._files
+
+
+def load_cases(ctx: Context) -> Dict[str, tuple]:
+    from utils import dicom
+    from utils.cache import VolumeCache
+
+    cache_dir = os.path.join(ctx.directory, 'cache')
+    cache = VolumeCache(cache_dir, max_bytes=1 << 40)
+    ctx.files  # written before any timing
+    cases = {
+        'load_series': (lambda: dicom.load_series(list(ctx.files)), None),
+        'load_series_cache_miss': (lambda: dicom.load_series(list(ctx.files), cache=cache), cache.clear),
+        'load_series_cache_hit': (lambda: dicom.load_series(list(ctx.files), cache=cache),
+                                  lambda: dicom.load_series(list(ctx.files), cache=cache)),
+        'load_series_lazy_slice': (lambda: dicom.load_series(list(ctx.files), lazy_threshold=0)[1][ctx.shape[0] // 2],
+                                   None),
+    }
+
+    def legacy():
+        with warnings.catch_warnings():
+            warnings.simplefilter('ignore')
+            dicom.load_dcm_series(list(ctx.files))
+    cases['load_dcm_series'] = (legacy, None)
+    return cases
+
+
+def segment_cases(ctx: Context) -> Dict[str, tuple]:
+    from utils import region_grow, pyramid
+
+    cases = {
+        'region_grow': (lambda: region_grow.region_grow(ctx.volume, ctx.seed, ctx.threshold), None),
+        'region_grow_26': (lambda: region_grow.region_grow(ctx.volume, ctx.seed, ctx.threshold, connectivity=26),
+                           None),
+    }
+    factor = 4
+    level = pyramid.build_pyramid(ctx.volume, (factor,))[factor]
+    cases['coarse_to_fine_grow'] = (
+        lambda: pyramid.coarse_to_fine_grow(ctx.volume, level, factor, ctx.seed, ctx.threshold), None)
+    grow = region_grow.IncrementalRegionGrow(ctx.volume, ctx.seed, synthetic.BACKGROUND)
+    cases['incremental_grow'] = (lambda: grow.grow(ctx.threshold), grow.prepare)
+
+    try:
+        from lymphangioma_segmentation import segmentation
+        from lymphangioma_segmentation.image import Pixel
+    except ImportError:
+        print('region_grow_3d, grow_by_every_slice: skipped, lymphangioma_segmentation is not installed')
+        return cases
+    pixel = Pixel(ctx.seed[1], ctx.seed[2], ctx.seed[0])
+    cases['region_grow_3d'] = (lambda: segmentation.region_grow_3d(ctx.volume, pixel, ctx.threshold), None)
+    cases['grow_by_every_slice'] = (
+        lambda: segmentation.grow_by_every_slice(pixel, ctx.volume, ratio=3, min_iter=5), None)
+    return cases
+
+
+def overlay_cases(ctx: Context) -> Dict[str, tuple]:
+    from store import Store, UpdateMode
+    from utils import brush, fine_tune
+    from utils import plane as plane_
+    from utils.overlay import SparseOverlay
+    from utils.plane import Plane
+
+    store = Store()
+    store.set_volume(ctx.volume, [''] * ctx.shape[0])
+
+    def reset():
+        store.set_overlay(SparseOverlay(ctx.shape), record=False)
+        store.history.clear()
+
+    (z, x, y), r = ctx.lesions[0]
+    roi = np.ones((2 * r, 2 * r), np.int8)
+    position = Position(max(0, y - r), max(0, x - r), z)
+    # The coronal plane at x, (horizontal, vertical) are (y, slice)
+    coronal = np.ones((2 * r, ctx.shape[0]), np.int8)
+    mask = region_grow_mask(ctx)
+
+    def edit_slices():
+        for k in range(ctx.shape[0]):
+            store.update_overlay(Position(position.row, position.col, k), roi, UpdateMode.APPEND)
+
+    # The ROI around the lesion in every slice, thresholded and written as one batched edit
+    rect = (max(0, x - r), max(0, y - r), min(x + r, ctx.shape[1]), min(y + r, ctx.shape[2]))
+
+    def fine_tune_slices():
+        block = plane_.get_block(ctx.volume, Plane.AXIAL, 0, ctx.shape[0], rect)
+        keep = plane_.get_block(store.overlay, Plane.AXIAL, 0, ctx.shape[0], rect) != 0
+        masks = fine_tune.threshold_components(block, ctx.threshold, keep)
+        store.update_overlay_block(*plane_.stack_to_block(Plane.AXIAL, 0, rect[0], rect[1], masks),
+                                   UpdateMode.APPEND)
+
+    # A brush stroke across the slice through the lesion, painted segment by segment like the mouse moves
+    stroke = np.stack([np.linspace(0, ctx.shape[1] - 1, 64), np.linspace(0, ctx.shape[2] - 1, 64)], axis=1)
+
+    def paint_stroke():
+        store.begin_stroke()
+        for a, b in zip(stroke[:-1], stroke[1:]):
+            result = brush.rasterize_stroke(np.stack([a, b]), max(r // 2, 1), ctx.shape[1:])
+            if result is not None:
+                store.paint_overlay(z, *result)
+        store.end_stroke()
+
+    def undo_all():
+        while store.undo():
+            pass
+
+    return {
+        'update_overlay_roi': (lambda: store.update_overlay(position, roi, UpdateMode.APPEND), reset),
+        'update_overlay_every_slice': (edit_slices, reset),
+        'update_overlay_coronal': (
+            lambda: store.update_overlay(Position(0, max(0, y - r), x), coronal, UpdateMode.OVER_WRITE,
+                                         Plane.CORONAL), reset),
+        'fine_tune_roi_slices': (fine_tune_slices, reset),
+        'paint_stroke': (paint_stroke, reset),
+        'set_overlay_volume': (lambda: store.set_overlay(mask), reset),
+        'undo_every_slice': (undo_all, lambda: (reset(), edit_slices())),
+    }
+
+
+def region_grow_mask(ctx: Context) -> np.ndarray:
+    from utils import region_grow
+    return region_grow.region_grow(ctx.volume, ctx.seed, ctx.threshold)
+
+
+def render_cases(ctx: Context) -> Dict[str, tuple]:
+    os.environ.setdefault('QT_QPA_PLATFORM', 'offscreen')
+    from PySide2 import QtWidgets
+    from state import State
+    from utils.overlay import SparseOverlay
+    from utils.plane import Plane
+    from widgets.image_view import MivImageView
+
+    app = QtWidgets.QApplication.instance() or QtWidgets.QApplication([])
+    state = State()
+    state.set_volume(ctx.volume, [''] * ctx.shape[0])
+    state.set_overlay(region_grow_mask(ctx))
+    views = {plane: MivImageView(state, plane) for plane in Plane}
+    for view in views.values():
+        view.resize(512, 512)
+        view.show()
+        view.reset_display()
+        view.refresh()
+    app.processEvents()
+
+    def scroll(view: MivImageView) -> Callable:
+        def run():
+            for index in range(view.slice_count):
+                view._show_current_slice(index)
+            app.processEvents()
+        return run
+
+    cases = {}
+    for plane, view in views.items():
+        name = plane.name.lower()
+        cases[f'show_slices_{name}'] = (scroll(view), view._render_cache.clear)
+        cases[f'show_slices_{name}_cached'] = (scroll(view), scroll(view))
+    ctx.widgets = (app, state, views)
+    return cases
+
+
+CASE_GROUPS = {
+    'load': load_cases,
+    'segment': segment_cases,
+    'overlay': overlay_cases,
+    'render': render_cases,
+}
+
+
+def main():
+    parser = create_parser(__doc__)
+    parser.add_argument('--shape', default='64', help='"64" or "slices,x,y", default: %(default)s')
+    parser.add_argument('--cases', default=','.join(GROUPS), help='groups of the cases, default: %(default)s')
+    args = parser.parse_args()
+
+    shape = synthetic.parse_shape(args.shape)
+    directory = tempfile.mkdtemp(prefix='miv-benchmark-')
+    results = {}
+    try:
+        ctx = Context(shape, directory)
+        for group in args.cases.split(','):
+            try:
+                cases = CASE_GROUPS[group](ctx)
+            except ImportError as e:
+                print(f'{group}: skipped, {e}')
+                continue
+            for name, (func, setup) in cases.items():
+                results[name] = run_case(func, args.repeat, setup)
+    finally:
+        shutil.rmtree(directory, ignore_errors=True)
+    name = 'hotpaths-{}x{}x{}'.format(*shape)
+    return report(name, results, args)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,84 @@
+"""
+@Author: Daryl Xu
+
+Startup time: every case runs in a fresh interpreter, so nothing is imported in advance.
+
+    python benchmarks/startup.py [--save-baseline]
+"""
+import json
+import os
+import subprocess
+import sys
+
+from common import create_parser, report, SOURCE_DIR
+
+# Every snippet prints a JSON object, 'seconds' is measured inside the interpreter
+CASES = {
+    # The core has to be importable without Qt and without the heavy packages
+    'import_core': '''
+import sys, time
+start = time.perf_counter()
+import constant, store, utils.dicom, utils.cache, utils.region_grow, utils.statistics, utils.overlay, utils.history
+seconds = time.perf_counter() - start
+heavy = [m for m in ('PySide2', 'pyqtgraph', 'pydicom', 'scipy', 'lymphangioma_segmentation') if m in sys.modules]
+print(json.dumps({'seconds': seconds, 'heavy_modules': heavy}))
+''',
+    'import_gui': '''
+import time
+start = time.perf_counter()
+import main
+print(json.dumps({'seconds': time.perf_counter() - start}))
+''',
+    'create_window': '''
+import time
+start = time.perf_counter()
+import main
+from PySide2 import QtWidgets
+app = QtWidgets.QApplication([])
+widget = main.MainWindow(files=[])
+print(json.dumps({'seconds': time.perf_counter() - start}))
+''',
+    'first_paint': '''
+import time
+start = time.perf_counter()
+import main
+from PySide2 import QtWidgets, QtCore
+app = QtWidgets.QApplication([])
+widget = main.MainWindow(files=[])
+widget.resize(1000, 600)
+widget.show()
+QtCore.QTimer.singleShot(0, app.quit)
+app.exec_()
+print(json.dumps({'seconds': time.perf_counter() - start}))
+''',
+}
+
+
+def run_snippet(code: str) -> dict:
+    env = dict(os.environ, QT_QPA_PLATFORM='offscreen')
+    process = subprocess.run([sys.executable, '-c', 'import json\n' + code], cwd=SOURCE_DIR, env=env,
+                             stdout=subprocess.PIPE, stderr=subprocess.PIPE, universal_newlines=True)
+    if process.returncode != 0:
+        raise RuntimeError(process.stderr.strip().splitlines()[-1] if process.stderr.strip() else 'failed')
+    return json.loads(process.stdout.strip().splitlines()[-1])
+
+
+def main():
+    args = create_parser(__doc__).parse_args()
+    results = {}
+    for name, code in CASES.items():
+        try:
+            runs = [run_snippet(code) for _ in range(args.repeat)]
+        except RuntimeError as e:
+            print('{}: skipped, {}'.format(name, e))
+            continue
+        seconds = [run['seconds'] for run in runs]
+        result = dict(runs[0], seconds={'best': min(seconds), 'mean': sum(seconds) / len(seconds)})
+        if result.get('heavy_modules'):
+            print('{}: imported {}'.format(name, ', '.join(result['heavy_modules'])))
+        results[name] = result
+    return report('startup', results, args)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
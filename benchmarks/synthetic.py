@@ -0,0 +1,103 @@
+"""
+@Author: Daryl Xu
+
+Synthetic volumes and DICOM series with planted lesions, the input of the benchmarks
+"""
+import os
+from typing import List, NamedTuple, Tuple
+
+import numpy as np
+
+BACKGROUND = 100
+LESION = 600
+NOISE = 20
+
+
+class Lesion(NamedTuple):
+    # (slice, x, y) as the seed of the volume
+    center: Tuple[int, int, int]
+    radius: int
+
+
+def parse_shape(text: str) -> Tuple[int, int, int]:
+    """
+    "64" -> (64, 64, 64), "1000,512,512" -> (1000, 512, 512), the shape is (slices, x, y)
+    """
+    values = [int(v) for v in text.lower().replace('x', ',').split(',')]
+    if len(values) == 1:
+        values *= 3
+    slices, x, y = values
+    return slices, x, y
+
+
+def plant_lesions(shape: Tuple[int, int, int], count: int = 3, seed: int = 0) -> List[Lesion]:
+    rng = np.random.default_rng(seed)
+    lesions = []
+    for _ in range(count):
+        radius = max(2, min(shape) // 8)
+        center = tuple(int(rng.integers(radius, max(radius + 1, n - radius))) for n in shape)
+        lesions.append(Lesion(center, radius))
+    return lesions
+
+
+def make_volume(shape: Tuple[int, int, int], lesions: List[Lesion], seed: int = 0) -> np.ndarray:
+    """
+    Noisy background with bright ellipsoids, built slice by slice to keep the peak memory low
+    """
+    rng = np.random.default_rng(seed)
+    volume = np.empty(shape, np.int16)
+    xs, ys = np.ogrid[: shape[1], : shape[2]]
+    for k in range(shape[0]):
+        slice_ = rng.normal(BACKGROUND, NOISE, shape[1:])
+        for (z, x, y), r in lesions:
+            dz = k - z
+            if abs(dz) > r:
+                continue
+            r2 = r * r - dz * dz
+            slice_[(xs - x) ** 2 + (ys - y) ** 2 <= r2] += LESION - BACKGROUND
+        volume[k] = slice_
+    return volume
+
+
+def write_series(volume: np.ndarray, directory: str, spacing: Tuple[float, float, float] = (1.0, 0.5, 0.5)) \
+        -> List[str]:
+    """
+    Write the volume as a DICOM series, one file per slice, in a shuffled order of the file names
+    """
+    import pydicom
+    from pydicom.dataset import FileDataset, FileMetaDataset
+    from pydicom.uid import ExplicitVRLittleEndian, generate_uid
+
+    os.makedirs(directory, exist_ok=True)
+    series_uid = generate_uid()
+    order = np.random.default_rng(0).permutation(volume.shape[0])
+    files = []
+    for k in range(volume.shape[0]):
+        meta = FileMetaDataset()
+        meta.MediaStorageSOPClassUID = pydicom.uid.MRImageStorage
+        meta.MediaStorageSOPInstanceUID = generate_uid()
+        meta.TransferSyntaxUID = ExplicitVRLittleEndian
+        path = os.path.join(directory, f'{order[k]:05d}.dcm')
+        dcm = FileDataset(path, {}, file_meta=meta, preamble=b'\0' * 128)
+        dcm.SOPClassUID = meta.MediaStorageSOPClassUID
+        dcm.SOPInstanceUID = meta.MediaStorageSOPInstanceUID
+        dcm.Modality = 'MR'
+        dcm.SeriesInstanceUID = series_uid
+        dcm.InstanceNumber = k + 1
+        dcm.SliceLocation = k * spacing[0]
+        dcm.ImagePositionPatient = [0, 0, k * spacing[0]]
+        dcm.SliceThickness = spacing[0]
+        dcm.PixelSpacing = [spacing[1], spacing[2]]
+        # The loaders stack the pixel arrays as they are
+        image = np.ascontiguousarray(volume[k])
+        dcm.Rows, dcm.Columns = image.shape
+        dcm.SamplesPerPixel = 1
+        dcm.PhotometricInterpretation = 'MONOCHROME2'
+        dcm.BitsAllocated = 16
+        dcm.BitsStored = 16
+        dcm.HighBit = 15
+        dcm.PixelRepresentation = 1
+        dcm.PixelData = image.astype(np.int16).tobytes()
+        dcm.save_as(path, write_like_original=False)
+        files.append(path)
+    return files
@@ -0,0 +1,178 @@
+"""
+@Author: Daryl Xu
+
+Headless batch segmentation, no Qt is imported.
+
+    python batch.py <root of the series> --out <output directory> [--manifest manifest.csv]
+
+Every directory containing files under the root is a series, or the series are listed in the manifest
+(CSV with the columns: path, seed, threshold; seed as "slice,x,y", threshold may be empty).
+The masks are written to <out>/masks, the voxel counts and volumes to <out>/results.csv.
+Series already in results.csv with the status "ok" are skipped, so an interrupted batch can be resumed.
+"""
+import argparse
+import csv
+import logging
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from typing import List, Dict, Optional, Tuple
+
+import numpy as np
+
+RESULT_FIELDS = ['name', 'path', 'seed', 'threshold', 'voxels', 'volume_cm3',
+                 'load_seconds', 'segment_seconds', 'status', 'error']
+
+
+def parse_seed(text: str) -> Tuple[int, int, int]:
+    z, x, y = (int(v) for v in text.replace(' ', '').strip('()').split(','))
+    return z, x, y
+
+
+def find_series(root: str) -> List[str]:
+    """
+    Directories containing files under the root
+    """
+    series = []
+    for directory, _, files in os.walk(root):
+        if any(not name.startswith('.') for name in files):
+            series.append(directory)
+    return sorted(series)
+
+
+def series_name(root: str, path: str) -> str:
+    name = os.path.relpath(path, root)
+    return 'root' if name == '.' else name.replace(os.sep, '_')
+
+
+def read_manifest(path: str) -> List[Dict[str, str]]:
+    with open(path, newline='') as f:
+        return list(csv.DictReader(f))
+
+
+def read_finished(result_file: str) -> set:
+    if not os.path.exists(result_file):
+        return set()
+    with open(result_file, newline='') as f:
+        return {row['name'] for row in csv.DictReader(f) if row['status'] == 'ok'}
+
+
+def segment_series(name: str, path: str, seed: Optional[Tuple[int, int, int]], threshold: Optional[float],
+                   mask_dir: str, connectivity: int) -> Dict:
+    """
+    Load and segment one series in a worker process, errors are reported in the result
+    """
+    # Imported in the worker process
+    from utils import dicom, region_grow, statistics
+
+    result = {'name': name, 'path': path, 'seed': '', 'threshold': '', 'voxels': '', 'volume_cm3': '',
+              'load_seconds': '', 'segment_seconds': '', 'status': 'failed', 'error': ''}
+    try:
+        start = time.perf_counter()
+        files = [os.path.join(path, file) for file in sorted(os.listdir(path))
+                 if not file.startswith('.') and os.path.isfile(os.path.join(path, file))]
+        files, volume, spacing, _ = dicom.load_series(files, workers=4)
+        volume = np.ascontiguousarray(volume)
+        result['load_seconds'] = f'{time.perf_counter() - start:.3f}'
+
+        start = time.perf_counter()
+        if seed is None:
+            # The center of the volume
+            seed = tuple(n // 2 for n in volume.shape)
+        if threshold is None:
+            threshold = statistics.estimate_region_statistics(volume, seed).threshold
+        overlay = region_grow.region_grow(volume, seed, threshold, connectivity)
+        result['segment_seconds'] = f'{time.perf_counter() - start:.3f}'
+
+        num = int(np.count_nonzero(overlay))
+        voxel_size = spacing[0] * spacing[1] * spacing[2]
+        np.savez_compressed(os.path.join(mask_dir, f'{name}.npz'), mask=np.packbits(overlay, axis=None),
+                            shape=overlay.shape, spacing=spacing, files=np.array(files))
+        result.update(seed=','.join(str(v) for v in seed), threshold=f'{threshold:.1f}', voxels=num,
+                      volume_cm3=f'{num * voxel_size / 1000:.2f}', status='ok')
+    except Exception as e:
+        logging.exception(e)
+        result['error'] = f'{type(e).__name__}: {e}'
+    return result
+
+
+def run_batch(jobs: List[Dict], out_dir: str, workers: Optional[int] = None, connectivity: int = 6) -> List[Dict]:
+    """
+    :param jobs: [{'name', 'path', 'seed', 'threshold'}]
+    :param out_dir:
+    :param workers: number of the processes
+    :param connectivity:
+    :return: the results of this run
+    """
+    mask_dir = os.path.join(out_dir, 'masks')
+    os.makedirs(mask_dir, exist_ok=True)
+    result_file = os.path.join(out_dir, 'results.csv')
+    finished = read_finished(result_file)
+    jobs = [job for job in jobs if job['name'] not in finished]
+    logging.info(f'{len(finished)} series finished before, {len(jobs)} to run')
+
+    results = []
+    new_file = not os.path.exists(result_file)
+    with open(result_file, 'a', newline='') as f, ProcessPoolExecutor(max_workers=workers) as executor:
+        writer = csv.DictWriter(f, RESULT_FIELDS)
+        if new_file:
+            writer.writeheader()
+        futures = {executor.submit(segment_series, job['name'], job['path'], job['seed'], job['threshold'],
+                                   mask_dir, connectivity): job for job in jobs}
+        for future in as_completed(futures):
+            job = futures[future]
+            try:
+                result = future.result()
+            except Exception as e:
+                # The worker process died
+                result = {'name': job['name'], 'path': job['path'], 'status': 'failed',
+                          'error': f'{type(e).__name__}: {e}'}
+            # Written at once, the finished series survive an interruption
+            writer.writerow(result)
+            f.flush()
+            results.append(result)
+            logging.info(f'{result["name"]}: {result["status"]} {result.get("error", "")}')
+    return results
+
+
+def create_jobs(args) -> List[Dict]:
+    default_seed = parse_seed(args.seed) if args.seed else None
+    default_threshold = args.threshold
+    jobs = []
+    if args.manifest:
+        for row in read_manifest(args.manifest):
+            path = os.path.join(args.root, row['path'])
+            jobs.append({
+                'name': series_name(args.root, path),
+                'path': path,
+                'seed': parse_seed(row['seed']) if row.get('seed') else default_seed,
+                'threshold': float(row['threshold']) if row.get('threshold') else default_threshold,
+            })
+    else:
+        for path in find_series(args.root):
+            jobs.append({'name': series_name(args.root, path), 'path': path,
+                         'seed': default_seed, 'threshold': default_threshold})
+    return jobs
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Headless batch segmentation')
+    parser.add_argument('root', help='root directory of the series')
+    parser.add_argument('--out', required=True, help='output directory')
+    parser.add_argument('--manifest', help='CSV with the columns: path, seed, threshold')
+    parser.add_argument('--seed', help='default seed "slice,x,y", the center of the volume if not given')
+    parser.add_argument('--threshold', type=float, help='default threshold, estimated around the seed if not given')
+    parser.add_argument('--workers', type=int, help='number of the processes')
+    parser.add_argument('--connectivity', type=int, default=6, choices=(6, 18, 26))
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s %(levelname)s %(message)s', datefmt='%H:%M:%S')
+    results = run_batch(create_jobs(args), args.out, args.workers, args.connectivity)
+    failed = [result for result in results if result['status'] != 'ok']
+    logging.info(f'{len(results) - len(failed)} succeeded, {len(failed)} failed')
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    import sys
+    sys.exit(main())
@@ -1,6 +1,8 @@
 """
 @Author: Daryl Xu
 """
+import os
+import tempfile
 from enum import Enum, unique
 
 
@@ -15,3 +17,38 @@ class ViewMode(Enum):
     VIEW = '看图'
     PIXEL_SELECTION = '选点'
     ROI_SELECTION = 'ROI选择'
+    BRUSH = '画笔'
+    POLYGON = '多边形'
+
+
+# 本地体数据缓存 | local volume cache
+VOLUME_CACHE_DIR = os.environ.get('MIV_CACHE_DIR', os.path.join(os.path.expanduser('~'), '.cache', 'medical-image-viewer'))
+VOLUME_CACHE_MAX_BYTES = int(os.environ.get('MIV_CACHE_MAX_MB', 4096)) * 1024 * 1024
+
+# 目录中DICOM序列的索引 | index of the DICOM series in the scanned directories
+SERIES_INDEX_PATH = os.environ.get('MIV_SERIES_INDEX', os.path.join(VOLUME_CACHE_DIR, 'series-index.sqlite'))
+
+# 超过该大小的序列按需逐层解码 | series larger than this are decoded slice by slice on demand
+LAZY_VOLUME_MIN_BYTES = int(os.environ.get('MIV_LAZY_VOLUME_MIN_MB', 1024)) * 1024 * 1024
+
+# 同时打开的多个序列的内存上限，超出时最久未用的序列被换出到磁盘 | memory budget of the open series,
+# the least recently used ones are spilled to disk when exceeded
+SESSION_MAX_BYTES = int(os.environ.get('MIV_SESSION_MAX_MB', 2048)) * 1024 * 1024
+SESSION_SPILL_DIR = os.environ.get('MIV_SPILL_DIR', os.path.join(tempfile.gettempdir(), 'medical-image-viewer-spill'))
+
+# 撤销历史的内存上限 | memory budget of the undo history
+OVERLAY_HISTORY_MAX_BYTES = int(os.environ.get('MIV_HISTORY_MAX_MB', 256)) * 1024 * 1024
+
+# 多分辨率金字塔的降采样倍数 | downsampling factors of the pyramid
+PYRAMID_FACTORS = (2, 4)
+
+# 性能计时，也可在诊断面板中开启 | timing instrumentation, can also be enabled in the diagnostics panel
+PROFILE_ENABLED = os.environ.get('MIV_PROFILE', '') not in ('', '0')
+PROFILE_MAX_SPANS = int(os.environ.get('MIV_PROFILE_MAX_SPANS', 10000))
+
+# 窗宽窗位预设，(窗位, 窗宽)，单位HU | window presets, (center, width) in HU
+WINDOW_PRESETS = {
+    '肺窗': (-600, 1500),
+    '软组织窗': (40, 400),
+    '骨窗': (400, 1800),
+}
@@ -2,42 +2,87 @@
 @Author: Daryl Xu
 """
 import logging
-from typing import List, Tuple
+import math
+from typing import List, Optional, Tuple
 
 from PySide2 import QtWidgets, QtCore
 from PySide2.QtCore import Slot
+from PySide2.QtGui import QKeySequence
 from PySide2.QtWidgets import QWidget, QLineEdit, QPushButton, QMenuBar, QMenu, QAction, QFileDialog, QTextBrowser, \
-    QMessageBox, QLabel, QComboBox, QSlider
+    QMessageBox, QLabel, QComboBox, QSlider, QProgressDialog, QApplication, QProgressBar, \
+    QCheckBox, QSpinBox, QDialog
 import numpy as np
-from lymphangioma_segmentation import segmentation
-from lymphangioma_segmentation.image import Pixel
-from lymphangioma_segmentation import image
 
-from constant import Algorithm
-from store import State
+from constant import Algorithm, LAZY_VOLUME_MIN_BYTES, PYRAMID_FACTORS, PROFILE_ENABLED
+from state import State
+from utils import dicom, statistics, region_grow, pyramid, profiling, mask_io
+from utils.cache import VolumeCache
+from utils.histogram import VolumeHistogram
+from utils.overlay import SparseOverlay
+from utils.series_index import SeriesIndex
+from utils.session import SeriesState, SessionManager
 from widgets.histogram_lut import MivHistogramLUTWidget
-from widgets.image_view import MivImageView, ViewMode
+from widgets.image_view import ViewMode
+from widgets.mpr_view import MivMprView
 from window.about import AboutWindow
+from window.diagnostics import DiagnosticsWindow
+from window.series_picker import SeriesPickerDialog
+from worker import Worker
 
 
 class MainWindow(QWidget):
     def __init__(self, files: List[str] = []):
         super().__init__()
         self.state = State(self)
+        self.volume_cache = VolumeCache()
+        self.sessions = SessionManager(self.state, find_cached=self._find_cached, reload=self._reload_series)
+        self.sessions.clear_spill()
+        self.series_index = SeriesIndex()
+        self._worker: Worker = None
+        self._threshold_preview: region_grow.IncrementalRegionGrow = None
+        self._pyramid_worker: Worker = None
+        self._histogram_worker: Worker = None
+        self._evict_worker: Worker = None
+        # Series loading in the background and its session, opened when the first slice is decoded
+        self._load_worker: Worker = None
+        self._loading_series: SeriesState = None
+        self._preview_timer = QtCore.QTimer(self)
+        self._preview_timer.setSingleShot(True)
+        self._preview_timer.setInterval(200)
+        self._preview_timer.timeout.connect(self._preview_threshold)
         self.ui = UiForm(self)
 
         # pg.show(np.random.random([4, 5, 6]))
-        self.ui.action_file_open.triggered.connect(self.open_files)
+        self.ui.action_file_open.triggered.connect(lambda: self.open_files())
+        self.ui.action_file_open_directory.triggered.connect(lambda: self.open_directory())
+        self.ui.action_file_save_mask.triggered.connect(self._save_mask)
+        self.ui.action_file_load_mask.triggered.connect(self._load_mask)
+        self.ui.action_file_close_series.triggered.connect(self._close_series)
+        self.ui.combo_series.activated.connect(self._series_selected)
         self.ui.action_help_about.triggered.connect(self._show_about)
+        self.ui.action_help_diagnostics.triggered.connect(self._show_diagnostics)
+        self.ui.action_edit_undo.triggered.connect(self._undo)
+        self.ui.action_edit_redo.triggered.connect(self._redo)
         self.ui.btn_seed_select.clicked.connect(self._select_seed)
         self.ui.btn_run.clicked.connect(self._run)
+        self.ui.btn_cancel.clicked.connect(self._cancel_clicked)
         self.ui.btn_fine_tune.clicked.connect(self._fine_tune_clicked)
         self.ui.btn_erase.clicked.connect(self._btn_erase_clicked)
         self.ui.btn_fine_seg.clicked.connect(self._btn_fine_seg)
+        self.ui.btn_brush.clicked.connect(lambda: self._set_edit_mode(ViewMode.BRUSH))
+        self.ui.btn_polygon.clicked.connect(lambda: self._set_edit_mode(ViewMode.POLYGON))
+        self.ui.btn_view.clicked.connect(lambda: self._set_edit_mode(ViewMode.VIEW))
+        self.ui.spin_brush_radius.valueChanged.connect(self._brush_changed)
+        self.ui.check_erase.toggled.connect(self._brush_changed)
         self.ui.btn_test.clicked.connect(self._test_clicked)
         self.ui.combo_algorithm.currentTextChanged.connect(self._algorithm_changed)
         self.ui.threshold_slider.valueChanged.connect(self.threshold_slider_value_changed)
         self.state.overlayUpdated.connect(self._overlay_updated)
+        self.state.cursorChanged.connect(self._cursor_changed)
+        self.ui.image_viewer.roiChanged.connect(self._overlay_updated)
+        self.ui.spin_roi_radius.valueChanged.connect(lambda _: self._overlay_updated())
+        self.ui.btn_first_slice.clicked.connect(self._first_slice_clicked)
+        self.ui.btn_last_slice.clicked.connect(self._last_slice_clicked)
 
         if files:
             self._load_files(files)
@@ -58,6 +103,8 @@ class MainWindow(QWidget):
 
     @staticmethod
     def _create_seed_pixel(seed: Tuple[int, int, int]):
+        # The segmentation package is imported on first use, it is slow to import
+        from lymphangioma_segmentation.image import Pixel
         return Pixel(seed[1], seed[2], seed[0])
 
     def _set_algorithm_ui_mode(self, algorithm: Algorithm):
@@ -73,32 +120,117 @@ class MainWindow(QWidget):
     def _show_about(self):
         self._about = AboutWindow()
 
+    @Slot()
+    def _show_diagnostics(self):
+        self._diagnostics = DiagnosticsWindow()
+
     @Slot()
     def _overlay_updated(self):
         """
         Overlay updated, update the statistic data in the window
+        The statistics come from the overlay index, only the changed slices are scanned
         :return:
         """
-        # Display the result in the text_result(QTextBrowser)
-        num = self.state.overlay.sum()
+        if not self.state.has_volume or self.state.overlay is None:
+            return
+        region = self.state.get_overlay_statistics()
         # TODO sure every slice has the same thickness and spacing
         voxel_size = float(self.ui.input_voxel_size.text())
         result_text = f'分割已结束\n' \
-                      f'体素数目: {num / 1000:.2f}k\n' \
-                      f'体积：{num * voxel_size / 1000 : .2f}cm3'
+                      f'体素数目: {region.count / 1000:.2f}k\n' \
+                      f'体积：{region.count * voxel_size / 1000 : .2f}cm3'
+        if region.count:
+            z0, z1, x0, x1, y0, y1 = region.bbox
+            result_text += f'\n层范围: {z0} - {z1 - 1}\n' \
+                           f'包围盒: x {x0} - {x1 - 1}, y {y0} - {y1 - 1}\n' \
+                           f'重心: ({region.centroid[0]:.1f}, {region.centroid[1]:.1f}, {region.centroid[2]:.1f})\n' \
+                           f'灰度: {region.mean:.1f} ± {region.std:.1f}'
+        current = self.state.get_slice_statistics(self.state.cursor[0])
+        result_text += f'\n\n当前层({current.index}):\n面积: {current.area:.2f}mm2'
+        if current.count:
+            x0, x1, y0, y1 = current.bbox
+            result_text += f'\n包围盒: x {x0} - {x1 - 1}, y {y0} - {y1 - 1}\n' \
+                           f'重心: ({current.centroid[0]:.1f}, {current.centroid[1]:.1f})\n' \
+                           f'灰度: {current.mean:.1f} ± {current.std:.1f}'
+        box = self.ui.image_viewer.get_roi_box(self.ui.spin_roi_radius.value())
+        if box is not None:
+            roi = self.state.get_roi_statistics(box)
+            result_text += f'\n\n选区内:\n体素数目: {roi.count}\n体积: {roi.volume:.2f}mm3'
+            if roi.count:
+                result_text += f'\n灰度: {roi.mean:.1f} ± {roi.std:.1f}'
         self.ui.text_result.setText(result_text)
 
+    @Slot(tuple)
+    def _cursor_changed(self, cursor: Tuple[int, int, int]):
+        self._overlay_updated()
+
+    def _jump_to_slice(self, index: int):
+        if index < 0:
+            return
+        _, x, y = self.state.cursor
+        self.state.set_cursor((index, x, y))
+
+    @Slot()
+    def _first_slice_clicked(self):
+        if self.state.has_volume and self.state.overlay is not None:
+            self._jump_to_slice(self.state.overlay_index.first)
+
+    @Slot()
+    def _last_slice_clicked(self):
+        if self.state.has_volume and self.state.overlay is not None:
+            self._jump_to_slice(self.state.overlay_index.last)
+
+    @Slot()
+    def _undo(self):
+        if self.state.undo():
+            self.ui.image_viewer.refresh()
+
+    @Slot()
+    def _redo(self):
+        if self.state.redo():
+            self.ui.image_viewer.refresh()
+
     @Slot()
     def _btn_fine_seg(self):
-        self.ui.image_viewer.segment_roi(self.algorithm, self.threshold)
+        self.ui.image_viewer.segment_roi(self.algorithm, self.threshold, self.ui.spin_roi_radius.value())
 
     @Slot()
     def _btn_erase_clicked(self):
-        self.ui.image_viewer.erase_roi()
+        self.ui.image_viewer.erase_roi(self.ui.spin_roi_radius.value())
 
     @Slot(int)
     def threshold_slider_value_changed(self, value: int):
         self.ui.input_threshold.setText(str(value))
+        if self.ui.check_live_preview.isChecked():
+            # Debounce, only the last value is segmented
+            self._preview_timer.start()
+
+    @Slot()
+    @profiling.timed('preview_threshold')
+    def _preview_threshold(self):
+        """
+        Live preview of the threshold: the visible slice is estimated at once, then the whole volume
+        is segmented incrementally in the background
+        """
+        if Algorithm.BY_THRESHOLD != self.algorithm:
+            return
+        try:
+            seed = self.state.seed
+            volume = self.state.volume
+        except AssertionError:
+            return
+        preview = self._threshold_preview
+        if preview is None or preview.seed != seed or preview.volume is not volume:
+            preview = region_grow.IncrementalRegionGrow(volume, seed, self.ui.threshold_slider.minimum())
+            self._threshold_preview = preview
+        threshold = self.threshold
+
+        index = self.state.cursor[0]
+        self.ui.image_viewer.show_partial_overlay(index, preview.estimate_slice(index, threshold))
+
+        def task(worker: Worker):
+            return preview.grow(threshold)
+        self._start_segmentation(task)
 
     @Slot()
     def _algorithm_changed(self):
@@ -110,12 +242,21 @@ class MainWindow(QWidget):
         # TODO need to be commented
         pass
 
+    def _set_edit_mode(self, mode: ViewMode):
+        self._brush_changed()
+        self.ui.image_viewer.set_view_mode(mode)
+
+    @Slot()
+    def _brush_changed(self):
+        self.ui.image_viewer.set_brush(self.ui.spin_brush_radius.value(), self.ui.check_erase.isChecked())
+
     @Slot()
     def _fine_tune_clicked(self):
         # TODO get ROI in the image_viewer
         self.ui.image_viewer.set_view_mode(ViewMode.ROI_SELECTION)
 
     @Slot()
+    @profiling.timed('run')
     def _run(self):
         try:
             seed_ = self.state.seed
@@ -131,60 +272,130 @@ class MainWindow(QWidget):
 
         algorithm = Algorithm(self.ui.combo_algorithm.currentText())
         if Algorithm.GROW_EVERY_SLICE == algorithm:
-            overlay, _, _ = segmentation.grow_by_every_slice(seed, volume, ratio=3, min_iter=5)
+            from lymphangioma_segmentation import segmentation
+
+            def task(worker: Worker):
+                # A lazy volume is decoded in the worker thread
+                overlay, _, _ = segmentation.grow_by_every_slice(seed, np.ascontiguousarray(volume),
+                                                                 ratio=3, min_iter=5)
+                return overlay
             self.ui.text_result.setText(f'Running, seed: {seed_}, shape: {volume.shape}')
         elif Algorithm.BY_THRESHOLD == algorithm:
             threshold = self.threshold
-            overlay = segmentation.region_grow_3d(volume, seed, threshold)
+
+            factors = self.state.pyramid_factors
+            if self.ui.check_coarse_preview.isChecked() and factors:
+                factor = factors[-1]
+                level = self.state.get_level(factor)
+                index = self.state.cursor[0]
+
+                def task(worker: Worker):
+                    def show_coarse(mask: np.ndarray):
+                        worker.check_cancelled()
+                        worker.progress(1, 2)
+                        worker.partial(index, mask[index].astype(np.int8))
+                    return pyramid.coarse_to_fine_grow(volume, level, factor, seed_, threshold,
+                                                       coarse_callback=show_coarse)
+            else:
+                index = self.state.cursor[0]
+
+                def task(worker: Worker):
+                    # The visible slice is estimated in 2D while the volume is labelled
+                    worker.partial(index, region_grow.estimate_slice_2d(volume[index], seed_[1:], threshold))
+
+                    def progress(finished: int, total: int):
+                        worker.check_cancelled()
+                        worker.progress(finished, total)
+                    return region_grow.region_grow(volume, seed_, threshold, progress=progress)
             self.ui.text_result.setText(f'Running, seed: {seed_}, threshold: {threshold}, shape: {volume.shape}')
         else:
             raise NotImplementedError
 
+        self._start_segmentation(task)
+
+    def _start_segmentation(self, task):
+        """
+        Run the segmentation task in the background, the previous one is cancelled
+        :param task: fn(worker) -> overlay
+        :return:
+        """
+        if self._worker is not None:
+            self._worker.cancel()
+        def timed_task(worker: Worker):
+            with profiling.span('segmentation'):
+                return task(worker)
+        worker = Worker(timed_task)
+        worker.signals.progress.connect(self._segmentation_progress)
+        worker.signals.partial.connect(self.ui.image_viewer.show_partial_overlay)
+        worker.signals.finished.connect(lambda overlay: self._segmentation_finished(worker, overlay))
+        worker.signals.failed.connect(lambda msg: self._segmentation_stopped(worker, f'分割失败：{msg}'))
+        worker.signals.cancelled.connect(lambda: self._segmentation_stopped(worker, '分割已取消'))
+        self._worker = worker
+        self._set_running(True)
+        worker.start()
+
+    def _set_running(self, running: bool):
+        self.ui.btn_run.setEnabled(not running)
+        self.ui.btn_cancel.setEnabled(running)
+        self.ui.progress_bar.setVisible(running)
+        # Busy indicator until the task reports the progress
+        self.ui.progress_bar.setRange(0, 0)
+
+    @Slot(int, int)
+    def _segmentation_progress(self, finished: int, total: int):
+        self.ui.progress_bar.setRange(0, total)
+        self.ui.progress_bar.setValue(finished)
+
+    def _segmentation_finished(self, worker: Worker, overlay: np.ndarray):
+        if worker is not self._worker:
+            return
+        self._worker = None
+        self._set_running(False)
+        self.ui.image_viewer.clear_partial_overlay()
+
         self.state.set_overlay(overlay)
 
         self.ui.image_viewer.refresh()
         # QMessageBox.information(self, '完成', f'定量计算已完成')
         self._overlay_updated()
 
+    def _segmentation_stopped(self, worker: Worker, msg: str):
+        if worker is not self._worker:
+            return
+        self._worker = None
+        self._set_running(False)
+        self.ui.image_viewer.clear_partial_overlay()
+        self.ui.image_viewer.refresh()
+        self.ui.text_result.setText(msg)
+
+    @Slot()
+    def _cancel_clicked(self):
+        if self._worker is not None:
+            self._worker.cancel()
+
     @Slot()
     def _select_seed(self):
         self.ui.image_viewer.set_view_mode(ViewMode.PIXEL_SELECTION)
         self.ui.image_viewer.pixelSelected.connect(self._pixel_selected)
 
     @Slot(tuple, float)
+    @profiling.timed('pixel_selected')
     def _pixel_selected(self, pos: Tuple[int, int, int], value):
         index, x, y = pos
 
         self.state.set_seed(pos)
         self.ui.input_seed.setText(f'({index}, {x}, {y}), {value:.1f}')
 
-        # compute the threshold
-        seed_pixel = self._create_seed_pixel(self.state.seed)
-        volume = self.state.volume
-
-        def get_reference_intensity():
-            neighbors = seed_pixel.get_26_neighborhood_3d(volume)
-            value_arr = []
-            for s in neighbors:
-                value_arr.append(s.get_pixel_3d(volume))
-            return np.array(value_arr).mean()
-
         algorithm = Algorithm(self.ui.combo_algorithm.currentText())
         if Algorithm.BY_THRESHOLD == algorithm:
+            # compute the threshold in a small window around the seed
+            stats = statistics.estimate_region_statistics(self.state.volume, self.state.seed)
+            threshold = stats.threshold
 
-            reference_intensity = get_reference_intensity()
-            slice_ = seed_pixel.get_slice(volume)
-            threshold, _ = segmentation.get_optimized_threshold(slice_, seed_pixel, reference_intensity, 1.1)
-
-            _, mean, std = segmentation.grow_by_every_slice(seed_pixel, volume, 3)
-            threshold = mean - std * 1.5
-
-            # threshold = mean - std
-            # threshold = mean
             self.ui.input_threshold.setText(f'{threshold:.1f}')
             self.ui.threshold_slider.setEnabled(True)
-            self.ui.threshold_slider.setRange(mean - 3 * std, mean + 3 * std)
-            self.ui.threshold_slider.setValue(threshold)
+            self.ui.threshold_slider.setRange(int(math.floor(stats.low)), int(math.ceil(stats.high)))
+            self.ui.threshold_slider.setValue(int(round(threshold)))
         elif algorithm == Algorithm.GROW_EVERY_SLICE:
             self.ui.threshold_slider.setEnabled(False)
             pass
@@ -194,52 +405,409 @@ class MainWindow(QWidget):
         self.ui.image_viewer.pixelSelected.disconnect(self._pixel_selected)
 
     def _display_images(self, volume: np.ndarray, files: List[str]):
-        # Clear the overlay
-        self.ui.image_viewer.clear_overlay()
+        # Clear the overlay and the rendered slices
+        self.ui.image_viewer.reset_display()
 
         self.ui.image_viewer.refresh()
 
+    @profiling.timed('load_files')
     def _load_files(self, files: List[str]):
         """
-        Load DICOM files
+        Load DICOM files, the series is shown as soon as its middle slice is decoded and the rest is
+        decoded in the background. A series still loading is closed.
         :param files:
         :return:
         """
-        state = self.state
-
+        self._cancel_loading()
         test_file = files[0]
         if test_file.endswith('.jpg'):
             # If jpg files got
             for file in files:
                 assert file.endswith('.jpg')
+            from lymphangioma_segmentation import image
             files, volume = image.load_jpg_series(files)
-            voxel_size = 0
-        else:
-            # or DCM files
-            try:
-                files, volume = image.load_dcm_series(files)
-                # np.save('test2.npy', volume)
-                voxel_size = image.get_voxel_size(files[0])
-            except image.DcmLoadingException:
-                # TODO show error box
-                return
+            histogram = VolumeHistogram.for_dtype(len(files), volume.dtype) if volume.dtype.kind in 'iu' else None
+            self._open_series(files, volume, (0., 0., 0.), histogram)
+            self._build_pyramid(volume)
+            self._build_histogram(volume, histogram)
+            return
 
+        # or DCM files
+        loader = dicom.SeriesLoader(files, cache=self.volume_cache, lazy_threshold=LAZY_VOLUME_MIN_BYTES)
+
+        def task(worker: Worker):
+            with profiling.span('load_series', files=len(files)):
+                loader.prepare()
+                worker.check_cancelled()
+                step = max(1, len(loader.files) // 50)
+                shown = [False]
+
+                def progress(finished: int, total: int):
+                    start, stop = loader.loaded
+                    if start < stop and (not shown[0] or finished % step == 0 or finished == total):
+                        shown[0] = True
+                        worker.progress(finished, total)
+                loader.decode(progress, worker.check_cancelled)
+            return loader
+        worker = Worker(task)
+        worker.signals.progress.connect(lambda finished, total: self._loading_progress(worker, loader, finished, total))
+        worker.signals.finished.connect(lambda _: self._loading_finished(worker, loader))
+        worker.signals.failed.connect(lambda msg: self._loading_stopped(worker, f'图像加载失败。{msg}'))
+        worker.signals.cancelled.connect(lambda: self._loading_stopped(worker, None))
+        self._load_worker = worker
+        self._loading_series = None
+        self._set_loading(True)
+        worker.start()
+
+    def _open_series(self, files: List[str], volume: np.ndarray, spacing: Tuple[float, float, float],
+                     histogram: Optional[VolumeHistogram], loaded: Tuple[int, int] = None):
+        """
+        Open the series and show it, the previous series stays open
+        :param loaded: (start, stop) of the slices decoded, all by default
+        """
+        self._detach_series()
         # state.set_voxel_size(voxel_size)
+        voxel_size = spacing[0] * spacing[1] * spacing[2]
         self.ui.input_voxel_size.setText(str(voxel_size))
-        state.set_volume(volume, files)
-        state.set_overlay(np.zeros(volume.shape, np.int8))
+        self.ui.input_seed.clear()
+        self.ui.threshold_slider.setEnabled(False)
+        series = self.sessions.open(files, volume, spacing, histogram)
+        if loaded is not None:
+            self.state.set_loaded_slices(volume, *loaded)
 
         self._display_images(volume, files)
+        self._update_series_combo()
+        self._evict_sessions()
+        return series
+
+    def _loading_progress(self, worker: Worker, loader: dicom.SeriesLoader, finished: int, total: int):
+        if worker is not self._load_worker:
+            return
+        if self._loading_series is None:
+            # The middle slice is decoded
+            self._loading_series = self._open_series(loader.files, loader.volume, loader.spacing,
+                                                     loader.histogram, loader.loaded)
+        else:
+            self.state.set_loaded_slices(loader.volume, *loader.loaded)
+            self.ui.image_viewer.update_loaded()
+        self.ui.progress_bar.setRange(0, total)
+        self.ui.progress_bar.setValue(finished)
+
+    def _loading_finished(self, worker: Worker, loader: dicom.SeriesLoader):
+        if worker is not self._load_worker:
+            return
+        self._load_worker = None
+        volume = loader.volume
+        if self._loading_series is None:
+            # A cached or a lazy volume, nothing was decoded in advance
+            self._open_series(loader.files, volume, loader.spacing, loader.histogram)
+        else:
+            self.state.set_loaded_slices(volume, 0, volume.shape[0])
+            self.state.set_histogram(volume, loader.histogram)
+            self.ui.image_viewer.update_loaded()
+        self._loading_series = None
+        self._set_loading(False)
+        self._build_pyramid(volume)
+        self._build_histogram(volume, loader.histogram)
+
+    def _loading_stopped(self, worker: Worker, msg: Optional[str]):
+        if worker is not self._load_worker:
+            return
+        self._load_worker = None
+        self._close_loading_series()
+        self._set_loading(False)
+        if msg is not None:
+            QMessageBox.warning(self, '警告', msg)
+
+    def _cancel_loading(self):
+        """
+        Stop the series loading in the background and close it
+        """
+        if self._load_worker is None:
+            return
+        self._load_worker.cancel()
+        self._load_worker = None
+        self._close_loading_series()
+        self._set_loading(False)
+
+    def _close_loading_series(self):
+        series, self._loading_series = self._loading_series, None
+        if series is None or series.key not in {s.key for s in self.sessions.series}:
+            return
+        if series is self.sessions.active:
+            self._close_series()
+        else:
+            self.sessions.close(series.key)
+            self._update_series_combo()
+
+    def _set_loading(self, loading: bool):
+        """
+        The segmentation needs the whole volume, it is enabled when the volume is loaded
+        """
+        for widget in (self.ui.btn_seed_select, self.ui.btn_run, self.ui.btn_fine_tune, self.ui.btn_fine_seg,
+                       self.ui.combo_series, self.ui.action_file_close_series):
+            widget.setEnabled(not loading)
+        self.ui.progress_bar.setVisible(loading)
+        # Busy indicator until the middle slice is decoded
+        self.ui.progress_bar.setRange(0, 0)
+
+    def _find_cached(self, files: List[str]):
+        """
+        The memory-mapped volume in the cache, an inactive series is switched to it instead of being spilled
+        """
+        if files[0].endswith('.jpg'):
+            return None
+        cached = self.volume_cache.get(files)
+        return cached[1] if cached is not None else None
+
+    def _reload_series(self, files: List[str]) -> np.ndarray:
+        """
+        Decode the volume of a series dropped from memory
+        """
+        if files[0].endswith('.jpg'):
+            from lymphangioma_segmentation import image
+            return image.load_jpg_series(files)[1]
+        return dicom.load_series(files, cache=self.volume_cache, lazy_threshold=LAZY_VOLUME_MIN_BYTES)[1]
+
+    def _detach_series(self):
+        """
+        Keep the values of the widgets in the active series and stop the tasks of its volume
+        """
+        series = self.sessions.active
+        if series is None:
+            return
+        if self._worker is not None:
+            self._worker.cancel()
+            self._worker = None
+            if self._load_worker is None:
+                self._set_running(False)
+                self.ui.progress_bar.setVisible(False)
+            else:
+                # Detached by the series loading, the buttons and the progress bar are left to _set_loading
+                self.ui.btn_cancel.setEnabled(False)
+        self._preview_timer.stop()
+        self._threshold_preview = None
+        slider = self.ui.threshold_slider
+        series.extras = {
+            'algorithm': self.ui.combo_algorithm.currentText(),
+            'seed': self.ui.input_seed.text(),
+            'threshold': self.ui.input_threshold.text(),
+            'voxel_size': self.ui.input_voxel_size.text(),
+            'slider': (slider.isEnabled(), slider.minimum(), slider.maximum(), slider.value()),
+        }
+
+    def _restore_series_ui(self, extras: dict):
+        if not extras:
+            return
+        self.ui.combo_algorithm.setCurrentText(extras['algorithm'])
+        self.ui.input_seed.setText(extras['seed'])
+        self.ui.input_voxel_size.setText(extras['voxel_size'])
+        enabled, low, high, value = extras['slider']
+        slider = self.ui.threshold_slider
+        # The text of the threshold is set after the slider, valueChanged overwrites it
+        slider.blockSignals(True)
+        slider.setRange(low, high)
+        slider.setValue(value)
+        slider.blockSignals(False)
+        slider.setEnabled(enabled)
+        self.ui.input_threshold.setText(extras['threshold'])
+
+    def _update_series_combo(self):
+        combo = self.ui.combo_series
+        combo.clear()
+        for series in self.sessions.series:
+            combo.addItem(series.name, series.key)
+        active = self.sessions.active
+        if active is not None:
+            combo.setCurrentIndex(combo.findData(active.key))
+
+    @Slot(int)
+    @profiling.timed('switch_series')
+    def _series_selected(self, index: int):
+        """
+        Switch to another open series, the volume, overlay and history are attached as they are
+        """
+        key = self.ui.combo_series.itemData(index)
+        active = self.sessions.active
+        if active is None or key == active.key:
+            return
+        self._detach_series()
+        try:
+            series = self.sessions.activate(key)
+        except dicom.DcmLoadingException as e:
+            QMessageBox.warning(self, '警告', f'图像加载失败。{e}')
+            self._update_series_combo()
+            return
+        self._show_series(series.extras)
+
+    def _show_series(self, extras: dict):
+        self._restore_series_ui(extras)
+        volume = self.state.volume
+        self._display_images(volume, self.state.dcm_files)
+        if not self.state.pyramid_factors:
+            self._build_pyramid(volume)
+        self._build_histogram(volume, self.state.histogram)
+        self._update_series_combo()
+        self._overlay_updated()
+        self._evict_sessions()
+
+    def _evict_sessions(self):
+        """
+        Release the volumes of the inactive series in the background, a volume may be copied to disk
+        """
+        self._evict_worker = Worker(lambda worker: self.sessions.evict()).start()
+
+    @Slot()
+    def _close_series(self):
+        active = self.sessions.active
+        if active is None:
+            return
+        self._detach_series()
+        series = self.sessions.close(active.key)
+        if series is not None:
+            self._show_series(series.extras)
+        else:
+            self.ui.image_viewer.reset_display()
+            self.ui.text_result.clear()
+            self._update_series_combo()
+
+    def _build_pyramid(self, volume: np.ndarray):
+        """
+        Build the downsampled levels in the background
+        """
+        if self._pyramid_worker is not None:
+            self._pyramid_worker.cancel()
+        if not isinstance(volume, np.ndarray):
+            # A lazy volume would be decoded entirely
+            return
+
+        def task(worker: Worker):
+            with profiling.span('build_pyramid'):
+                return pyramid.build_pyramid(volume, PYRAMID_FACTORS, lambda *_: worker.check_cancelled())
+        worker = Worker(task)
+        worker.signals.finished.connect(lambda levels: self.state.set_pyramid(volume, levels))
+        self._pyramid_worker = worker.start()
+
+    def _create_progress_dialog(self, text: str, total: int) -> QProgressDialog:
+        dialog = QProgressDialog(text, '', 0, total, self)
+        dialog.setCancelButton(None)
+        dialog.setWindowModality(QtCore.Qt.WindowModal)
+        dialog.setMinimumDuration(500)
+        return dialog
+
+    @Slot()
+    def _save_mask(self):
+        """
+        Save the segmentation as NIfTI, NRRD or DICOM-SEG
+        """
+        if not self.state.has_volume or self.state.overlay is None:
+            QMessageBox.warning(self, '警告', '没有可保存的分割结果')
+            return
+        path, _ = QFileDialog.getSaveFileName(self, '保存分割', 'mask.nii.gz', ';;'.join(mask_io.FORMATS))
+        if not path:
+            return
+        # The entries of the overlay are immutable, a copy of the table is a snapshot
+        overlay = SparseOverlay(self.state.overlay.shape)
+        overlay.set_entries(self.state.overlay.get_entries())
+        progress_dialog = self._create_progress_dialog('正在保存分割...', overlay.shape[0])
+
+        def progress(finished: int, total: int):
+            progress_dialog.setValue(finished)
+            QApplication.processEvents()
+
+        try:
+            mask_io.save_mask(path, overlay, self.state.spacing, self.state.dcm_files, progress)
+        except (mask_io.MaskFormatException, dicom.DcmLoadingException, OSError) as e:
+            QMessageBox.warning(self, '警告', f'分割保存失败。{e}')
+        finally:
+            progress_dialog.close()
 
     @Slot()
-    def open_files(self):
+    def _load_mask(self):
+        """
+        Load a segmentation on the grid of the current volume, it can be undone
+        """
+        if not self.state.has_volume:
+            QMessageBox.warning(self, '警告', '请先加载图像')
+            return
+        path, _ = QFileDialog.getOpenFileName(self, '加载分割', '', ';;'.join(mask_io.FORMATS))
+        if not path:
+            return
+        progress_dialog = self._create_progress_dialog('正在加载分割...', self.state.volume.shape[0])
+
+        def progress(finished: int, total: int):
+            progress_dialog.setMaximum(total)
+            progress_dialog.setValue(finished)
+            QApplication.processEvents()
+
+        try:
+            overlay = mask_io.load_mask(path, self.state.volume.shape, self.state.dcm_files, progress)
+        except (mask_io.MaskFormatException, dicom.DcmLoadingException) as e:
+            QMessageBox.warning(self, '警告', f'分割加载失败。{e}')
+            return
+        finally:
+            progress_dialog.close()
+        self.state.set_overlay(overlay)
+        self.ui.image_viewer.refresh()
+        self._overlay_updated()
+
+    def _build_histogram(self, volume: np.ndarray, histogram: VolumeHistogram):
+        """
+        Fill the histogram not computed while loading(a lazy volume) in the background,
+        the widgets are updated while it grows
+        """
+        if self._histogram_worker is not None:
+            self._histogram_worker.cancel()
+        if histogram is None or histogram.done:
+            return
+
+        def task(worker: Worker):
+            total = volume.shape[0]
+            # Interleaved, the partial histogram is a sample of the whole volume
+            stride = 8
+            indices = [i for offset in range(stride) for i in range(offset, total, stride)]
+            for finished, index in enumerate(indices, 1):
+                worker.check_cancelled()
+                histogram.add_slice(index, np.asarray(volume[index]))
+                if finished % 16 == 0:
+                    worker.progress(finished, total)
+            return histogram
+        worker = Worker(task)
+        worker.signals.progress.connect(lambda *_: self.state.set_histogram(volume, histogram))
+        worker.signals.finished.connect(lambda _: self.state.set_histogram(volume, histogram))
+        self._histogram_worker = worker.start()
+
+    def open_files(self, files: List[str] = None):
         """
-        This is the test function,
+        Open the files, a series is picked if they mix several series
+        :param files: asked if not given
         :return:
         """
-        files, _ = QFileDialog.getOpenFileNames()
-        if files:
+        files = files or QFileDialog.getOpenFileNames()[0]
+        if not files:
+            return
+        if files[0].endswith('.jpg'):
             self._load_files(files)
+        else:
+            self._pick_series(files=files)
+
+    def open_directory(self, root: str = None):
+        """
+        Scan the directory tree and open a series of it
+        :param root: asked if not given
+        """
+        root = root or QFileDialog.getExistingDirectory(self, '打开文件夹')
+        if root:
+            self._pick_series(root=root)
+
+    def _pick_series(self, root: str = None, files: List[str] = None):
+        dialog = SeriesPickerDialog(self.series_index, root, files, self)
+        accepted = dialog.exec_() == QDialog.Accepted
+        series = dialog.selected_series
+        # The dialog is a child of the window, it would be kept with its table until the window is closed
+        dialog.deleteLater()
+        if accepted and series is not None:
+            self._load_files(series.files)
 
 
 class UiForm:
@@ -247,14 +815,36 @@ class UiForm:
         self.menu_bar = QMenuBar(form)
 
         self.menu_file = QMenu('文件')
+        self.menu_edit = QMenu('编辑')
         self.menu_help = QMenu('帮助')
         self.menu_bar.addMenu(self.menu_file)
+        self.menu_bar.addMenu(self.menu_edit)
         self.menu_bar.addMenu(self.menu_help)
         self.action_file_open = QAction('打开')
+        self.action_file_open_directory = QAction('打开文件夹...')
+        self.action_file_save_mask = QAction('保存分割...')
+        self.action_file_load_mask = QAction('加载分割...')
+        self.action_file_close_series = QAction('关闭序列')
         self.action_help_about = QAction('关于')
+        self.action_help_diagnostics = QAction('诊断')
+        self.action_edit_undo = QAction('撤销')
+        self.action_edit_undo.setShortcut(QKeySequence.Undo)
+        self.action_edit_redo = QAction('重做')
+        self.action_edit_redo.setShortcut(QKeySequence.Redo)
         # menu = QMenu('文件')
         self.menu_file.addAction(self.action_file_open)
+        self.menu_file.addAction(self.action_file_open_directory)
+        self.menu_file.addAction(self.action_file_close_series)
+        self.menu_file.addSeparator()
+        self.menu_file.addAction(self.action_file_save_mask)
+        self.menu_file.addAction(self.action_file_load_mask)
         self.menu_help.addAction(self.action_help_about)
+        self.menu_help.addAction(self.action_help_diagnostics)
+        self.menu_edit.addAction(self.action_edit_undo)
+        self.menu_edit.addAction(self.action_edit_redo)
+        # The shortcuts work when the actions belong to the window
+        form.addAction(self.action_edit_undo)
+        form.addAction(self.action_edit_redo)
 
         #
         self.root_layout = QtWidgets.QVBoxLayout()
@@ -264,6 +854,10 @@ class UiForm:
         self.left_result = QtWidgets.QVBoxLayout()
         self.right_layout = QtWidgets.QVBoxLayout()
         self.fine_tune_layout = QtWidgets.QHBoxLayout()
+        self.run_layout = QtWidgets.QHBoxLayout()
+
+        # 已打开的序列 | the open series
+        self.combo_series = QComboBox()
 
         # 操作按钮
         self.btn_seed_select = QPushButton('选择种子点')
@@ -278,19 +872,45 @@ class UiForm:
         self.input_voxel_size = QLineEdit('')
         self.threshold_slider = QSlider(QtCore.Qt.Horizontal)
         self.threshold_slider.setEnabled(False)
+        self.check_live_preview = QCheckBox('实时预览')
+        self.check_coarse_preview = QCheckBox('快速预览（低分辨率分割后细化边界）')
 
         self.btn_run = QPushButton('运行')
+        self.btn_cancel = QPushButton('取消')
+        self.btn_cancel.setEnabled(False)
+        self.progress_bar = QProgressBar()
+        self.progress_bar.setVisible(False)
         self.btn_fine_tune = QPushButton('选择区域微调')
         self.btn_erase = QPushButton('擦除')
         self.btn_fine_seg = QPushButton('分割')
+        # The ROI edits apply to the slices within the radius of the current one
+        self.spin_roi_radius = QSpinBox()
+        self.spin_roi_radius.setRange(0, 999)
+        self.spin_roi_radius.setPrefix('前后 ')
+        self.spin_roi_radius.setSuffix(' 层')
         self.btn_test = QPushButton('测试')
+        # 手动编辑 | manual editing: brush and polygon
+        self.edit_layout = QtWidgets.QHBoxLayout()
+        self.btn_brush = QPushButton('画笔')
+        self.btn_polygon = QPushButton('多边形')
+        self.btn_polygon.setToolTip('单击添加顶点，双击闭合并填充')
+        self.btn_view = QPushButton('结束编辑')
+        self.spin_brush_radius = QSpinBox()
+        self.spin_brush_radius.setRange(0, 200)
+        self.spin_brush_radius.setValue(5)
+        self.spin_brush_radius.setPrefix('半径 ')
+        self.check_erase = QCheckBox('擦除')
         self.text_result = QTextBrowser()
+        self.result_layout = QtWidgets.QHBoxLayout()
+        self.btn_first_slice = QPushButton('第一层')
+        self.btn_last_slice = QPushButton('最后一层')
 
         #
-        self.image_viewer = MivImageView(form.state)
-        self.histogram_LUT = MivHistogramLUTWidget(self.image_viewer.ui.image_item)
+        self.image_viewer = MivMprView(form.state)
+        self.histogram_LUT = MivHistogramLUTWidget(self.image_viewer)
 
         #
+        self.left_form.addRow('序列', self.combo_series)
         self.left_form.addRow('显示模式', self.image_viewer.ui.view_mode_selector)
         self.left_form.addRow(self.btn_seed_select, self.input_seed)
         self.left_form.addRow('分割算法', self.combo_algorithm)
@@ -300,17 +920,32 @@ class UiForm:
         self.root_layout.addWidget(self.menu_bar)
         self.right_layout.addWidget(self.image_viewer)
         self.left_result.addWidget(self.threshold_slider)
-        self.left_result.addWidget(self.btn_run)
+        self.left_result.addWidget(self.check_live_preview)
+        self.left_result.addWidget(self.check_coarse_preview)
+        self.left_result.addLayout(self.run_layout)
+        self.run_layout.addWidget(self.btn_run)
+        self.run_layout.addWidget(self.btn_cancel)
+        self.left_result.addWidget(self.progress_bar)
         self.left_result.addWidget(self.btn_fine_tune)
 
         self.left_result.addLayout(self.fine_tune_layout)
         self.fine_tune_layout.addWidget(self.btn_erase)
         self.fine_tune_layout.addWidget(self.btn_fine_seg)
+        self.fine_tune_layout.addWidget(self.spin_roi_radius)
+        self.left_result.addLayout(self.edit_layout)
+        self.edit_layout.addWidget(self.btn_brush)
+        self.edit_layout.addWidget(self.btn_polygon)
+        self.edit_layout.addWidget(self.spin_brush_radius)
+        self.edit_layout.addWidget(self.check_erase)
+        self.edit_layout.addWidget(self.btn_view)
 
         # 测试按钮
         # self.left_result.addWidget(self.btn_test)
         self.left_result.addWidget(QLabel('计算结果'))
         self.left_result.addWidget(self.text_result)
+        self.left_result.addLayout(self.result_layout)
+        self.result_layout.addWidget(self.btn_first_slice)
+        self.result_layout.addWidget(self.btn_last_slice)
 
         self.main_layout.addLayout(self.left_layout, 2)
         self.left_layout.addLayout(self.left_form)
@@ -333,20 +968,20 @@ if __name__ == '__main__':
     import sys
     import os
 
-    # config_log()
+    if PROFILE_ENABLED:
+        config_log()
     app = QtWidgets.QApplication([])
 
-    dcm_files = []
-    if len(sys.argv) > 1:
-        dcm_dir = sys.argv[1]
-        dcm_files = os.listdir(dcm_dir)
-        for i in range(len(dcm_files)):
-            dcm_files[i] = os.path.join(dcm_dir, dcm_files[i])
-
-    widget = MainWindow(files=dcm_files)
+    widget = MainWindow()
 
     widget.resize(1000, 600)
     widget.setWindowTitle('medical-image-viewer')
     widget.show()
+    if len(sys.argv) > 1:
+        # A directory may mix several series, one of them is picked
+        if os.path.isdir(sys.argv[1]):
+            widget.open_directory(sys.argv[1])
+        else:
+            widget.open_files(sys.argv[1:])
 
     sys.exit(app.exec_())
@@ -0,0 +1,34 @@
+"""
+@Author: Daryl.Xu <ziqiang_xu@qq.com>
+"""
+from typing import Tuple
+
+from PySide2 import QtCore
+from PySide2.QtCore import QObject
+
+from store import Store
+
+
+class State(QObject, Store):
+    """
+    共享
+    The store with Qt signals
+    """
+    # signals
+    overlayUpdated = QtCore.Signal()
+    # (slice, x, y) of the crosshair
+    cursorChanged = QtCore.Signal(tuple)
+    histogramChanged = QtCore.Signal()
+
+    def __init__(self, parent: QObject = None):
+        QObject.__init__(self, parent)
+        Store.__init__(self)
+
+    def on_overlay_updated(self):
+        self.overlayUpdated.emit()
+
+    def on_cursor_changed(self, cursor: Tuple[int, int, int]):
+        self.cursorChanged.emit(cursor)
+
+    def on_histogram_changed(self):
+        self.histogramChanged.emit()
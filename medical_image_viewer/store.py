@@ -3,13 +3,21 @@
 """
 import os
 from enum import unique, Enum
-from typing import List, Tuple
+from typing import List, Tuple, Dict, Optional, TYPE_CHECKING
 
 import numpy as np
-from PySide2 import QtCore
-from PySide2.QtCore import QObject
 
-from lymphangioma_segmentation.image import Pixel
+from constant import OVERLAY_HISTORY_MAX_BYTES
+from utils import plane as plane_
+from utils.histogram import VolumeHistogram
+from utils.history import OverlayHistory, RegionEdit, SlicesEdit, CompositeEdit
+from utils.overlay import SparseOverlay
+from utils.overlay_index import OverlayIndex, RegionStatistics, SliceStatistics
+from utils.plane import Plane
+
+if TYPE_CHECKING:
+    from lymphangioma_segmentation.image import Pixel
+    from utils.session import SeriesState
 
 
 @unique
@@ -18,23 +26,37 @@ class UpdateMode(Enum):
     OVER_WRITE = 0
     # 新增
     APPEND = 1
+    # 擦除，清除块中为真的位置 | clear where the block is set
+    ERASE = 2
 
 
-class State(QObject):
+class Store:
     """
-    共享
+    共享数据，不依赖Qt
+    The shared data without Qt, used by the viewer (through state.State) and the headless tools.
+    Subclasses override the on_* methods to get notified.
     """
-    # signals
-    overlayUpdated = QtCore.Signal()
-
-    def __init__(self, parent: QObject):
-        super().__init__(parent)
+    def __init__(self):
         self.name = 'state'
         self._dcm_files: List[str] = []
         self._volume: np.ndarray = None
-        self._overlay: np.ndarray = None
+        self._overlay: SparseOverlay = None
         self._seed: Tuple[int, int, int] = None
         self._voxel_size = 0
+        self.history = OverlayHistory(OVERLAY_HISTORY_MAX_BYTES)
+        # (slice, x, y) in mm
+        self._spacing: Tuple[float, float, float] = (1., 1., 1.)
+        self._cursor: Tuple[int, int, int] = (0, 0, 0)
+        # {factor: downsampled volume}
+        self._pyramid: Dict[int, np.ndarray] = {}
+        # Min/max of the slices and the histogram of the volume, None if not computed
+        self._histogram: VolumeHistogram = None
+        # Per-slice statistics of the overlay, synchronized lazily with the versions of the slices
+        self._overlay_index: OverlayIndex = None
+        # Edits of the running stroke, recorded as one step of the history when it ends
+        self._stroke: List = None
+        # (start, stop) of the slices decoded, the volume is still filled in the background if not all
+        self._loaded_slices: Tuple[int, int] = (0, 0)
 
     @property
     def voxel_size(self):
@@ -47,6 +69,40 @@ class State(QObject):
         # TODO 移除本行代码
         raise BaseException('暂时不将本属性存储在store中')
 
+    @property
+    def spacing(self) -> Tuple[float, float, float]:
+        return self._spacing
+
+    def set_spacing(self, spacing: Tuple[float, float, float]):
+        """
+        :param spacing: (slice, x, y) in mm
+        """
+        self._spacing = tuple(float(v) for v in spacing)
+
+    @property
+    def cursor(self) -> Tuple[int, int, int]:
+        return self._cursor
+
+    def set_cursor(self, cursor: Tuple[int, int, int]):
+        """
+        Move the crosshair shared by the planes
+        :param cursor: (slice, x, y)
+        """
+        cursor = tuple(int(v) for v in cursor)
+        if cursor == self._cursor:
+            return
+        self._cursor = cursor
+        self.on_cursor_changed(cursor)
+
+    def on_cursor_changed(self, cursor: Tuple[int, int, int]):
+        pass
+
+    def on_overlay_updated(self):
+        pass
+
+    def on_histogram_changed(self):
+        pass
+
     @property
     def dcm_files(self):
         assert self._dcm_files
@@ -66,47 +122,261 @@ class State(QObject):
         assert self._volume is not None
         return self._volume
 
+    @property
+    def has_volume(self) -> bool:
+        return self._volume is not None
+
+    @property
+    def volume_array(self) -> np.ndarray:
+        """
+        The volume as a contiguous array, a lazy volume is decoded entirely.
+        Use it for the segmentation algorithms.
+        """
+        return np.ascontiguousarray(self.volume)
+
     def set_volume(self, volume: np.ndarray, dcm_files: List):
         """
-        :param volume:
+        :param volume: np.ndarray, np.memmap or LazyVolume
         :param dcm_files: DICOM files sorted by the acquire position
         :return:
         """
         assert volume.ndim == 3 and volume.shape[0] == len(dcm_files)
         self._volume = volume
         self._dcm_files = dcm_files
+        self._overlay = None
+        # The history of the previous volume may be kept by its series
+        self.history = OverlayHistory(OVERLAY_HISTORY_MAX_BYTES)
+        self._cursor = tuple(n // 2 for n in volume.shape)
+        self._pyramid = {}
+        self._histogram = None
+        self._overlay_index = OverlayIndex(volume.shape[0])
+        self._loaded_slices = (0, volume.shape[0])
+        # The history of the stroke is gone with the previous volume
+        self._stroke = None
+
+    def detach_series(self, series: 'SeriesState'):
+        """
+        Save the data of the current volume into its series, the store keeps it until another series is attached
+        """
+        # A stroke not ended belongs to the history of the series
+        self.end_stroke()
+        series.files, series.volume, series.spacing = self._dcm_files, self._volume, self._spacing
+        series.overlay, series.history, series.seed = self._overlay, self.history, self._seed
+        series.cursor, series.pyramid, series.histogram = self._cursor, self._pyramid, self._histogram
+        series.overlay_index = self._overlay_index
+
+    def attach_series(self, series: Optional['SeriesState']):
+        """
+        Show the series, nothing is copied or computed. None to clear the store.
+        """
+        self._stroke = None
+        if series is None:
+            self._dcm_files, self._volume, self._overlay, self._seed = [], None, None, None
+            self.history = OverlayHistory(OVERLAY_HISTORY_MAX_BYTES)
+            self._pyramid, self._histogram, self._overlay_index = {}, None, None
+            self._loaded_slices = (0, 0)
+            self.on_histogram_changed()
+            return
+        self._dcm_files, self._volume, self._spacing = series.files, series.volume, series.spacing
+        self._overlay, self.history, self._seed = series.overlay, series.history, series.seed
+        self._pyramid, self._histogram = series.pyramid, series.histogram
+        self._overlay_index = series.overlay_index
+        self._cursor = tuple(series.cursor)
+        self._loaded_slices = (0, series.shape[0])
+        self.on_histogram_changed()
+        self.on_cursor_changed(self._cursor)
+        self.on_overlay_updated()
+
+    @property
+    def loaded_slices(self) -> Tuple[int, int]:
+        return self._loaded_slices
+
+    @property
+    def fully_loaded(self) -> bool:
+        return self._volume is not None and self._loaded_slices == (0, self._volume.shape[0])
+
+    def set_loaded_slices(self, volume: np.ndarray, start: int, stop: int):
+        """
+        The slices of the volume decoded so far, the volume is loaded in the background
+        :param volume: ignored if it is not the current volume
+        :param start:
+        :param stop: excluded
+        """
+        if volume is self._volume:
+            self._loaded_slices = (int(start), int(stop))
 
     @property
-    def overlay(self):
+    def pyramid_factors(self) -> List[int]:
+        return sorted(self._pyramid)
+
+    def get_level(self, factor: int) -> np.ndarray:
+        """
+        :param factor: downsampling factor
+        :return: the level of the pyramid, None if not built
+        """
+        return self._pyramid.get(factor)
+
+    def set_pyramid(self, volume: np.ndarray, levels: Dict[int, np.ndarray]):
+        """
+        :param volume: the volume the levels were built from, ignored if it is not the current volume
+        :param levels: {factor: downsampled volume}
+        :return:
+        """
+        if volume is self._volume:
+            self._pyramid = dict(levels)
+
+    @property
+    def histogram(self) -> VolumeHistogram:
+        return self._histogram
+
+    def set_histogram(self, volume: np.ndarray, histogram: VolumeHistogram):
+        """
+        Set or update(the histogram is filled in the background) the histogram
+        :param volume: the volume the histogram was computed from, ignored if it is not the current volume
+        :param histogram:
+        :return:
+        """
+        if volume is self._volume:
+            self._histogram = histogram
+            self.on_histogram_changed()
+
+    @property
+    def overlay(self) -> SparseOverlay:
         # TODO add a decorator for every property to sure the value not be a None object
         return self._overlay
 
-    def set_overlay(self, overlay: np.ndarray):
+    @property
+    def overlay_count(self) -> int:
+        """
+        Number of the segmented voxels, maintained by every update
+        """
+        return self._overlay.count if self._overlay is not None else 0
+
+    @property
+    def overlay_index(self) -> OverlayIndex:
+        """
+        The index synchronized with the overlay, only the slices changed since the last read are indexed
+        """
+        self._overlay_index.sync(self._overlay, self._volume)
+        return self._overlay_index
+
+    def get_overlay_statistics(self) -> RegionStatistics:
+        return self.overlay_index.get_statistics(self._spacing)
+
+    def get_slice_statistics(self, index: int) -> SliceStatistics:
+        return self.overlay_index.get_slice_statistics(index, self._spacing)
+
+    def get_roi_statistics(self, box: Tuple[Tuple[int, int], Tuple[int, int], Tuple[int, int]]) -> RegionStatistics:
+        """
+        :param box: ((z0, z1), (x0, x1), (y0, y1))
+        """
+        return self.overlay_index.get_roi_statistics(box, self._spacing)
+
+    def set_overlay(self, overlay, record: bool = True):
         """
-        :param overlay:
+        :param overlay: dense array or SparseOverlay, the dense array is compressed
+        :param record: record the changed slices in the history
         :return:
         """
+        # The edits of a stroke not ended are recorded before the overlay is replaced
+        self.end_stroke()
         if overlay is not None:
             assert overlay.shape == self.volume.shape
+            if not isinstance(overlay, SparseOverlay):
+                overlay = SparseOverlay.from_dense(overlay)
+            if record and self._overlay is not None:
+                edit = SlicesEdit.diff(self._overlay, overlay)
+                if not edit.empty:
+                    self.history.push(edit)
         self._overlay = overlay
 
-    def update_overlay(self, position: Pixel, arr: np.ndarray, mode: UpdateMode):
+    def undo(self) -> bool:
+        """
+        撤销
+        :return: False if nothing to undo or a stroke is running
+        """
+        if self._stroke is not None or self._overlay is None or not self.history.undo(self._overlay):
+            return False
+        self.on_overlay_updated()
+        return True
+
+    def redo(self) -> bool:
+        """
+        重做
+        :return: False if nothing to redo or a stroke is running
+        """
+        if self._stroke is not None or self._overlay is None or not self.history.redo(self._overlay):
+            return False
+        self.on_overlay_updated()
+        return True
+
+    def update_overlay(self, position: 'Pixel', arr: np.ndarray, mode: UpdateMode, plane: Plane = Plane.AXIAL):
         """
         更新overlay
         update overlay
         :param mode:
-        :param position: 要更新的位置(z, ) | where to update
-        :param arr: 更新的内容 | array to update
+        :param position: 要更新的位置(z, ) | where to update, height is the index along the axis of the plane,
+            col and row are the horizontal and vertical start in the image of the plane
+        :param arr: 更新的内容 | array to update, indexed by (horizontal, vertical)
+        :param plane: the plane where the ROI is
+        """
+        start, block = plane_.to_block(plane, position.height, position.col, position.row, arr)
+        self.update_overlay_block(start, block, mode)
+
+    def update_overlay_block(self, start: Tuple[int, int, int], block: np.ndarray, mode: UpdateMode):
+        """
+        Update a block of the overlay, recorded in the history as one edit
+        :param start: (slice, x, y)
+        :param block: content of the block, clipped by the border of the overlay
+        :param mode:
         """
-        xl, yl = arr.shape
-        x_start, y_start = position.col, position.row
-        x_end, y_end = x_start + xl, y_start + yl
+        target = self.overlay.get_block(start, block.shape)
+        block = block[: target.shape[0], : target.shape[1], : target.shape[2]]
         if UpdateMode.OVER_WRITE == mode:
             pass
         elif UpdateMode.APPEND == mode:
-            target_slice = self.overlay[position.height]
-            arr = np.logical_or(target_slice[x_start: x_end, y_start: y_end], arr)
+            block = np.logical_or(target, block)
+        elif UpdateMode.ERASE == mode:
+            block = np.logical_and(target, np.logical_not(block))
         else:
             raise NotImplementedError
-        self.overlay[position.height, x_start: x_end, y_start: y_end] = arr.astype(np.int8)
-        self.overlayUpdated.emit()
+        block = block.astype(np.int8)
+        z0, x0, y0 = start
+        edits = [RegionEdit(z0 + k, x0, y0, target[k], block[k]) for k in range(block.shape[0])]
+        self.overlay.set_block(start, block)
+        if self._stroke is not None:
+            self._stroke.extend(edits)
+            return
+        self.history.push(edits[0] if len(edits) == 1 else CompositeEdit(edits))
+        self.on_overlay_updated()
+
+    def paint_overlay(self, index: int, rect: Tuple[int, int, int, int], mask: np.ndarray, erase: bool = False,
+                      plane: Plane = Plane.AXIAL):
+        """
+        Paint or erase the mask in a rectangle of the image of the plane
+        :param index: index along the axis of the plane
+        :param rect: (h0, v0, h1, v1) in the image of the plane
+        :param mask: bool, (horizontal, vertical)
+        :param erase:
+        :param plane:
+        """
+        start, block = plane_.stack_to_block(plane, index, rect[0], rect[1], mask[None])
+        self.update_overlay_block(start, block, UpdateMode.ERASE if erase else UpdateMode.APPEND)
+
+    def begin_stroke(self):
+        """
+        The following edits are one step of the history, on_overlay_updated is called once by end_stroke.
+        A stroke not ended is ended first.
+        """
+        self.end_stroke()
+        self._stroke = []
+
+    def end_stroke(self):
+        """
+        Record the edits of the stroke as one step of the history, nothing if no stroke is running
+        """
+        edits, self._stroke = self._stroke, None
+        if not edits:
+            return
+        self.history.push(edits[0] if len(edits) == 1 else CompositeEdit(edits))
+        self.on_overlay_updated()
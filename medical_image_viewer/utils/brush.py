@@ -0,0 +1,118 @@
+"""
+@Author: Daryl Xu
+
+Rasterization of the brush strokes and the polygons in the image of a plane. The positions are
+(horizontal, vertical) in pixels, the pixel (i, j) covers [i, i + 1) x [j, j + 1).
+A stroke is sampled along its length and a precomputed disc is stamped at every sample in one
+vectorized step, a polygon is filled by scan lines.
+"""
+import functools
+from typing import Optional, Tuple
+
+import numpy as np
+
+# Max number of the (sample, stamp pixel) pairs stamped at once
+_MAX_PAIRS = 1 << 20
+
+
+@functools.lru_cache(maxsize=64)
+def get_stamp(radius: int) -> np.ndarray:
+    """
+    Offsets of the pixels in the disc, read only
+    :param radius: in pixels, 0 for a single pixel
+    :return: (pixels, 2)
+    """
+    r = int(radius)
+    h, v = np.mgrid[-r: r + 1, -r: r + 1]
+    inside = h * h + v * v <= r * r + r
+    offsets = np.stack([h[inside], v[inside]], axis=1)
+    offsets.flags.writeable = False
+    return offsets
+
+
+def interpolate(points: np.ndarray, step: float) -> np.ndarray:
+    """
+    Samples along the polyline every step, the vertices included
+    :param points: (n, 2)
+    :param step:
+    :return: (samples, 2)
+    """
+    points = np.asarray(points, np.float64).reshape(-1, 2)
+    if len(points) < 2:
+        return points
+    lengths = np.hypot(*np.diff(points, axis=0).T)
+    distance = np.concatenate([[0.], np.cumsum(lengths)])
+    samples = np.union1d(np.arange(0., distance[-1], step), distance)
+    return np.stack([np.interp(samples, distance, points[:, 0]),
+                     np.interp(samples, distance, points[:, 1])], axis=1)
+
+
+def _clip_rect(low: np.ndarray, high: np.ndarray, shape: Tuple[int, int]) -> Optional[Tuple[int, int, int, int]]:
+    h0, v0 = max(int(low[0]), 0), max(int(low[1]), 0)
+    h1, v1 = min(int(high[0]), shape[0]), min(int(high[1]), shape[1])
+    if h0 >= h1 or v0 >= v1:
+        return None
+    return h0, v0, h1, v1
+
+
+def rasterize_stroke(points: np.ndarray, radius: int, shape: Tuple[int, int]) \
+        -> Optional[Tuple[Tuple[int, int, int, int], np.ndarray]]:
+    """
+    The pixels covered by a brush of the radius moved along the points
+    :param points: (n, 2) positions of the mouse
+    :param radius: in pixels
+    :param shape: shape of the image
+    :return: rectangle (h0, v0, h1, v1) touched, bool mask of the rectangle; None if outside the image
+    """
+    # Sampled every quarter of the radius, the border of the stroke is smooth to a fraction of a pixel
+    samples = interpolate(points, max(radius / 4, 0.5))
+    centers = np.unique(np.floor(samples).astype(np.intp), axis=0)
+    rect = _clip_rect(centers.min(axis=0) - radius, centers.max(axis=0) + radius + 1, shape)
+    if rect is None:
+        return None
+    h0, v0, h1, v1 = rect
+    mask = np.zeros((h1 - h0, v1 - v0), bool)
+    stamp = get_stamp(radius)
+    chunk = max(1, _MAX_PAIRS // len(stamp))
+    for i in range(0, len(centers), chunk):
+        pixels = (centers[i: i + chunk, None, :] + stamp[None]).reshape(-1, 2) - (h0, v0)
+        inside = (pixels[:, 0] >= 0) & (pixels[:, 0] < h1 - h0) & (pixels[:, 1] >= 0) & (pixels[:, 1] < v1 - v0)
+        pixels = pixels[inside]
+        mask[pixels[:, 0], pixels[:, 1]] = True
+    return rect, mask
+
+
+def rasterize_polygon(vertices: np.ndarray, shape: Tuple[int, int]) \
+        -> Optional[Tuple[Tuple[int, int, int, int], np.ndarray]]:
+    """
+    The pixels whose centers are inside the polygon(even-odd rule)
+    :param vertices: (n, 2), the polygon is closed from the last vertex to the first
+    :param shape: shape of the image
+    :return: rectangle (h0, v0, h1, v1) touched, bool mask of the rectangle; None if empty
+    """
+    vertices = np.asarray(vertices, np.float64).reshape(-1, 2)
+    if len(vertices) < 3:
+        return None
+    rect = _clip_rect(np.floor(vertices.min(axis=0)), np.ceil(vertices.max(axis=0)) + 1, shape)
+    if rect is None:
+        return None
+    h0, v0, h1, v1 = rect
+    start, end = vertices, np.roll(vertices, -1, axis=0)
+    # Crossings of the edges with the scan lines through the pixel centers, (lines, edges)
+    v = np.arange(v0, v1)[:, None] + 0.5
+    crossing = (start[:, 1] <= v) != (end[:, 1] <= v)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        h = start[:, 0] + (v - start[:, 1]) * (end[:, 0] - start[:, 0]) / (end[:, 1] - start[:, 1])
+    h = np.sort(np.where(crossing, h, np.inf), axis=1)
+    # Pairs of crossings are the spans inside, the pixel i is inside if its center i + 0.5 is in a span
+    enter = np.clip(np.ceil(h[:, 0::2] - 0.5), h0, h1).astype(np.intp) - h0
+    leave = np.clip(np.ceil(h[:, 1::2] - 0.5), h0, h1).astype(np.intp) - h0
+    n = min(enter.shape[1], leave.shape[1])
+    enter, leave = enter[:, :n], leave[:, :n]
+    rows = np.broadcast_to(np.arange(v1 - v0)[:, None], enter.shape)
+    valid = np.isfinite(h[:, 1::2][:, :n]) & (leave > enter)
+    diff = np.zeros((v1 - v0, h1 - h0 + 1), np.int32)
+    np.add.at(diff, (rows[valid], enter[valid]), 1)
+    np.add.at(diff, (rows[valid], leave[valid]), -1)
+    mask = np.cumsum(diff[:, :-1], axis=1) > 0
+    return rect, mask.T
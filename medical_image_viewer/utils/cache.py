@@ -0,0 +1,149 @@
+"""
+@Author: Daryl Xu
+
+On-disk cache of the decoded volumes, the volume is memory-mapped when reopened
+"""
+import hashlib
+import json
+import logging
+import os
+import shutil
+import tempfile
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+
+from constant import VOLUME_CACHE_DIR, VOLUME_CACHE_MAX_BYTES
+
+# Changed when the format of the entries changes, the old entries are never hit
+# 3: the volumes are rescaled by the modality LUT
+FORMAT_VERSION = 3
+VOLUME_FILE = 'volume.npy'
+META_FILE = 'meta.json'
+ARRAYS_FILE = 'arrays.npz'
+
+
+class VolumeCache:
+    """
+    体数据缓存，以SeriesInstanceUID和文件修改时间为键
+    Cache of decoded volumes keyed by the SeriesInstanceUID and the mtimes of the files,
+    least recently used entries are evicted when the size limit is exceeded
+    """
+    def __init__(self, cache_dir: str = VOLUME_CACHE_DIR, max_bytes: int = VOLUME_CACHE_MAX_BYTES):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        os.makedirs(cache_dir, exist_ok=True)
+
+    @staticmethod
+    def get_key(files: List[str]) -> str:
+        """
+        Key of the series, changes when any of the files is modified
+        :param files:
+        :return:
+        """
+        import pydicom
+        paths = sorted(os.path.abspath(file) for file in files)
+        dcm = pydicom.dcmread(paths[0], stop_before_pixels=True, force=True,
+                              specific_tags=['SeriesInstanceUID'])
+        digest = hashlib.sha1(f'{FORMAT_VERSION}\0{dcm.get("SeriesInstanceUID", "")}'.encode())
+        for path in paths:
+            stat = os.stat(path)
+            digest.update(f'{path}\0{stat.st_mtime_ns}\0{stat.st_size}\0'.encode())
+        return digest.hexdigest()
+
+    def _entry_dir(self, key: str) -> str:
+        return os.path.join(self.cache_dir, key)
+
+    def get(self, files: List[str]) -> Optional[Tuple[List[str], np.memmap, dict]]:
+        """
+        Get the cached volume of the files
+        :param files:
+        :return: sorted files, memory-mapped volume, metadata(the arrays stored with the volume in 'arrays');
+            None if not cached
+        """
+        from pydicom.errors import InvalidDicomError
+        try:
+            key = self.get_key(files)
+        except (OSError, InvalidDicomError):
+            return None
+        entry = self._entry_dir(key)
+        meta_path = os.path.join(entry, META_FILE)
+        if not os.path.exists(meta_path):
+            return None
+        try:
+            with open(meta_path) as f:
+                meta = json.load(f)
+            volume = np.load(os.path.join(entry, VOLUME_FILE), mmap_mode='r')
+            arrays_path = os.path.join(entry, ARRAYS_FILE)
+            if os.path.exists(arrays_path):
+                with np.load(arrays_path) as arrays:
+                    meta['arrays'] = dict(arrays)
+        except (OSError, ValueError) as e:
+            logging.warning(f'broken cache entry {entry}: {e}')
+            shutil.rmtree(entry, ignore_errors=True)
+            return None
+        # The mtime of the meta file records the last access for the LRU eviction
+        os.utime(meta_path)
+        return meta['files'], volume, meta
+
+    def put(self, files: List[str], sorted_files: List[str], volume: np.ndarray, meta: dict,
+            arrays: Dict[str, np.ndarray] = None):
+        """
+        Store the volume
+        :param files: files given to the loader, used for the key
+        :param sorted_files: files sorted by the slice location
+        :param volume:
+        :param meta: spacing, modality LUT etc., must be JSON serializable
+        :param arrays: small arrays computed from the volume(histogram etc.)
+        :return:
+        """
+        if volume.nbytes > self.max_bytes:
+            return
+        key = self.get_key(files)
+        entry = self._entry_dir(key)
+        if os.path.exists(entry):
+            return
+        self._evict(self.max_bytes - volume.nbytes)
+
+        meta = dict(meta, files=sorted_files)
+        # Write into a temporary directory then rename, a half written entry is never visible
+        tmp = tempfile.mkdtemp(dir=self.cache_dir, prefix='.tmp-')
+        try:
+            np.save(os.path.join(tmp, VOLUME_FILE), volume)
+            if arrays:
+                np.savez(os.path.join(tmp, ARRAYS_FILE), **arrays)
+            with open(os.path.join(tmp, META_FILE), 'w') as f:
+                json.dump(meta, f)
+            os.rename(tmp, entry)
+        except OSError as e:
+            logging.warning(f'failed to cache the volume: {e}')
+            shutil.rmtree(tmp, ignore_errors=True)
+
+    def _entries(self) -> List[Tuple[float, int, str]]:
+        entries = []
+        for name in os.listdir(self.cache_dir):
+            entry = self._entry_dir(name)
+            meta_path = os.path.join(entry, META_FILE)
+            if name.startswith('.') or not os.path.exists(meta_path):
+                continue
+            size = os.path.getsize(os.path.join(entry, VOLUME_FILE))
+            entries.append((os.path.getmtime(meta_path), size, entry))
+        return entries
+
+    def _evict(self, max_bytes: int):
+        """
+        Remove the least recently used entries until the total size fits in max_bytes
+        :param max_bytes:
+        :return:
+        """
+        entries = sorted(self._entries())
+        total = sum(size for _, size, _ in entries)
+        for _, size, entry in entries:
+            if total <= max_bytes:
+                break
+            shutil.rmtree(entry, ignore_errors=True)
+            total -= size
+
+    def clear(self):
+        for _, _, entry in self._entries():
+            shutil.rmtree(entry, ignore_errors=True)
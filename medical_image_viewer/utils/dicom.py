@@ -1,17 +1,26 @@
 """
 @Author: Daryl Xu
 """
-from typing import List
+import os
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import List, Callable, Optional, Tuple, TYPE_CHECKING
 import warnings
 
-import pydicom
 import numpy as np
 from deprecated.sphinx import deprecated
 
+from utils import profiling
+from utils.cache import VolumeCache
+from utils.histogram import VolumeHistogram
+from utils.lazy_volume import LazyVolume
+
+if TYPE_CHECKING:
+    import pydicom
+
 
 class DcmLoadingException(Exception):
-    def __init__(self, msg, *args,**kwargs):
-        super(DcmLoadingException, self).__init__(args, kwargs)
+    def __init__(self, msg, *args, **kwargs):
+        super(DcmLoadingException, self).__init__(msg, *args)
 
 
 @deprecated(version='1.0', reason='replaced by lymphangioma_segmentation.dicom')
@@ -22,6 +31,7 @@ def get_slice_location(path: str) -> float:
     :return:
     """
     warnings.warn('', DeprecationWarning)
+    import pydicom
     dcm = pydicom.dcmread(path, force=True)
     # return dcm.InStackPositionNumber
     return float(dcm.SliceLocation)
@@ -35,6 +45,7 @@ def load_dcm_series(files: List[str]):
     :return:
     """
     warnings.warn('', DeprecationWarning)
+    import pydicom
     volume = []
     files.sort(key=get_slice_location)
     for file in files:
@@ -53,9 +64,338 @@ def get_voxel_size(path: str) -> float:
     :return:
     """
     warnings.warn('', DeprecationWarning)
+    import pydicom
     dcm = pydicom.dcmread(path, force=True)
     x_str, y_str = dcm.PixelSpacing
     x = float(x_str)
     y = float(y_str)
     z = float(dcm.SpacingBetweenSlices)
     return x * y * z
+
+
+class DcmHeader:
+    """
+    DICOM文件头，不包含像素数据
+    Header of one DICOM file, read once without the pixel data
+    """
+    def __init__(self, path: str, dcm: 'pydicom.Dataset'):
+        self.path = path
+        self.rows = int(dcm.Rows)
+        self.cols = int(dcm.Columns)
+        self.bits_allocated = int(dcm.get('BitsAllocated', 16) or 16)
+        self.bits_stored = int(dcm.get('BitsStored', self.bits_allocated) or self.bits_allocated)
+        self.pixel_representation = int(dcm.get('PixelRepresentation', 0) or 0)
+        self.pixel_spacing = tuple(float(v) for v in dcm.get('PixelSpacing', (0, 0)))
+        self.spacing_between_slices = float(dcm.get('SpacingBetweenSlices', 0) or 0)
+        self.slice_thickness = float(dcm.get('SliceThickness', 0) or 0)
+        self.rescale_slope = float(dcm.get('RescaleSlope', 1) or 1)
+        self.rescale_intercept = float(dcm.get('RescaleIntercept', 0) or 0)
+        self.series_uid = str(dcm.get('SeriesInstanceUID', ''))
+        self.sop_uid = str(dcm.get('SOPInstanceUID', ''))
+        self.sop_class_uid = str(dcm.get('SOPClassUID', ''))
+        # Geometry in the patient coordinate system(LPS), None if not given
+        self.position = tuple(float(v) for v in dcm.ImagePositionPatient) \
+            if 'ImagePositionPatient' in dcm else None
+        self.orientation = tuple(float(v) for v in dcm.ImageOrientationPatient) \
+            if 'ImageOrientationPatient' in dcm else None
+        self.location = self._get_location(dcm)
+
+    @property
+    def dtype(self) -> np.dtype:
+        """
+        dtype of the decoded pixel array
+        """
+        kind = 'int' if self.pixel_representation else 'uint'
+        return np.dtype(f'{kind}{self.bits_allocated}')
+
+    @property
+    def value_range(self) -> Tuple[float, float]:
+        """
+        Range of the values after the modality LUT(rescale slope and intercept)
+        """
+        bits = min(self.bits_stored, self.bits_allocated)
+        if self.pixel_representation:
+            low, high = -(1 << (bits - 1)), (1 << (bits - 1)) - 1
+        else:
+            low, high = 0, (1 << bits) - 1
+        low, high = low * self.rescale_slope + self.rescale_intercept, high * self.rescale_slope + self.rescale_intercept
+        return min(low, high), max(low, high)
+
+    @property
+    def identity_rescale(self) -> bool:
+        return self.rescale_slope == 1 and self.rescale_intercept == 0
+
+    @staticmethod
+    def _get_location(dcm: 'pydicom.Dataset') -> float:
+        if 'SliceLocation' in dcm:
+            return float(dcm.SliceLocation)
+        if 'ImagePositionPatient' in dcm:
+            return float(dcm.ImagePositionPatient[2])
+        return float(dcm.get('InstanceNumber', 0) or 0)
+
+
+def read_header(path: str) -> DcmHeader:
+    """
+    Read the header of the DICOM file, stop before the pixel data
+    :param path:
+    :return:
+    """
+    import pydicom
+    dcm = pydicom.dcmread(path, stop_before_pixels=True, force=True)
+    return DcmHeader(path, dcm)
+
+
+def read_pixels(path: str) -> np.ndarray:
+    """
+    Read and decode the pixel data of the DICOM file
+    :param path:
+    :return:
+    """
+    import pydicom
+    dcm = pydicom.dcmread(path, force=True)
+    # file_meta没有内容，但是我们需要其中的TransferSyntaxUID字段，没有则设置默认小端
+    if not dcm.file_meta.get('TransferSyntaxUID'):
+        dcm.file_meta.TransferSyntaxUID = pydicom.uid.ImplicitVRLittleEndian
+    return dcm.pixel_array
+
+
+def get_rescaled_dtype(headers: List[DcmHeader]) -> Tuple[np.dtype, float, float]:
+    """
+    The narrowest dtype holding the rescaled values of all the slices: an integer type if the slopes and
+    the intercepts are integers(int16 for CT), float32 otherwise
+    :return: dtype, lowest and highest possible value
+    """
+    ranges = [header.value_range for header in headers]
+    low, high = min(r[0] for r in ranges), max(r[1] for r in ranges)
+    integer = all(float(header.rescale_slope).is_integer() and float(header.rescale_intercept).is_integer()
+                  for header in headers)
+    if integer:
+        for dtype in (np.uint8, np.int8, np.uint16, np.int16, np.int32):
+            info = np.iinfo(dtype)
+            if info.min <= low and high <= info.max:
+                return np.dtype(dtype), low, high
+    return np.dtype(np.float32), low, high
+
+
+def rescale(arr: np.ndarray, slope: float, intercept: float, out: np.ndarray):
+    """
+    Apply the modality LUT, write the result into out(a slice of the preallocated volume)
+    """
+    if slope == 1 and intercept == 0:
+        if out.dtype.kind != 'f' and not np.can_cast(arr.dtype, out.dtype):
+            # Pixel data beyond the stored bits would wrap in the narrow type
+            info = np.iinfo(out.dtype)
+            np.clip(arr, info.min, info.max, out=out, casting='unsafe')
+        else:
+            out[...] = arr
+    elif out.dtype.kind == 'f':
+        np.multiply(arr, out.dtype.type(slope), out=out, casting='unsafe')
+        out += out.dtype.type(intercept)
+    else:
+        # The raw values may not fit in the target type before the intercept is added
+        tmp = arr.astype(np.int32)
+        if slope != 1:
+            tmp *= int(slope)
+        tmp += int(intercept)
+        info = np.iinfo(out.dtype)
+        np.clip(tmp, info.min, info.max, out=tmp)
+        out[...] = tmp
+    return out
+
+
+def read_rescaled(header: DcmHeader, dtype: np.dtype, out: np.ndarray = None) -> np.ndarray:
+    """
+    Decode the pixel data of the file and apply the modality LUT
+    """
+    if out is None:
+        out = np.empty((header.rows, header.cols), dtype)
+    return rescale(read_pixels(header.path), header.rescale_slope, header.rescale_intercept, out)
+
+
+def compute_spacing(headers: List[DcmHeader]) -> Tuple[float, float, float]:
+    """
+    Compute the spacing(mm) of the volume from the sorted headers
+    :param headers: headers sorted by the slice location
+    :return: (slice, row, column)
+    """
+    x, y = headers[0].pixel_spacing
+    z = headers[0].spacing_between_slices
+    if not z and len(headers) > 1:
+        z = abs(headers[1].location - headers[0].location)
+    if not z:
+        z = headers[0].slice_thickness
+    return z, x, y
+
+
+def read_sorted_headers(files: List[str], workers: Optional[int] = None) -> List[DcmHeader]:
+    """
+    Read the headers of the given files in parallel and sort them by the slice location
+    :param files:
+    :param workers: max number of the threads
+    :return:
+    """
+    from pydicom.errors import InvalidDicomError
+    try:
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            headers = list(executor.map(read_header, files))
+    except (InvalidDicomError, AttributeError, KeyError, ValueError) as e:
+        raise DcmLoadingException(f'Invalid DICOM file: {e}')
+    headers.sort(key=lambda header: header.location)
+
+    rows, cols = headers[0].rows, headers[0].cols
+    for header in headers:
+        if (header.rows, header.cols) != (rows, cols):
+            raise DcmLoadingException(f'Inconsistent image size: {header.path}')
+    return headers
+
+
+class SeriesLoader:
+    """
+    分步加载
+    Loading of a series in steps, the series can be shown before it is decoded entirely:
+    prepare() reads and sorts the headers and allocates the volume, decode() fills the slices from the
+    middle outwards. The decoded slices are always the contiguous range `loaded` around the middle one.
+    """
+    def __init__(self, files: List[str], workers: Optional[int] = None, cache: VolumeCache = None,
+                 lazy_threshold: Optional[int] = None):
+        """
+        :param files:
+        :param workers: max number of the threads
+        :param cache: if given, a cached volume is memory-mapped instead of decoding the files
+        :param lazy_threshold: series larger than this(bytes) are returned as a LazyVolume
+        """
+        if not files:
+            raise DcmLoadingException('No file given')
+        self.source_files = files
+        self.workers = workers or min(32, (os.cpu_count() or 1) + 4)
+        self.cache = cache
+        self.lazy_threshold = lazy_threshold
+        # Set by prepare()
+        self.files: List[str] = None
+        self.volume: np.ndarray = None
+        self.spacing: Tuple[float, float, float] = None
+        self.histogram: Optional[VolumeHistogram] = None
+        # (start, stop) of the decoded slices
+        self.loaded: Tuple[int, int] = (0, 0)
+        # Headers of the slices to decode, None if there is nothing to decode(cached or lazy volume)
+        self._headers: Optional[List[DcmHeader]] = None
+
+    @property
+    def prepared(self) -> bool:
+        return self.volume is not None
+
+    @property
+    def done(self) -> bool:
+        return self.prepared and self.loaded == (0, len(self.files))
+
+    def prepare(self):
+        if self.cache is not None:
+            cached = self.cache.get(self.source_files)
+            if cached is not None:
+                self.files, self.volume, meta = cached
+                profiling.count('volume_cache_hits')
+                arrays = meta.get('arrays')
+                self.histogram = VolumeHistogram.from_arrays(arrays) if arrays else None
+                self.spacing = tuple(meta['spacing'])
+                self.loaded = (0, len(self.files))
+                return
+
+        with profiling.span('read_headers', files=len(self.source_files)):
+            headers = read_sorted_headers(self.source_files, self.workers)
+        self.files = [header.path for header in headers]
+        total = len(self.files)
+        shape = (total, headers[0].rows, headers[0].cols)
+        self.spacing = compute_spacing(headers)
+        dtype, low, high = get_rescaled_dtype(headers)
+        self.histogram = VolumeHistogram(total, low, high, dtype.kind != 'f')
+
+        if self.lazy_threshold is not None and np.prod(shape) * dtype.itemsize > self.lazy_threshold:
+            by_path = {header.path: header for header in headers}
+            # The histogram is filled in the background by the caller
+            self.volume = LazyVolume(self.files, shape, dtype, lambda path: read_rescaled(by_path[path], dtype))
+            self.loaded = (0, total)
+            return
+        # The coronal/sagittal images are shown while loading, the slices not decoded yet are black
+        self.volume = np.zeros(shape, dtype)
+        self._headers = headers
+        self.loaded = (total // 2, total // 2)
+
+    def decode(self, progress: Callable[[int, int], None] = None, check_cancelled: Callable[[], None] = None):
+        """
+        Decode the slices in a thread pool, the middle one first. The min/max of every slice and the
+        histogram are computed by the decoding threads. The volume is put into the cache when finished.
+        :param progress: callback(finished, total) called in the caller's thread after every slice,
+            `loaded` is updated before
+        :param check_cancelled: called in the caller's thread after every slice, raises to stop the decoding
+        """
+        if self._headers is None:
+            return
+        headers, volume, histogram = self._headers, self.volume, self.histogram
+        total = len(headers)
+        middle = total // 2
+        order = sorted(range(total), key=lambda i: (abs(i - middle), i))
+        decoded = np.zeros(total, bool)
+        dtype = volume.dtype
+
+        def decode(i: int):
+            return histogram.compute_slice(read_rescaled(headers[i], dtype, volume[i]))
+
+        with profiling.span('decode_pixels', slices=total):
+            with ThreadPoolExecutor(max_workers=self.workers) as executor:
+                futures = {executor.submit(decode, i): i for i in order}
+                try:
+                    for finished, future in enumerate(as_completed(futures), 1):
+                        i = futures[future]
+                        try:
+                            stats = future.result()
+                        except Exception as e:
+                            raise DcmLoadingException(f'Failed to decode {self.files[i]}: {e}')
+                        histogram.add_slice(i, stats=stats)
+                        decoded[i] = True
+                        if decoded[middle]:
+                            start, stop = self.loaded if self.loaded[0] < self.loaded[1] else (middle, middle + 1)
+                            while start > 0 and decoded[start - 1]:
+                                start -= 1
+                            while stop < total and decoded[stop]:
+                                stop += 1
+                            self.loaded = (start, stop)
+                        if check_cancelled is not None:
+                            check_cancelled()
+                        if progress is not None:
+                            progress(finished, total)
+                except BaseException:
+                    for f in futures:
+                        f.cancel()
+                    raise
+        self._headers = None
+
+        if self.cache is not None:
+            self.cache.put(self.source_files, self.files, volume, {
+                'spacing': self.spacing,
+                'locations': [header.location for header in headers],
+                'rescale_slope': headers[0].rescale_slope,
+                'rescale_intercept': headers[0].rescale_intercept,
+            }, histogram.to_arrays())
+
+
+def load_series(files: List[str], progress: Callable[[int, int], None] = None,
+                workers: Optional[int] = None, cache: VolumeCache = None,
+                lazy_threshold: Optional[int] = None) \
+        -> Tuple[List[str], np.ndarray, Tuple[float, float, float], Optional[VolumeHistogram]]:
+    """
+    Load the DICOM series, every file is parsed once for the header and once for the pixel data.
+    The pixel data is decoded in a thread pool into a preallocated volume of the narrowest dtype holding
+    the rescaled values, the modality LUT(rescale slope and intercept) is applied while decoding.
+    The min/max of every slice and the histogram are computed by the decoding threads.
+    :param files:
+    :param progress: callback(finished, total), called in the caller's thread
+    :param workers: max number of the threads
+    :param cache: if given, a cached volume is memory-mapped instead of decoding the files
+    :param lazy_threshold: series larger than this(bytes) are returned as a LazyVolume
+    :return: sorted files, volume(slice, rows, cols), spacing(slice, row, column) in mm,
+        histogram(empty for a LazyVolume)
+    """
+    loader = SeriesLoader(files, workers, cache, lazy_threshold)
+    loader.prepare()
+    loader.decode(progress)
+    return loader.files, loader.volume, loader.spacing, loader.histogram
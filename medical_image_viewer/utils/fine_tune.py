@@ -0,0 +1,82 @@
+"""
+@Author: Daryl Xu
+
+Fine-tuning of the segmentation in an axis-aligned rectangle of a plane. The rectangle is taken as an
+integer slice of the images (a view of the volume, nothing is resampled), the slices of a range are
+processed as one block: thresholding and the 2D connected-component labelling are vectorized over the block.
+"""
+import math
+from typing import Optional, Tuple
+
+import numpy as np
+
+from utils.region_grow import _get_ndimage
+
+# 8-connectivity in the plane, the slices of the block are not connected to each other
+_STRUCTURE_2D = np.zeros((3, 3, 3), bool)
+_STRUCTURE_2D[1] = True
+
+
+def get_rect(pos: Tuple[float, float], size: Tuple[float, float],
+             shape: Tuple[int, int]) -> Optional[Tuple[int, int, int, int]]:
+    """
+    The pixels covered by a rectangle of the image
+    :param pos: (horizontal, vertical) of the corner
+    :param size: (width, height)
+    :param shape: shape of the image, (horizontal, vertical)
+    :return: (h0, v0, h1, v1) clipped by the image, the stops excluded; None if the rectangle is outside
+    """
+    h0, v0 = max(int(math.floor(pos[0])), 0), max(int(math.floor(pos[1])), 0)
+    h1 = min(int(math.ceil(pos[0] + size[0])), shape[0])
+    v1 = min(int(math.ceil(pos[1] + size[1])), shape[1])
+    if h0 >= h1 or v0 >= v1:
+        return None
+    return h0, v0, h1, v1
+
+
+def label_slices(mask: np.ndarray) -> Tuple[np.ndarray, int]:
+    """
+    Label the 2D connected components of every slice of the block in one call, the labels are unique in the block
+    :param mask: (slices, horizontal, vertical)
+    :return: labels, number of the labels; None if scipy is not installed
+    """
+    ndimage = _get_ndimage()
+    if ndimage is None:
+        return None, 0
+    return ndimage.label(mask, structure=_STRUCTURE_2D)
+
+
+def threshold_components(block: np.ndarray, threshold: float, keep: np.ndarray = None) -> np.ndarray:
+    """
+    The pixels not lower than the threshold, only the components touching the current segmentation are kept,
+    or the largest component of a slice where nothing is segmented.
+    Without scipy the thresholded pixels are returned as they are.
+    :param block: intensities, (slices, horizontal, vertical)
+    :param threshold:
+    :param keep: current segmentation of the block, bool
+    :return: bool mask of the block
+    """
+    mask = np.asarray(block) >= threshold
+    labels, n = label_slices(mask)
+    if labels is None or n == 0:
+        return mask
+    selected = np.zeros(n + 1, bool)
+    if keep is not None:
+        selected[labels[keep & mask]] = True
+    # The slice of every label, the largest label of the slices without a kept component
+    slice_of_label = np.zeros(n + 1, np.intp)
+    z, x, y = np.nonzero(labels)
+    slice_of_label[labels[z, x, y]] = z
+    sizes = np.bincount(labels[z, x, y], minlength=n + 1)
+    covered = np.zeros(mask.shape[0], bool)
+    covered[slice_of_label[np.nonzero(selected)[0]]] = True
+    candidates = np.arange(1, n + 1)
+    candidates = candidates[~covered[slice_of_label[candidates]]]
+    if candidates.size:
+        # Sorted by slice then by size, the last label of every slice is the largest
+        order = candidates[np.lexsort((sizes[candidates], slice_of_label[candidates]))]
+        slices = slice_of_label[order]
+        last = np.append(slices[1:] != slices[:-1], True)
+        selected[order[last]] = True
+    selected[0] = False
+    return selected[labels]
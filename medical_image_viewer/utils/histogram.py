@@ -0,0 +1,134 @@
+"""
+@Author: Daryl Xu
+
+Intensity statistics of the whole volume: the min/max of every slice and a global histogram,
+accumulated slice by slice while the volume is decoded
+"""
+from typing import Dict, Tuple
+
+import numpy as np
+
+# Integer data gets a bin per value if the range is not wider than this
+MAX_INTEGER_BINS = 65536
+FLOAT_BINS = 4096
+
+
+class VolumeHistogram:
+    """
+    体数据直方图
+    The bins cover a fixed range known before decoding (the range of the dtype or of the rescaled
+    stored bits). compute_slice() is pure and can run in the decoding threads, add_slice() is not thread-safe.
+    """
+    def __init__(self, slices: int, low: float, high: float, integer: bool):
+        self.integer = integer and high - low + 1 <= MAX_INTEGER_BINS
+        if self.integer:
+            low, high = int(low), int(high)
+            # The bins are centered at the integers
+            self.edges = np.arange(low, high + 2, dtype=np.float64) - 0.5
+        else:
+            # Widened a little, the bounds rounded to float32 must fall in the bins
+            margin = (high - low) * 1e-6 or 1e-6
+            low, high = float(low) - margin, float(high) + margin
+            self.edges = np.linspace(low, high, FLOAT_BINS + 1)
+        self.low, self.high = low, high
+        self.counts = np.zeros(len(self.edges) - 1, np.int64)
+        self.slice_min = np.full(slices, np.nan)
+        self.slice_max = np.full(slices, np.nan)
+
+    @classmethod
+    def for_dtype(cls, slices: int, dtype: np.dtype, low: float = None, high: float = None) -> 'VolumeHistogram':
+        """
+        :param low: lower bound of the values, the bound of the dtype by default
+        :param high:
+        """
+        dtype = np.dtype(dtype)
+        if dtype.kind in 'iub':
+            info = np.iinfo(dtype) if dtype.kind != 'b' else np.iinfo(np.uint8)
+            low = info.min if low is None else low
+            high = info.max if high is None else high
+            return cls(slices, low, high, True)
+        if low is None or high is None:
+            raise ValueError('The range of a float volume must be given')
+        return cls(slices, low, high, False)
+
+    def compute_slice(self, arr: np.ndarray) -> Tuple[float, float, np.ndarray]:
+        """
+        :return: min, max and the histogram of the slice
+        """
+        arr = np.asarray(arr)
+        if self.integer:
+            # Subtracted in intp, the difference may not fit in the type of the slice. The values out of the
+            # range(padding, pixel data beyond the stored bits) are counted in the first/last bin
+            bins = np.subtract(arr.ravel(), self.low, dtype=np.intp)
+            np.clip(bins, 0, len(self.counts) - 1, out=bins)
+            counts = np.bincount(bins, minlength=len(self.counts))
+        else:
+            counts, _ = np.histogram(arr, self.edges)
+        return float(arr.min()), float(arr.max()), counts
+
+    def add_slice(self, index: int, arr: np.ndarray = None, stats: Tuple[float, float, np.ndarray] = None):
+        """
+        Add the slice given by the array or by the result of compute_slice, a slice is only added once
+        """
+        if not np.isnan(self.slice_min[index]):
+            return
+        low, high, counts = stats if stats is not None else self.compute_slice(arr)
+        self.slice_min[index], self.slice_max[index] = low, high
+        self.counts += counts[: len(self.counts)]
+
+    @property
+    def empty(self) -> bool:
+        return bool(np.isnan(self.slice_min).all())
+
+    @property
+    def done(self) -> bool:
+        return not np.isnan(self.slice_min).any()
+
+    @property
+    def min(self) -> float:
+        return float(np.nanmin(self.slice_min))
+
+    @property
+    def max(self) -> float:
+        return float(np.nanmax(self.slice_max))
+
+    def percentile(self, q: float) -> float:
+        """
+        The value below which q percent of the added voxels fall, at the resolution of the bins
+        """
+        cumulative = np.cumsum(self.counts)
+        if cumulative[-1] == 0:
+            return float(self.low)
+        i = min(int(np.searchsorted(cumulative, cumulative[-1] * q / 100.)), len(self.counts) - 1)
+        return float((self.edges[i] + self.edges[i + 1]) / 2)
+
+    def get_histogram(self, bins: int = 256) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        The histogram between the min and the max of the volume
+        :return: centers of the bins, counts
+        """
+        start = int(np.searchsorted(self.edges, self.min, side='right')) - 1
+        stop = int(np.searchsorted(self.edges, self.max, side='right'))
+        start, stop = max(start, 0), min(max(stop, start + 1), len(self.counts))
+        step = max(1, int(np.ceil((stop - start) / bins)))
+        bounds = np.append(np.arange(start, stop, step), stop)
+        counts = np.add.reduceat(self.counts[start: stop], bounds[:-1] - start)
+        edges = self.edges[bounds]
+        return (edges[:-1] + edges[1:]) / 2, counts
+
+    def to_arrays(self) -> Dict[str, np.ndarray]:
+        return {
+            'histogram_range': np.array([self.low, self.high, self.integer], np.float64),
+            'histogram_counts': self.counts,
+            'slice_min': self.slice_min,
+            'slice_max': self.slice_max,
+        }
+
+    @classmethod
+    def from_arrays(cls, arrays: Dict[str, np.ndarray]) -> 'VolumeHistogram':
+        low, high, integer = arrays['histogram_range']
+        histogram = cls(len(arrays['slice_min']), low, high, bool(integer))
+        histogram.counts[:] = arrays['histogram_counts']
+        histogram.slice_min[:] = arrays['slice_min']
+        histogram.slice_max[:] = arrays['slice_max']
+        return histogram
@@ -0,0 +1,150 @@
+"""
+@Author: Daryl Xu
+
+Undo/redo history of the overlay edits, only the changed part of the overlay is recorded
+"""
+from collections import deque
+from typing import Dict, List
+
+import numpy as np
+
+from utils.overlay import SparseOverlay
+
+
+class OverlayEdit:
+    """
+    Base class of the recorded edits
+    """
+    nbytes = 0
+
+    def undo(self, overlay: SparseOverlay):
+        raise NotImplementedError
+
+    def redo(self, overlay: SparseOverlay):
+        raise NotImplementedError
+
+
+class RegionEdit(OverlayEdit):
+    """
+    Edit of a rectangle in one slice, the contents before and after are kept bit-packed
+    """
+    def __init__(self, index: int, x0: int, y0: int, before: np.ndarray, after: np.ndarray):
+        self.index, self.x0, self.y0 = index, x0, y0
+        self.shape = before.shape
+        self._before = np.packbits(before != 0, axis=None)
+        self._after = np.packbits(after != 0, axis=None)
+        self.nbytes = self._before.nbytes + self._after.nbytes
+
+    def _unpack(self, bits: np.ndarray) -> np.ndarray:
+        return np.unpackbits(bits, count=int(np.prod(self.shape))).reshape(self.shape).astype(np.int8)
+
+    def undo(self, overlay: SparseOverlay):
+        overlay.set_region(self.index, self.x0, self.y0, self._unpack(self._before))
+
+    def redo(self, overlay: SparseOverlay):
+        overlay.set_region(self.index, self.x0, self.y0, self._unpack(self._after))
+
+
+class SlicesEdit(OverlayEdit):
+    """
+    Edit of whole slices (e.g. a segmentation result), the compressed slices before and after are kept
+    """
+    def __init__(self, before: Dict[int, tuple], after: Dict[int, tuple]):
+        self._before = before
+        self._after = after
+        self.nbytes = sum(SparseOverlay.entry_nbytes(entry) for entry in before.values()) + \
+            sum(SparseOverlay.entry_nbytes(entry) for entry in after.values())
+
+    @classmethod
+    def diff(cls, old: SparseOverlay, new: SparseOverlay) -> 'SlicesEdit':
+        """
+        Record the slices differing between the overlays
+        """
+        old_entries, new_entries = old.get_entries(), new.get_entries()
+        before, after = {}, {}
+        for index in set(old_entries) | set(new_entries):
+            a, b = old_entries.get(index), new_entries.get(index)
+            if a is b:
+                continue
+            if a is not None and b is not None and a[:3] == b[:3] and np.array_equal(a[3], b[3]):
+                continue
+            before[index], after[index] = a, b
+        return cls(before, after)
+
+    @property
+    def empty(self) -> bool:
+        return not self._before
+
+    def undo(self, overlay: SparseOverlay):
+        overlay.set_entries(self._before)
+
+    def redo(self, overlay: SparseOverlay):
+        overlay.set_entries(self._after)
+
+
+class CompositeEdit(OverlayEdit):
+    """
+    Several edits done as one
+    """
+    def __init__(self, edits: List[OverlayEdit]):
+        self._edits = edits
+        self.nbytes = sum(edit.nbytes for edit in edits)
+
+    def undo(self, overlay: SparseOverlay):
+        for edit in reversed(self._edits):
+            edit.undo(overlay)
+
+    def redo(self, overlay: SparseOverlay):
+        for edit in self._edits:
+            edit.redo(overlay)
+
+
+class OverlayHistory:
+    """
+    撤销/重做
+    Undo and redo stacks, the oldest edits are dropped when the memory budget is exceeded
+    """
+    def __init__(self, max_bytes: int):
+        self.max_bytes = max_bytes
+        self._undo = deque()
+        self._redo = []
+        self._nbytes = 0
+
+    @property
+    def nbytes(self) -> int:
+        return self._nbytes
+
+    def can_undo(self) -> bool:
+        return bool(self._undo)
+
+    def can_redo(self) -> bool:
+        return bool(self._redo)
+
+    def push(self, edit: OverlayEdit):
+        self._nbytes -= sum(e.nbytes for e in self._redo)
+        self._redo.clear()
+        self._undo.append(edit)
+        self._nbytes += edit.nbytes
+        while self._nbytes > self.max_bytes and self._undo:
+            self._nbytes -= self._undo.popleft().nbytes
+
+    def undo(self, overlay: SparseOverlay) -> bool:
+        if not self._undo:
+            return False
+        edit = self._undo.pop()
+        edit.undo(overlay)
+        self._redo.append(edit)
+        return True
+
+    def redo(self, overlay: SparseOverlay) -> bool:
+        if not self._redo:
+            return False
+        edit = self._redo.pop()
+        edit.redo(overlay)
+        self._undo.append(edit)
+        return True
+
+    def clear(self):
+        self._undo.clear()
+        self._redo.clear()
+        self._nbytes = 0
@@ -0,0 +1,147 @@
+"""
+@Author: Daryl Xu
+
+Volume whose slices are decoded from the DICOM files on first access
+"""
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor, Future
+from typing import List, Dict
+
+import numpy as np
+
+
+class LazyVolume:
+    """
+    按需解码的体数据，仅缓存最近使用的若干层
+    ndarray-like volume, slices are decoded on first access and kept in a bounded LRU.
+    Use np.asarray(volume) to get a contiguous array.
+    """
+    def __init__(self, files: List[str], shape: tuple, dtype: np.dtype, decode,
+                 max_slices: int = 64, workers: int = 2):
+        """
+        :param files: DICOM files sorted by the slice location
+        :param shape: (slice, rows, cols)
+        :param dtype:
+        :param decode: function to decode the pixel data of one file
+        :param max_slices: max number of the decoded slices kept in memory
+        :param workers: number of the prefetching threads
+        """
+        assert len(shape) == 3 and shape[0] == len(files)
+        self.files = files
+        self.shape = tuple(shape)
+        self.dtype = np.dtype(dtype)
+        self.max_slices = max_slices
+        self._decode = decode
+        self._slices: OrderedDict = OrderedDict()
+        self._pending: Dict[int, Future] = {}
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=workers)
+
+    @property
+    def ndim(self):
+        return 3
+
+    @property
+    def size(self):
+        return int(np.prod(self.shape))
+
+    @property
+    def nbytes(self):
+        return self.size * self.dtype.itemsize
+
+    @property
+    def resident_nbytes(self) -> int:
+        """
+        Memory held by the decoded slices
+        """
+        with self._lock:
+            return sum(arr.nbytes for arr in self._slices.values())
+
+    def __len__(self):
+        return self.shape[0]
+
+    def _load(self, index: int) -> np.ndarray:
+        arr = np.asarray(self._decode(self.files[index]), self.dtype)
+        with self._lock:
+            self._pending.pop(index, None)
+            self._slices[index] = arr
+            self._slices.move_to_end(index)
+            while len(self._slices) > self.max_slices:
+                self._slices.popitem(last=False)
+        return arr
+
+    def get_slice(self, index: int) -> np.ndarray:
+        """
+        :param index: index of the slice, negative index allowed
+        :return: decoded slice, read only
+        """
+        if index < 0:
+            index += self.shape[0]
+        if not 0 <= index < self.shape[0]:
+            raise IndexError(f'index {index} out of range')
+        with self._lock:
+            arr = self._slices.get(index)
+            if arr is not None:
+                self._slices.move_to_end(index)
+                return arr
+            future = self._pending.get(index)
+        if future is not None:
+            return future.result()
+        return self._load(index)
+
+    def prefetch(self, index: int, radius: int = 2):
+        """
+        Decode the slices next to the index in the background
+        :param index: current slice
+        :param radius: number of the slices on each side
+        :return:
+        """
+        for i in sorted(range(index - radius, index + radius + 1), key=lambda i: abs(i - index)):
+            if not 0 <= i < self.shape[0]:
+                continue
+            with self._lock:
+                if i in self._slices or i in self._pending:
+                    continue
+                self._pending[i] = self._executor.submit(self._load, i)
+
+    def __getitem__(self, item):
+        if isinstance(item, (int, np.integer)):
+            return self.get_slice(int(item))
+        if isinstance(item, tuple) and item and isinstance(item[0], (int, np.integer)):
+            return self.get_slice(int(item[0]))[item[1:]]
+        # Fancy or sliced indexing along the first axis
+        indices = np.arange(self.shape[0])[item if not isinstance(item, tuple) else item[0]]
+        arr = self._stack(np.atleast_1d(indices))
+        if isinstance(item, tuple):
+            arr = arr[(slice(None),) + item[1:]]
+        return arr
+
+    def _stack(self, indices) -> np.ndarray:
+        arr = np.empty((len(indices),) + self.shape[1:], self.dtype)
+        for i, index in enumerate(indices):
+            arr[i] = self.get_slice(int(index))
+        return arr
+
+    def __array__(self, dtype=None, copy=None):
+        """
+        Decode all the slices into a contiguous array, the array is not kept by the volume
+        """
+        arr = np.empty(self.shape, self.dtype)
+        futures = [self._executor.submit(self.get_slice, i) for i in range(self.shape[0])]
+        for i, future in enumerate(futures):
+            arr[i] = future.result()
+        if dtype is not None:
+            arr = arr.astype(dtype, copy=False)
+        return arr
+
+    def release(self):
+        """
+        Drop the decoded slices, they are decoded again on access
+        """
+        with self._lock:
+            self._slices.clear()
+
+    def close(self):
+        self._executor.shutdown(wait=False)
+        self._slices.clear()
@@ -0,0 +1,583 @@
+"""
+@Author: Daryl Xu
+
+Save and load the segmentation mask as NIfTI(.nii, .nii.gz), NRRD(.nrrd) or DICOM-SEG(.dcm).
+
+The mask is written slice by slice, a dense copy of the volume is never built. gzip is compressed
+in parallel: the chunks are deflated independently in a thread pool and joined into one gzip member
+(the way pigz does), readable by any gzip reader. Uncompressed files are memory-mapped when loaded.
+
+Voxel (i, j, k) of the files is (column, row, slice) of the volume, the slices in the order of State.dcm_files.
+"""
+import gzip
+import os
+import struct
+import time
+import zlib
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, List, Optional, Tuple, BinaryIO
+
+import numpy as np
+
+from utils import profiling
+from utils.overlay import SparseOverlay
+
+Progress = Optional[Callable[[int, int], None]]
+
+NIFTI_HEADER = struct.Struct('<i10s18sihcc8h3f4h8f3fhcc4f2i80s24s2h6f12f16s4s')
+NIFTI_VOX_OFFSET = 352
+NIFTI_DTYPES = {2: 'u1', 4: 'i2', 8: 'i4', 16: 'f4', 64: 'f8', 256: 'i1', 512: 'u2', 768: 'u4'}
+NRRD_DTYPES = {
+    'uchar': 'u1', 'unsigned char': 'u1', 'uint8': 'u1', 'uint8_t': 'u1',
+    'signed char': 'i1', 'int8': 'i1', 'int8_t': 'i1',
+    'short': 'i2', 'int16': 'i2', 'int16_t': 'i2', 'ushort': 'u2', 'uint16': 'u2', 'uint16_t': 'u2',
+    'int': 'i4', 'int32': 'i4', 'int32_t': 'i4', 'uint': 'u4', 'uint32': 'u4', 'uint32_t': 'u4',
+    'float': 'f4', 'double': 'f8',
+}
+SEGMENTATION_STORAGE = '1.2.840.10008.5.1.4.1.1.66.4'
+
+
+class MaskFormatException(Exception):
+    def __init__(self, msg, *args, **kwargs):
+        super(MaskFormatException, self).__init__(msg, *args)
+
+
+class ParallelGzipWriter:
+    """
+    Write one gzip member, the data is deflated in chunks by a thread pool.
+    zlib releases the GIL, so the chunks are compressed in parallel. At most 2 * workers chunks are in flight.
+    """
+    def __init__(self, fileobj: BinaryIO, level: int = 6, workers: int = None, chunk_bytes: int = 4 << 20):
+        self._file = fileobj
+        self._level = level
+        self._chunk_bytes = chunk_bytes
+        self._workers = workers or min(8, os.cpu_count() or 1)
+        self._executor = ThreadPoolExecutor(max_workers=self._workers)
+        self._pending = deque()
+        self._buffer = []
+        self._buffered = 0
+        self._crc = 0
+        self._size = 0
+        # header: magic, deflate, no flags, mtime, no extra flags, unknown OS
+        self._file.write(b'\x1f\x8b\x08\x00' + struct.pack('<I', int(time.time())) + b'\x00\xff')
+
+    def _deflate(self, data: bytes, last: bool) -> bytes:
+        compressor = zlib.compressobj(self._level, zlib.DEFLATED, -zlib.MAX_WBITS)
+        # A sync flush ends the chunk on a byte boundary without the final block, so the chunks can be joined
+        return compressor.compress(data) + compressor.flush(zlib.Z_FINISH if last else zlib.Z_SYNC_FLUSH)
+
+    def _submit(self, last: bool):
+        data = b''.join(self._buffer)
+        self._buffer, self._buffered = [], 0
+        self._pending.append(self._executor.submit(self._deflate, data, last))
+        while len(self._pending) > 2 * self._workers or (last and self._pending):
+            self._file.write(self._pending.popleft().result())
+
+    def write(self, data: bytes):
+        self._crc = zlib.crc32(data, self._crc)
+        self._size += len(data)
+        self._buffer.append(data)
+        self._buffered += len(data)
+        if self._buffered >= self._chunk_bytes:
+            self._submit(last=False)
+
+    def close(self):
+        try:
+            self._submit(last=True)
+            self._file.write(struct.pack('<II', self._crc & 0xffffffff, self._size & 0xffffffff))
+        finally:
+            self._executor.shutdown(wait=True)
+
+
+class _RawWriter:
+    def __init__(self, fileobj: BinaryIO):
+        self.write = fileobj.write
+
+    def close(self):
+        pass
+
+
+def _open_writer(fileobj: BinaryIO, compress: bool):
+    return ParallelGzipWriter(fileobj) if compress else _RawWriter(fileobj)
+
+
+def _write_slices(writer, overlay, progress: Progress):
+    total = overlay.shape[0]
+    for index in range(total):
+        writer.write((np.asarray(overlay[index]) != 0).astype(np.uint8).tobytes())
+        if progress is not None:
+            progress(index + 1, total)
+
+
+def get_affine(headers: Optional[list], shape: Tuple[int, int, int], spacing: Tuple[float, float, float]) \
+        -> np.ndarray:
+    """
+    Map the voxel (column, row, slice) to the patient coordinate(LPS, mm)
+    :param headers: DcmHeader of the slices in the order of the volume, the spacing is used without them
+    :param shape:
+    :param spacing: (slice, row, column)
+    :return: 4x4 matrix
+    """
+    affine = np.diag([spacing[2] or 1., spacing[1] or 1., spacing[0] or 1., 1.])
+    if not headers or headers[0].position is None or headers[0].orientation is None:
+        return affine
+    row_dir = np.array(headers[0].orientation[:3])
+    col_dir = np.array(headers[0].orientation[3:])
+    first = np.array(headers[0].position)
+    if len(headers) > 1 and headers[-1].position is not None:
+        step = (np.array(headers[-1].position) - first) / (len(headers) - 1)
+    else:
+        step = np.cross(row_dir, col_dir) * (spacing[0] or 1.)
+    # PixelSpacing is (between the rows, between the columns)
+    affine[:3, 0] = row_dir * (spacing[2] or 1.)
+    affine[:3, 1] = col_dir * (spacing[1] or 1.)
+    affine[:3, 2] = step
+    affine[:3, 3] = first
+    return affine
+
+
+def _read_headers(files: List[str]) -> list:
+    from utils import dicom
+    with ThreadPoolExecutor() as executor:
+        return list(executor.map(dicom.read_header, files))
+
+
+def _to_sparse(source, shape: Tuple[int, int, int], dtype: np.dtype, progress: Progress) -> SparseOverlay:
+    """
+    :param source: memmap of the whole data or a file object positioned at the data
+    """
+    overlay = SparseOverlay(shape)
+    slice_shape = shape[1:]
+    slice_bytes = int(np.prod(slice_shape)) * dtype.itemsize
+    for index in range(shape[0]):
+        if isinstance(source, np.ndarray):
+            arr = source[index]
+        else:
+            data = source.read(slice_bytes)
+            if len(data) != slice_bytes:
+                raise MaskFormatException('Truncated data')
+            arr = np.frombuffer(data, dtype).reshape(slice_shape)
+        if arr.any():
+            overlay.set_slice(index, arr)
+        if progress is not None:
+            progress(index + 1, shape[0])
+    return overlay
+
+
+def _check_shape(shape: Tuple[int, ...], expected: Tuple[int, int, int]):
+    if expected is not None and tuple(shape) != tuple(expected):
+        raise MaskFormatException(f'The shape of the mask {tuple(shape)} does not match the volume {tuple(expected)}')
+
+
+# NIfTI-1
+
+def save_nifti(path: str, overlay, spacing: Tuple[float, float, float], headers: list = None,
+               progress: Progress = None):
+    slices, rows, cols = overlay.shape
+    # NIfTI is RAS, the DICOM patient coordinate is LPS
+    affine = np.diag([-1., -1., 1., 1.]) @ get_affine(headers, overlay.shape, spacing)
+    pixdim = np.sqrt((affine[:3, :3] ** 2).sum(axis=0))
+    header = NIFTI_HEADER.pack(
+        348, b'', b'', 0, 0, b'r', b'\0',
+        3, cols, rows, slices, 1, 1, 1, 1,
+        0., 0., 0.,
+        0, 2, 8, 0,  # intent_code, datatype(uint8), bitpix, slice_start
+        1., *pixdim, 0., 0., 0., 0.,
+        NIFTI_VOX_OFFSET, 1., 0.,
+        0, b'\0', b'\x02',  # slice_end, slice_code, xyzt_units(mm)
+        1., 0., 0., 0.,
+        1, 0,
+        b'medical-image-viewer mask', b'',
+        0, 1,  # qform_code, sform_code(scanner)
+        0., 0., 0., 0., 0., 0.,
+        *affine[0], *affine[1], *affine[2],
+        b'', b'n+1\0')
+    with open(path, 'wb') as f:
+        writer = _open_writer(f, path.endswith('.gz'))
+        writer.write(header + b'\0' * (NIFTI_VOX_OFFSET - NIFTI_HEADER.size))
+        _write_slices(writer, overlay, progress)
+        writer.close()
+
+
+def _parse_nifti_header(data: bytes):
+    endian = '<' if struct.unpack('<i', data[:4])[0] == 348 else '>'
+    fields = struct.Struct(endian + NIFTI_HEADER.format[1:]).unpack(data[:NIFTI_HEADER.size])
+    if fields[-1] not in (b'n+1\0', b'ni1\0'):
+        raise MaskFormatException('Not a NIfTI-1 file')
+    if fields[-1] == b'ni1\0':
+        raise MaskFormatException('The detached NIfTI(.hdr/.img) is not supported')
+    dim = fields[7: 15]
+    datatype = fields[19]
+    vox_offset = int(fields[30])
+    if datatype not in NIFTI_DTYPES:
+        raise MaskFormatException(f'Unsupported NIfTI datatype: {datatype}')
+    if dim[0] < 3 or any(n > 1 for n in dim[4: dim[0] + 1]):
+        raise MaskFormatException(f'Not a 3D image, dim: {dim}')
+    return (dim[3], dim[2], dim[1]), np.dtype(endian + NIFTI_DTYPES[datatype]), vox_offset
+
+
+def load_nifti(path: str, shape: Tuple[int, int, int] = None, progress: Progress = None) -> SparseOverlay:
+    if path.endswith('.gz'):
+        with gzip.open(path, 'rb') as f:
+            data_shape, dtype, vox_offset = _parse_nifti_header(f.read(NIFTI_HEADER.size))
+            _check_shape(data_shape, shape)
+            f.read(vox_offset - NIFTI_HEADER.size)
+            return _to_sparse(f, data_shape, dtype, progress)
+    with open(path, 'rb') as f:
+        data_shape, dtype, vox_offset = _parse_nifti_header(f.read(NIFTI_HEADER.size))
+    _check_shape(data_shape, shape)
+    data = np.memmap(path, dtype, 'r', offset=vox_offset, shape=data_shape)
+    return _to_sparse(data, data_shape, dtype, progress)
+
+
+# NRRD
+
+def save_nrrd(path: str, overlay, spacing: Tuple[float, float, float], headers: list = None,
+              progress: Progress = None, compress: bool = True):
+    slices, rows, cols = overlay.shape
+    affine = get_affine(headers, overlay.shape, spacing)
+    directions = ' '.join('({:.6g},{:.6g},{:.6g})'.format(*affine[:3, i]) for i in range(3))
+    lines = [
+        'NRRD0004',
+        '# medical-image-viewer mask',
+        'type: uint8',
+        'dimension: 3',
+        f'sizes: {cols} {rows} {slices}',
+        'space: left-posterior-superior',
+        f'space directions: {directions}',
+        'space origin: ({:.6g},{:.6g},{:.6g})'.format(*affine[:3, 3]),
+        'kinds: domain domain domain',
+        'endian: little',
+        f'encoding: {"gzip" if compress else "raw"}',
+    ]
+    with open(path, 'wb') as f:
+        f.write(('\n'.join(lines) + '\n\n').encode('ascii'))
+        writer = _open_writer(f, compress)
+        _write_slices(writer, overlay, progress)
+        writer.close()
+
+
+def load_nrrd(path: str, shape: Tuple[int, int, int] = None, progress: Progress = None) -> SparseOverlay:
+    fields = {}
+    with open(path, 'rb') as f:
+        if not f.readline().startswith(b'NRRD'):
+            raise MaskFormatException('Not a NRRD file')
+        for line in f:
+            line = line.decode('latin-1').rstrip('\r\n')
+            if not line:
+                break
+            if line.startswith('#') or ':' not in line:
+                continue
+            key, _, value = line.partition(':')
+            fields[key.strip().lower()] = value.lstrip('=').strip()
+        offset = f.tell()
+    if 'data file' in fields or 'datafile' in fields:
+        raise MaskFormatException('The detached NRRD(.nhdr) is not supported')
+    sizes = [int(v) for v in fields.get('sizes', '').split()]
+    if len(sizes) != 3:
+        raise MaskFormatException(f'Not a 3D image, sizes: {sizes}')
+    type_ = fields.get('type', '').lower()
+    if type_ not in NRRD_DTYPES:
+        raise MaskFormatException(f'Unsupported NRRD type: {type_}')
+    endian = '>' if fields.get('endian') == 'big' else '<'
+    dtype = np.dtype(endian + NRRD_DTYPES[type_])
+    data_shape = (sizes[2], sizes[1], sizes[0])
+    _check_shape(data_shape, shape)
+
+    encoding = fields.get('encoding', 'raw')
+    if encoding == 'raw':
+        data = np.memmap(path, dtype, 'r', offset=offset, shape=data_shape)
+        return _to_sparse(data, data_shape, dtype, progress)
+    if encoding in ('gzip', 'gz'):
+        with open(path, 'rb') as raw:
+            raw.seek(offset)
+            with gzip.GzipFile(fileobj=raw, mode='rb') as f:
+                return _to_sparse(f, data_shape, dtype, progress)
+    raise MaskFormatException(f'Unsupported NRRD encoding: {encoding}')
+
+
+# DICOM-SEG
+
+def _code(value: str, scheme: str, meaning: str):
+    from pydicom.dataset import Dataset
+    code = Dataset()
+    code.CodeValue = value
+    code.CodingSchemeDesignator = scheme
+    code.CodeMeaning = meaning
+    return code
+
+
+def save_dicom_seg(path: str, overlay, spacing: Tuple[float, float, float], files: List[str],
+                   headers: list = None, progress: Progress = None):
+    """
+    Binary segmentation with one segment, a frame for every slice with segmented voxels.
+    The frames reference the source images by the SOP Instance UID.
+    The packed pixel data(1 bit per voxel) of the non-empty slices is held in the memory.
+    """
+    import pydicom
+    from pydicom.dataset import Dataset, FileDataset, FileMetaDataset
+    from pydicom.sequence import Sequence
+    from pydicom.tag import Tag
+    from pydicom.uid import ExplicitVRLittleEndian, generate_uid
+
+    if not files or len(files) != overlay.shape[0]:
+        raise MaskFormatException('DICOM-SEG needs the DICOM files of the volume')
+    headers = headers or _read_headers(files)
+    source = pydicom.dcmread(files[0], stop_before_pixels=True, force=True)
+    slices, rows, cols = overlay.shape
+
+    meta = FileMetaDataset()
+    meta.MediaStorageSOPClassUID = SEGMENTATION_STORAGE
+    meta.MediaStorageSOPInstanceUID = generate_uid()
+    meta.TransferSyntaxUID = ExplicitVRLittleEndian
+    ds = FileDataset(path, {}, file_meta=meta, preamble=b'\0' * 128)
+    for keyword in ('PatientName', 'PatientID', 'PatientBirthDate', 'PatientSex', 'StudyInstanceUID', 'StudyDate',
+                    'StudyTime', 'StudyID', 'AccessionNumber', 'ReferringPhysicianName', 'FrameOfReferenceUID'):
+        setattr(ds, keyword, source.get(keyword, ''))
+    now = time.localtime()
+    ds.SOPClassUID = SEGMENTATION_STORAGE
+    ds.SOPInstanceUID = meta.MediaStorageSOPInstanceUID
+    ds.Modality = 'SEG'
+    ds.SeriesInstanceUID = generate_uid()
+    ds.SeriesNumber = 300
+    ds.InstanceNumber = 1
+    ds.ContentDate = time.strftime('%Y%m%d', now)
+    ds.ContentTime = time.strftime('%H%M%S', now)
+    ds.Manufacturer = 'medical-image-viewer'
+    ds.ManufacturerModelName = 'medical-image-viewer'
+    ds.DeviceSerialNumber = '0'
+    ds.SoftwareVersions = '1.0.0'
+    ds.ImageType = ['DERIVED', 'PRIMARY']
+    ds.ContentLabel = 'MASK'
+    ds.ContentDescription = 'Segmentation'
+    ds.ContentCreatorName = ''
+    ds.SegmentationType = 'BINARY'
+    ds.LossyImageCompression = '00'
+    ds.SamplesPerPixel = 1
+    ds.PhotometricInterpretation = 'MONOCHROME2'
+    ds.Rows, ds.Columns = rows, cols
+    ds.BitsAllocated = ds.BitsStored = 1
+    ds.HighBit = 0
+    ds.PixelRepresentation = 0
+
+    segment = Dataset()
+    segment.SegmentNumber = 1
+    segment.SegmentLabel = 'Lesion'
+    segment.SegmentAlgorithmType = 'SEMIAUTOMATIC'
+    segment.SegmentAlgorithmName = 'region grow'
+    segment.SegmentedPropertyCategoryCodeSequence = Sequence([
+        _code('49755003', 'SCT', 'Morphologically Altered Structure')])
+    segment.SegmentedPropertyTypeCodeSequence = Sequence([_code('4147007', 'SCT', 'Mass')])
+    ds.SegmentSequence = Sequence([segment])
+
+    dimension_uid = generate_uid()
+    dimensions = []
+    for pointer, group in (('ReferencedSegmentNumber', 'SegmentIdentificationSequence'),
+                           ('ImagePositionPatient', 'PlanePositionSequence')):
+        item = Dataset()
+        item.DimensionOrganizationUID = dimension_uid
+        item.DimensionIndexPointer = Tag(pointer)
+        item.FunctionalGroupPointer = Tag(group)
+        dimensions.append(item)
+    organization = Dataset()
+    organization.DimensionOrganizationUID = dimension_uid
+    ds.DimensionOrganizationSequence = Sequence([organization])
+    ds.DimensionIndexSequence = Sequence(dimensions)
+
+    shared = Dataset()
+    measures = Dataset()
+    measures.PixelSpacing = [spacing[1], spacing[2]]
+    measures.SliceThickness = spacing[0]
+    measures.SpacingBetweenSlices = spacing[0]
+    shared.PixelMeasuresSequence = Sequence([measures])
+    if headers[0].orientation is not None:
+        orientation = Dataset()
+        orientation.ImageOrientationPatient = list(headers[0].orientation)
+        shared.PlaneOrientationSequence = Sequence([orientation])
+    ds.SharedFunctionalGroupsSequence = Sequence([shared])
+
+    affine = get_affine(headers, overlay.shape, spacing)
+    frames, chunks = [], []
+    aligned = rows * cols % 8 == 0
+    for index in range(slices):
+        mask = np.asarray(overlay[index]) != 0
+        if mask.any():
+            frames.append(index)
+            # The frames are packed one after another, the first pixel in the least significant bit
+            chunks.append(np.packbits(mask, axis=None, bitorder='little') if aligned else mask.ravel())
+        if progress is not None:
+            progress(index + 1, slices)
+    pixel_data = np.concatenate(chunks) if chunks else np.zeros(0, np.uint8)
+    if not aligned:
+        pixel_data = np.packbits(pixel_data, bitorder='little')
+
+    per_frame = []
+    for number, index in enumerate(frames, 1):
+        header = headers[index]
+        item = Dataset()
+        content = Dataset()
+        content.DimensionIndexValues = [1, number]
+        item.FrameContentSequence = Sequence([content])
+        position = Dataset()
+        position.ImagePositionPatient = list(header.position) if header.position is not None \
+            else [float(v) for v in affine[:3] @ [0, 0, index, 1]]
+        item.PlanePositionSequence = Sequence([position])
+        referenced = Dataset()
+        referenced.ReferencedSOPClassUID = header.sop_class_uid
+        referenced.ReferencedSOPInstanceUID = header.sop_uid
+        referenced.PurposeOfReferenceCodeSequence = Sequence([
+            _code('121322', 'DCM', 'Source image for image processing operation')])
+        derivation = Dataset()
+        derivation.SourceImageSequence = Sequence([referenced])
+        derivation.DerivationCodeSequence = Sequence([_code('113076', 'DCM', 'Segmentation')])
+        item.DerivationImageSequence = Sequence([derivation])
+        identification = Dataset()
+        identification.ReferencedSegmentNumber = 1
+        item.SegmentIdentificationSequence = Sequence([identification])
+        per_frame.append(item)
+    ds.PerFrameFunctionalGroupsSequence = Sequence(per_frame)
+    ds.NumberOfFrames = len(frames)
+
+    instances = []
+    for header in headers:
+        instance = Dataset()
+        instance.ReferencedSOPClassUID = header.sop_class_uid
+        instance.ReferencedSOPInstanceUID = header.sop_uid
+        instances.append(instance)
+    series = Dataset()
+    series.SeriesInstanceUID = headers[0].series_uid
+    series.ReferencedInstanceSequence = Sequence(instances)
+    ds.ReferencedSeriesSequence = Sequence([series])
+
+    if pixel_data.size % 2:
+        pixel_data = np.append(pixel_data, np.uint8(0))
+    ds.PixelData = pixel_data.tobytes()
+    ds['PixelData'].VR = 'OB'
+    ds.save_as(path, write_like_original=False)
+
+
+def load_dicom_seg(path: str, shape: Tuple[int, int, int], files: List[str], headers: list = None,
+                   progress: Progress = None) -> SparseOverlay:
+    """
+    The frames are placed by the referenced SOP Instance UID, or by the position if the reference is missing.
+    All the segments are merged.
+    """
+    import pydicom
+
+    ds = pydicom.dcmread(path, force=True)
+    if str(ds.get('SOPClassUID', '')) != SEGMENTATION_STORAGE:
+        raise MaskFormatException('Not a DICOM segmentation')
+    if not files or len(files) != shape[0]:
+        raise MaskFormatException('DICOM-SEG needs the DICOM files of the volume')
+    rows, cols = int(ds.Rows), int(ds.Columns)
+    _check_shape((shape[0], rows, cols), shape)
+    headers = headers or _read_headers(files)
+    by_uid = {header.sop_uid: i for i, header in enumerate(headers)}
+    positions = np.array([header.position if header.position is not None else (np.nan,) * 3 for header in headers])
+
+    frame_count = int(ds.get('NumberOfFrames', 1) or 1)
+    frame_pixels = rows * cols
+    binary = int(ds.BitsAllocated) == 1
+    data = np.frombuffer(ds.PixelData, np.uint8)
+    overlay = SparseOverlay(shape)
+    for number, item in enumerate(ds.PerFrameFunctionalGroupsSequence):
+        if number >= frame_count:
+            break
+        index = None
+        try:
+            uid = item.DerivationImageSequence[0].SourceImageSequence[0].ReferencedSOPInstanceUID
+            index = by_uid.get(str(uid))
+        except (AttributeError, IndexError):
+            pass
+        if index is None and 'PlanePositionSequence' in item:
+            position = np.array([float(v) for v in item.PlanePositionSequence[0].ImagePositionPatient])
+            distances = np.linalg.norm(positions - position, axis=1)
+            if not np.all(np.isnan(distances)):
+                index = int(np.nanargmin(distances))
+        if index is None:
+            raise MaskFormatException(f'Cannot locate the frame {number + 1} in the volume')
+        if binary:
+            start = number * frame_pixels
+            chunk = data[start // 8: (start + frame_pixels + 7) // 8 + 1]
+            bits = np.unpackbits(chunk, bitorder='little')[start % 8: start % 8 + frame_pixels]
+            mask = bits.reshape(rows, cols)
+        else:
+            mask = data[number * frame_pixels: (number + 1) * frame_pixels].reshape(rows, cols)
+        if mask.any():
+            overlay.set_slice(index, np.logical_or(overlay.get_slice(index), mask))
+        if progress is not None:
+            progress(number + 1, frame_count)
+    return overlay
+
+
+# Entry
+
+FORMATS = {
+    'NIfTI (*.nii.gz *.nii)': ('.nii.gz', '.nii'),
+    'NRRD (*.nrrd)': ('.nrrd',),
+    'DICOM-SEG (*.dcm)': ('.dcm',),
+}
+
+
+def get_format(path: str) -> str:
+    lower = path.lower()
+    if lower.endswith('.nii') or lower.endswith('.nii.gz'):
+        return 'nifti'
+    if lower.endswith('.nrrd'):
+        return 'nrrd'
+    if lower.endswith('.dcm'):
+        return 'dicom-seg'
+    raise MaskFormatException(f'Unknown mask format: {os.path.basename(path)}')
+
+
+@profiling.timed('save_mask')
+def save_mask(path: str, overlay, spacing: Tuple[float, float, float], files: List[str] = None,
+              progress: Progress = None):
+    """
+    Save the overlay, the format is given by the extension
+    :param path:
+    :param overlay: SparseOverlay or array, indexed slice by slice
+    :param spacing: (slice, row, column)
+    :param files: DICOM files of the volume, for the geometry and the references of DICOM-SEG
+    :param progress: callback(finished slices, total)
+    :return:
+    """
+    format_ = get_format(path)
+    headers = None
+    if files and len(files) == overlay.shape[0]:
+        try:
+            headers = _read_headers(files)
+        except (OSError, AttributeError, KeyError, ValueError):
+            # Not DICOM(jpg series), saved without the geometry
+            headers = None
+    if format_ == 'dicom-seg':
+        if headers is None:
+            raise MaskFormatException('DICOM-SEG needs the DICOM files of the volume')
+        save_dicom_seg(path, overlay, spacing, files, headers, progress)
+    elif format_ == 'nrrd':
+        save_nrrd(path, overlay, spacing, headers, progress)
+    else:
+        save_nifti(path, overlay, spacing, headers, progress)
+
+
+@profiling.timed('load_mask')
+def load_mask(path: str, shape: Tuple[int, int, int], files: List[str] = None,
+              progress: Progress = None) -> SparseOverlay:
+    """
+    Load the mask saved by save_mask or by another program on the same grid
+    :param path:
+    :param shape: shape of the volume, the mask must have the same shape
+    :param files: DICOM files of the volume, needed by DICOM-SEG
+    :param progress: callback(finished, total)
+    :return:
+    """
+    format_ = get_format(path)
+    try:
+        if format_ == 'dicom-seg':
+            return load_dicom_seg(path, shape, files, progress=progress)
+        if format_ == 'nrrd':
+            return load_nrrd(path, shape, progress)
+        return load_nifti(path, shape, progress)
+    except (OSError, EOFError, struct.error, zlib.error, ValueError) as e:
+        raise MaskFormatException(f'Failed to read {os.path.basename(path)}: {e}')
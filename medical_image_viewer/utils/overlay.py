@@ -0,0 +1,247 @@
+"""
+@Author: Daryl Xu
+
+Compact storage of the segmentation overlay
+"""
+import itertools
+from typing import Dict, Tuple
+
+import numpy as np
+
+# Versions are unique among all the overlays, a replaced overlay never reuses a version
+_versions = itertools.count(1)
+
+
+class SparseOverlay:
+    """
+    稀疏存储的分割结果：每层只保存非零区域的包围盒，并按位压缩
+    Overlay stored slice by slice, only the bounding box of the non-zero voxels of a slice is kept,
+    bit-packed. The number of the segmented voxels is maintained by every write.
+    Indexing with an integer gives the dense np.int8 slice, np.asarray(overlay) gives the dense volume.
+    """
+    dtype = np.dtype(np.int8)
+    ndim = 3
+
+    def __init__(self, shape: Tuple[int, int, int]):
+        assert len(shape) == 3
+        self.shape = tuple(int(n) for n in shape)
+        # index: (x0, y0, shape of the box, packed bits, voxel count)
+        self._slices: Dict[int, tuple] = {}
+        self._count = 0
+        self._versions: Dict[int, int] = {}
+        self._version = next(_versions)
+        # The latest version of any slice
+        self.generation = self._version
+
+    @classmethod
+    def from_dense(cls, overlay: np.ndarray) -> 'SparseOverlay':
+        sparse = cls(overlay.shape)
+        for index in range(overlay.shape[0]):
+            sparse.set_slice(index, overlay[index])
+        return sparse
+
+    @property
+    def count(self) -> int:
+        """
+        Number of the segmented voxels
+        """
+        return self._count
+
+    def sum(self) -> int:
+        return self._count
+
+    def version(self, index: int) -> int:
+        """
+        Version of the slice, changes on every write of the slice
+        """
+        return self._versions.get(index, self._version)
+
+    def slice_count(self, index: int) -> int:
+        entry = self._slices.get(index)
+        return entry[4] if entry is not None else 0
+
+    @property
+    def nbytes(self) -> int:
+        return sum(entry[3].nbytes for entry in self._slices.values())
+
+    def __len__(self):
+        return self.shape[0]
+
+    def get_slice(self, index: int) -> np.ndarray:
+        """
+        :param index:
+        :return: dense np.int8 slice, a new array
+        """
+        if index < 0:
+            index += self.shape[0]
+        if not 0 <= index < self.shape[0]:
+            raise IndexError(f'index {index} out of range')
+        arr = np.zeros(self.shape[1:], np.int8)
+        entry = self._slices.get(index)
+        if entry is not None:
+            x0, y0, (w, h), bits, _ = entry
+            arr[x0: x0 + w, y0: y0 + h] = np.unpackbits(bits, count=w * h).reshape(w, h)
+        return arr
+
+    def set_slice(self, index: int, arr: np.ndarray):
+        """
+        Replace the whole slice
+        :param index:
+        :param arr: any dtype, non-zero means segmented
+        :return:
+        """
+        assert arr.shape == self.shape[1:]
+        self._store(index, np.asarray(arr) != 0)
+
+    def _store(self, index: int, mask: np.ndarray, count: int = None, x0: int = 0, y0: int = 0):
+        """
+        :param index:
+        :param mask: bool slice, or a box of the slice at (x0, y0) with nothing segmented outside of it
+        :param count: number of the voxels of the mask, counted if None
+        :param x0:
+        :param y0:
+        :return:
+        """
+        old = self._slices.pop(index, None)
+        self._versions[index] = self.generation = next(_versions)
+        if old is not None:
+            self._count -= old[4]
+        xs = np.nonzero(mask.any(axis=1))[0]
+        if xs.size == 0:
+            return
+        ys = np.nonzero(mask.any(axis=0))[0]
+        box = mask[xs[0]: xs[-1] + 1, ys[0]: ys[-1] + 1]
+        if count is None:
+            count = int(np.count_nonzero(box))
+        self._slices[index] = (int(x0 + xs[0]), int(y0 + ys[0]), box.shape, np.packbits(box, axis=None), count)
+        self._count += count
+
+    def get_entries(self, indices=None) -> Dict[int, tuple]:
+        """
+        The compressed slices, the entries are immutable and can be kept for the history
+        :param indices: all the slices if None
+        :return: {index: entry or None}
+        """
+        if indices is None:
+            return dict(self._slices)
+        return {index: self._slices.get(index) for index in indices}
+
+    def set_entries(self, entries: Dict[int, tuple]):
+        """
+        Restore the compressed slices got by get_entries
+        :param entries: {index: entry or None}
+        :return:
+        """
+        for index, entry in entries.items():
+            self._versions[index] = self.generation = next(_versions)
+            old = self._slices.pop(index, None)
+            if old is not None:
+                self._count -= old[4]
+            if entry is not None:
+                self._slices[index] = entry
+                self._count += entry[4]
+
+    @staticmethod
+    def entry_nbytes(entry: tuple) -> int:
+        return entry[3].nbytes if entry is not None else 0
+
+    def get_region(self, index: int, x0: int, y0: int, w: int, h: int) -> np.ndarray:
+        """
+        :return: dense np.int8 rectangle of the slice, clipped by the border of the slice
+        """
+        w, h = max(min(w, self.shape[1] - x0), 0), max(min(h, self.shape[2] - y0), 0)
+        arr = np.zeros((w, h), np.int8)
+        entry = self._slices.get(index)
+        if entry is not None:
+            bx0, by0, (bw, bh), bits, _ = entry
+            # Intersection of the rectangle and the box of the slice
+            ix0, iy0 = max(x0, bx0), max(y0, by0)
+            ix1, iy1 = min(x0 + w, bx0 + bw), min(y0 + h, by0 + bh)
+            if ix0 < ix1 and iy0 < iy1:
+                box = np.unpackbits(bits, count=bw * bh).reshape(bw, bh)
+                arr[ix0 - x0: ix1 - x0, iy0 - y0: iy1 - y0] = box[ix0 - bx0: ix1 - bx0, iy0 - by0: iy1 - by0]
+        return arr
+
+    def set_region(self, index: int, x0: int, y0: int, arr: np.ndarray):
+        """
+        Write the rectangle of the slice, the voxel count is updated by the difference in the rectangle.
+        Only the union of the rectangle and the box of the slice is unpacked, not the whole slice.
+        :param index:
+        :param x0:
+        :param y0:
+        :param arr: clipped by the border of the slice
+        :return:
+        """
+        arr = np.asarray(arr)
+        w, h = min(arr.shape[0], self.shape[1] - x0), min(arr.shape[1], self.shape[2] - y0)
+        new = arr[: w, : h] != 0
+        ux0, uy0, ux1, uy1 = x0, y0, x0 + w, y0 + h
+        entry = self._slices.get(index)
+        if entry is not None:
+            bx0, by0, (bw, bh), bits, _ = entry
+            ux0, uy0, ux1, uy1 = min(ux0, bx0), min(uy0, by0), max(ux1, bx0 + bw), max(uy1, by0 + bh)
+        current = np.zeros((ux1 - ux0, uy1 - uy0), bool)
+        if entry is not None:
+            current[bx0 - ux0: bx0 - ux0 + bw, by0 - uy0: by0 - uy0 + bh] = \
+                np.unpackbits(bits, count=bw * bh).reshape(bw, bh)
+        region = current[x0 - ux0: x0 - ux0 + w, y0 - uy0: y0 - uy0 + h]
+        count = self.slice_count(index) + int(np.count_nonzero(new)) - int(np.count_nonzero(region))
+        region[...] = new
+        self._store(index, current, count, ux0, uy0)
+
+    def get_block(self, start: Tuple[int, int, int], shape: Tuple[int, int, int]) -> np.ndarray:
+        """
+        :param start: (slice, x, y)
+        :param shape:
+        :return: dense block, clipped by the border of the overlay
+        """
+        z0, x0, y0 = start
+        z1 = min(z0 + shape[0], self.shape[0])
+        return np.stack([self.get_region(z, x0, y0, shape[1], shape[2]) for z in range(z0, z1)])
+
+    def set_block(self, start: Tuple[int, int, int], block: np.ndarray):
+        """
+        Write the block slice by slice
+        :param start: (slice, x, y)
+        :param block:
+        :return:
+        """
+        z0, x0, y0 = start
+        for k in range(min(block.shape[0], self.shape[0] - z0)):
+            self.set_region(z0 + k, x0, y0, block[k])
+
+    def take_plane(self, axis: int, index: int) -> np.ndarray:
+        """
+        The dense plane at the index along the axis, only the slices crossing the plane are decoded
+        :param axis: 0, 1 or 2
+        :param index:
+        :return: (x, y) for axis 0, (slice, y) for axis 1 and (slice, x) for axis 2
+        """
+        if axis == 0:
+            return self.get_slice(index)
+        arr = np.zeros((self.shape[0], self.shape[3 - axis]), np.int8)
+        for z, (x0, y0, (w, h), bits, _) in self._slices.items():
+            start, size = (x0, w) if axis == 1 else (y0, h)
+            if not start <= index < start + size:
+                continue
+            box = np.unpackbits(bits, count=w * h).reshape(w, h)
+            if axis == 1:
+                arr[z, y0: y0 + h] = box[index - x0]
+            else:
+                arr[z, x0: x0 + w] = box[:, index - y0]
+        return arr
+
+    def __getitem__(self, item):
+        if isinstance(item, (int, np.integer)):
+            return self.get_slice(int(item))
+        if isinstance(item, tuple) and item and isinstance(item[0], (int, np.integer)):
+            return self.get_slice(int(item[0]))[item[1:]]
+        return np.asarray(self)[item]
+
+    def __array__(self, dtype=None, copy=None):
+        arr = np.zeros(self.shape, np.int8)
+        for index in self._slices:
+            arr[index] = self.get_slice(index)
+        if dtype is not None:
+            arr = arr.astype(dtype, copy=False)
+        return arr
@@ -0,0 +1,199 @@
+"""
+@Author: Daryl Xu
+
+Index of the segmented voxels: count, bounding box, coordinate sums and intensity sums of every slice.
+The statistics of the slices, of the region and the first/last segmented slice are computed from the
+index in O(slices). The index follows the versions of the overlay slices, only the changed slices
+are indexed again, within their bounding boxes.
+"""
+from typing import NamedTuple, Optional, Tuple
+
+import numpy as np
+
+from utils.overlay import SparseOverlay
+
+
+class SliceStatistics(NamedTuple):
+    index: int
+    count: int
+    # mm2
+    area: float
+    # (x0, x1, y0, y1), the stops excluded
+    bbox: Tuple[int, int, int, int]
+    # (x, y)
+    centroid: Tuple[float, float]
+    mean: float
+    std: float
+
+
+class RegionStatistics(NamedTuple):
+    count: int
+    # mm3
+    volume: float
+    # (z0, z1, x0, x1, y0, y1), the stops excluded
+    bbox: Tuple[int, int, int, int, int, int]
+    # (z, x, y)
+    centroid: Tuple[float, float, float]
+    mean: float
+    std: float
+    first: int
+    last: int
+
+
+def _mean_std(count, total, total2) -> Tuple[float, float]:
+    if not count:
+        return float('nan'), float('nan')
+    mean = total / count
+    return float(mean), float(np.sqrt(max(total2 / count - mean * mean, 0.)))
+
+
+class OverlayIndex:
+    """
+    分割结果索引
+    Call sync() before reading, it indexes the slices changed since the last call.
+    """
+    def __init__(self, slices: int):
+        self._overlay: Optional[SparseOverlay] = None
+        self._volume = None
+        # Generation of the overlay at the last sync, nothing changed if it is the same
+        self._generation = -1
+        # Version of the overlay slice indexed, -1: not indexed
+        self.versions = np.full(slices, -1, np.int64)
+        self.counts = np.zeros(slices, np.int64)
+        # (x0, x1, y0, y1) of every slice
+        self.bboxes = np.zeros((slices, 4), np.int64)
+        # Sums of x, y, the intensity and the squared intensity of the segmented voxels
+        self.sums = np.zeros((slices, 4), np.float64)
+
+    def sync(self, overlay: SparseOverlay, volume) -> int:
+        """
+        :param overlay:
+        :param volume: intensities of the voxels, read only in the bounding boxes of the changed slices
+        :return: number of the slices indexed
+        """
+        if overlay is not self._overlay or volume is not self._volume:
+            self._overlay, self._volume = overlay, volume
+            self.versions[:] = -1
+            self._generation = -1
+        if overlay is None:
+            self.counts[:] = 0
+            return 0
+        if overlay.generation == self._generation:
+            return 0
+        versions = np.fromiter((overlay.version(i) for i in range(len(self.versions))), np.int64,
+                               len(self.versions))
+        changed = np.nonzero(versions != self.versions)[0]
+        if changed.size:
+            entries = overlay.get_entries(changed.tolist())
+            for index in changed:
+                self._index_slice(int(index), entries[index])
+            self.versions[changed] = versions[changed]
+        self._generation = overlay.generation
+        return int(changed.size)
+
+    def rebind(self, volume):
+        """
+        The volume was replaced by a copy of the same values(memory-mapped etc.), the index stays valid
+        """
+        self._volume = volume
+
+    def _index_slice(self, index: int, entry: Optional[tuple]):
+        if entry is None:
+            self.counts[index] = 0
+            self.bboxes[index] = 0
+            self.sums[index] = 0
+            return
+        x0, y0, (w, h), bits, _ = entry
+        self._index_box(index, x0, y0, np.unpackbits(bits, count=w * h).reshape(w, h).astype(bool))
+
+    def _index_box(self, index: int, x0: int, y0: int, box: np.ndarray):
+        """
+        :param box: bool mask of the segmented voxels in a box of the slice starting at (x0, y0)
+        """
+        rows, cols = box.any(axis=1), box.any(axis=0)
+        count = int(np.count_nonzero(box))
+        self.counts[index] = count
+        if not count:
+            self.bboxes[index] = 0
+            self.sums[index] = 0
+            return
+        xs, ys = np.nonzero(rows)[0], np.nonzero(cols)[0]
+        self.bboxes[index] = (x0 + xs[0], x0 + xs[-1] + 1, y0 + ys[0], y0 + ys[-1] + 1)
+        w, h = box.shape
+        values = np.asarray(self._volume[index])[x0: x0 + w, y0: y0 + h][box].astype(np.float64)
+        self.sums[index] = (box.sum(axis=1) @ np.arange(x0, x0 + w, dtype=np.float64),
+                            box.sum(axis=0) @ np.arange(y0, y0 + h, dtype=np.float64),
+                            values.sum(), np.square(values).sum())
+
+    @property
+    def segmented(self) -> np.ndarray:
+        """
+        Indices of the segmented slices
+        """
+        return np.nonzero(self.counts)[0]
+
+    @property
+    def first(self) -> int:
+        """
+        First segmented slice, -1 if nothing segmented
+        """
+        indices = self.segmented
+        return int(indices[0]) if indices.size else -1
+
+    @property
+    def last(self) -> int:
+        indices = self.segmented
+        return int(indices[-1]) if indices.size else -1
+
+    def get_slice_statistics(self, index: int, spacing: Tuple[float, float, float]) -> SliceStatistics:
+        """
+        :param index:
+        :param spacing: (slice, x, y) in mm
+        """
+        count = int(self.counts[index])
+        sum_x, sum_y, total, total2 = self.sums[index]
+        centroid = (float(sum_x / count), float(sum_y / count)) if count else (float('nan'), float('nan'))
+        mean, std = _mean_std(count, total, total2)
+        return SliceStatistics(index, count, count * spacing[1] * spacing[2], tuple(int(v) for v in self.bboxes[index]),
+                               centroid, mean, std)
+
+    def get_statistics(self, spacing: Tuple[float, float, float]) -> RegionStatistics:
+        """
+        Statistics of the whole segmented region
+        :param spacing: (slice, x, y) in mm
+        """
+        indices = self.segmented
+        count = int(self.counts.sum())
+        if not count:
+            nan = float('nan')
+            return RegionStatistics(0, 0., (0, 0, 0, 0, 0, 0), (nan, nan, nan), nan, nan, -1, -1)
+        bboxes = self.bboxes[indices]
+        bbox = (int(indices[0]), int(indices[-1]) + 1, int(bboxes[:, 0].min()), int(bboxes[:, 1].max()),
+                int(bboxes[:, 2].min()), int(bboxes[:, 3].max()))
+        sums = self.sums.sum(axis=0)
+        z = float(self.counts @ np.arange(len(self.counts))) / count
+        mean, std = _mean_std(count, sums[2], sums[3])
+        return RegionStatistics(count, count * spacing[0] * spacing[1] * spacing[2], bbox,
+                                (z, float(sums[0] / count), float(sums[1] / count)), mean, std, bbox[0], bbox[1] - 1)
+
+    def get_roi_statistics(self, box: Tuple[Tuple[int, int], Tuple[int, int], Tuple[int, int]],
+                           spacing: Tuple[float, float, float]) -> RegionStatistics:
+        """
+        Statistics of the segmented voxels in a box, only the segmented slices crossing the box are read
+        :param box: ((z0, z1), (x0, x1), (y0, y1)), the stops excluded, clipped by the volume
+        :param spacing: (slice, x, y) in mm
+        """
+        index = OverlayIndex(len(self.counts))
+        index._overlay, index._volume = self._overlay, self._volume
+        (start, stop), (x0, x1), (y0, y1) = box
+        start, stop = max(start, 0), min(stop, len(self.counts))
+        # The stops are taken before the origin is clipped, the upper bounds are clipped by the slicing
+        x0, y0 = max(x0, 0), max(y0, 0)
+        if x0 >= x1 or y0 >= y1:
+            return index.get_statistics(spacing)
+        for i in self.segmented[(self.segmented >= start) & (self.segmented < stop)]:
+            bx0, bx1, by0, by1 = self.bboxes[i]
+            if bx0 >= x1 or bx1 <= x0 or by0 >= y1 or by1 <= y0:
+                continue
+            index._index_box(int(i), x0, y0, self._overlay.get_region(int(i), x0, y0, x1 - x0, y1 - y0) != 0)
+        return index.get_statistics(spacing)
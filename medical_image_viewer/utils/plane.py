@@ -0,0 +1,135 @@
+"""
+@Author: Daryl Xu
+
+Axial, coronal and sagittal planes of the volume(slice, x, y).
+The 2D image of a plane is a strided view of the volume, indexed by (horizontal, vertical) for display.
+"""
+from enum import unique, Enum
+from typing import Tuple
+
+import numpy as np
+
+
+@unique
+class Plane(Enum):
+    # value: the axis of the volume fixed by the plane
+    AXIAL = 0
+    CORONAL = 1
+    SAGITTAL = 2
+
+
+# The axes of the volume shown horizontally and vertically
+DISPLAY_AXES = {
+    Plane.AXIAL: (1, 2),
+    Plane.CORONAL: (2, 0),
+    Plane.SAGITTAL: (1, 0),
+}
+
+
+def get_image(arr, plane: Plane, index: int) -> np.ndarray:
+    """
+    Image of the plane indexed by (horizontal, vertical), a view of the array without copying
+    if the array is an ndarray or memmap
+    :param arr: volume or overlay
+    :param plane:
+    :param index: index along the axis of the plane
+    :return:
+    """
+    if Plane.AXIAL == plane:
+        return arr[index]
+    if hasattr(arr, 'take_plane'):
+        image = arr.take_plane(plane.value, index)
+    elif Plane.CORONAL == plane:
+        image = arr[:, index, :]
+    else:
+        image = arr[:, :, index]
+    # (slice, y) -> (y, slice); (slice, x) -> (x, slice)
+    return image.T
+
+
+def to_voxel(plane: Plane, index: int, h: int, v: int) -> Tuple[int, int, int]:
+    """
+    Convert the position in the image of the plane to the voxel (slice, x, y)
+    """
+    coordinates = [0, 0, 0]
+    coordinates[plane.value] = index
+    h_axis, v_axis = DISPLAY_AXES[plane]
+    coordinates[h_axis] = h
+    coordinates[v_axis] = v
+    return tuple(coordinates)
+
+
+def to_block(plane: Plane, index: int, h: int, v: int, image: np.ndarray) -> Tuple[Tuple[int, int, int], np.ndarray]:
+    """
+    Convert a rectangle in the image of the plane to a block of the volume
+    :param plane:
+    :param index: index along the axis of the plane
+    :param h: horizontal start of the rectangle
+    :param v: vertical start of the rectangle
+    :param image: content of the rectangle, indexed by (horizontal, vertical)
+    :return: start (slice, x, y) and the block
+    """
+    arr = image if Plane.AXIAL == plane else image.T
+    return to_voxel(plane, index, h, v), np.expand_dims(arr, plane.value)
+
+
+def get_aspect(plane: Plane, spacing: Tuple[float, float, float]) -> float:
+    """
+    Height / width of a displayed pixel
+    :param plane:
+    :param spacing: (slice, x, y) in mm
+    :return:
+    """
+    h_axis, v_axis = DISPLAY_AXES[plane]
+    if not spacing[h_axis] or not spacing[v_axis]:
+        return 1.
+    return spacing[v_axis] / spacing[h_axis]
+
+
+def get_block(arr, plane: Plane, start: int, stop: int, rect: Tuple[int, int, int, int]) -> np.ndarray:
+    """
+    The rectangle of the images of consecutive slices of the plane, a strided view if the array is an
+    ndarray or memmap
+    :param arr: volume, a LazyVolume decodes the slices crossed
+    :param plane:
+    :param start: first index along the axis of the plane
+    :param stop: stop index, excluded
+    :param rect: (h0, v0, h1, v1) in the images of the plane
+    :return: (slices, horizontal, vertical)
+    """
+    h0, v0, h1, v1 = rect
+    h_axis, v_axis = DISPLAY_AXES[plane]
+    item = [slice(None)] * 3
+    item[plane.value] = slice(start, stop)
+    item[h_axis] = slice(h0, h1)
+    item[v_axis] = slice(v0, v1)
+    return np.asarray(arr[tuple(item)]).transpose((plane.value, h_axis, v_axis))
+
+
+def stack_to_block(plane: Plane, index: int, h: int, v: int, images: np.ndarray) \
+        -> Tuple[Tuple[int, int, int], np.ndarray]:
+    """
+    Convert the rectangles in the images of consecutive slices of the plane to a block of the volume,
+    the batched form of to_block
+    :param plane:
+    :param index: index of the first image along the axis of the plane
+    :param h: horizontal start of the rectangles
+    :param v: vertical start of the rectangles
+    :param images: (slices, horizontal, vertical)
+    :return: start (slice, x, y) and the block
+    """
+    axes = [0, 0, 0]
+    h_axis, v_axis = DISPLAY_AXES[plane]
+    axes[plane.value], axes[h_axis], axes[v_axis] = 0, 1, 2
+    return to_voxel(plane, index, h, v), images.transpose(axes)
+
+
+def get_region(arr, plane: Plane, index: int, rect: Tuple[int, int, int, int]) -> np.ndarray:
+    """
+    The rectangle of the image of the plane, only the rectangle of an axial slice of a SparseOverlay is decoded
+    :param rect: (h0, v0, h1, v1)
+    """
+    h0, v0, h1, v1 = rect
+    if Plane.AXIAL == plane and hasattr(arr, 'get_region'):
+        return arr.get_region(index, h0, v0, h1 - h0, v1 - v0)
+    return get_image(arr, plane, index)[h0: h1, v0: v1]
@@ -0,0 +1,198 @@
+"""
+@Author: Daryl Xu
+
+Opt-in timing instrumentation: spans of the slow actions kept in a ring buffer, counters,
+export as Chrome trace (chrome://tracing, Perfetto) and cProfile capture of a single action.
+An action is a `timed` function, the spans opened with `span` are the steps of the actions.
+Disabled, a span costs one attribute check.
+
+    with profiler.span('load_series', files=len(files)):
+        ...
+
+    @profiler.timed('segmentation')
+    def run(...):
+        ...
+"""
+import cProfile
+import functools
+import io
+import json
+import logging
+import os
+import pstats
+import threading
+import time
+from collections import deque, namedtuple
+from contextlib import contextmanager
+from typing import Callable, Dict, List, Optional
+
+from constant import PROFILE_ENABLED, PROFILE_MAX_SPANS
+
+# start and duration in seconds, start is relative to the creation of the profiler
+Span = namedtuple('Span', ['name', 'start', 'duration', 'thread', 'args'])
+
+
+class Profiler:
+    """
+    性能计时
+    Spans can be recorded from any thread, the cProfile capture only profiles the thread of the action.
+    """
+    def __init__(self, enabled: bool = False, max_spans: int = 10000):
+        self.enabled = enabled
+        self._spans = deque(maxlen=max_spans)
+        self._counters: Dict[str, int] = {}
+        self._lock = threading.Lock()
+        self._origin = time.perf_counter()
+        # The next action of the thread arming the capture, or the next span of the name, is profiled
+        self._capture_armed = False
+        self._capture_thread: Optional[int] = None
+        self._capture_name: Optional[str] = None
+        self._capturing = False
+        self._capture_path: Optional[str] = None
+        self.last_capture: Optional[pstats.Stats] = None
+        self.last_capture_name: Optional[str] = None
+
+    def set_enabled(self, enabled: bool):
+        self.enabled = enabled
+
+    def span(self, name: str, **args):
+        return self._span(name, False, args)
+
+    @contextmanager
+    def _span(self, name: str, action: bool, args: dict):
+        if not self.enabled:
+            yield
+            return
+        profile = self._start_capture(name, action)
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            duration = time.perf_counter() - start
+            if profile is not None:
+                self._finish_capture(profile, name)
+            self._spans.append(Span(name, start - self._origin, duration, threading.get_ident(), args))
+            logging.debug(f'{name}: {duration * 1000:.1f}ms')
+
+    def timed(self, name: str = None) -> Callable:
+        """
+        Decorator recording a span for every call, the name defaults to the qualified name of the function
+        """
+        def decorator(fn):
+            span_name = name or fn.__qualname__
+
+            @functools.wraps(fn)
+            def wrapper(*args, **kwargs):
+                if not self.enabled:
+                    return fn(*args, **kwargs)
+                with self._span(span_name, True, {}):
+                    return fn(*args, **kwargs)
+            return wrapper
+        return decorator
+
+    def count(self, name: str, n: int = 1):
+        if not self.enabled:
+            return
+        with self._lock:
+            self._counters[name] = self._counters.get(name, 0) + n
+
+    @property
+    def counters(self) -> Dict[str, int]:
+        with self._lock:
+            return dict(self._counters)
+
+    @property
+    def spans(self) -> List[Span]:
+        return list(self._spans)
+
+    def clear(self):
+        self._spans.clear()
+        with self._lock:
+            self._counters.clear()
+
+    def summary(self) -> List[dict]:
+        """
+        Statistics of the spans by name, the slowest in total first
+        """
+        stats = {}
+        for span in self.spans:
+            item = stats.setdefault(span.name, {'name': span.name, 'count': 0, 'total': 0., 'max': 0.})
+            item['count'] += 1
+            item['total'] += span.duration
+            item['max'] = max(item['max'], span.duration)
+        for item in stats.values():
+            item['mean'] = item['total'] / item['count']
+        return sorted(stats.values(), key=lambda item: item['total'], reverse=True)
+
+    def to_chrome_trace(self) -> dict:
+        """
+        Trace Event Format, the timestamps are in microseconds
+        """
+        pid = os.getpid()
+        events = [{
+            'name': span.name, 'ph': 'X', 'pid': pid, 'tid': span.thread,
+            'ts': span.start * 1e6, 'dur': span.duration * 1e6,
+            'args': {key: str(value) for key, value in span.args.items()},
+        } for span in self.spans]
+        now = (time.perf_counter() - self._origin) * 1e6
+        events.extend({'name': name, 'ph': 'C', 'pid': pid, 'tid': 0, 'ts': now, 'args': {name: value}}
+                      for name, value in self.counters.items())
+        return {'traceEvents': events, 'displayTimeUnit': 'ms'}
+
+    def export_chrome_trace(self, path: str):
+        with open(path, 'w') as f:
+            json.dump(self.to_chrome_trace(), f)
+
+    def capture_next(self, path: str = None, name: str = None):
+        """
+        Profile the next action with cProfile, the statistics are kept in last_capture and written to
+        path(pstats format) if given. Enables the profiler.
+        :param path:
+        :param name: profile the next span of the name instead, in any thread; without a name only the actions
+            of the calling thread(the GUI thread) are profiled, not the spans of the background tasks
+        """
+        with self._lock:
+            self.enabled = True
+            self._capture_path = path
+            self._capture_name = name
+            self._capture_thread = threading.get_ident()
+            self._capture_armed = True
+
+    def _start_capture(self, name: str, action: bool) -> Optional[cProfile.Profile]:
+        # Only the thread starting the span is profiled, a nested span does not start another capture
+        with self._lock:
+            if not self._capture_armed or self._capturing:
+                return None
+            if self._capture_name is not None:
+                if name != self._capture_name:
+                    return None
+            elif not action or threading.get_ident() != self._capture_thread:
+                return None
+            self._capture_armed = False
+            self._capturing = True
+        profile = cProfile.Profile()
+        profile.enable()
+        return profile
+
+    def _finish_capture(self, profile: cProfile.Profile, name: str):
+        profile.disable()
+        if self._capture_path:
+            profile.dump_stats(self._capture_path)
+        self.last_capture = pstats.Stats(profile)
+        self.last_capture_name = name
+        with self._lock:
+            self._capturing = False
+
+    def format_capture(self, limit: int = 30) -> str:
+        if self.last_capture is None:
+            return ''
+        stream = io.StringIO()
+        self.last_capture.stream = stream
+        self.last_capture.sort_stats('cumulative').print_stats(limit)
+        return stream.getvalue()
+
+
+profiler = Profiler(PROFILE_ENABLED, PROFILE_MAX_SPANS)
+span = profiler.span
+timed = profiler.timed
+count = profiler.count
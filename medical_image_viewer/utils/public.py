@@ -3,7 +3,6 @@
 
 Some public functions
 """
-import pydicom
 import numpy as np
 
 
@@ -0,0 +1,130 @@
+"""
+@Author: Daryl Xu
+
+Multi-resolution pyramid of the volume, the slices are downsampled in plane(x, y) only,
+so a slice of every level matches the slice of the volume
+"""
+from typing import Dict, Tuple, Callable
+
+import numpy as np
+
+from utils import region_grow
+from utils.plane import Plane, DISPLAY_AXES, get_image
+
+
+def downsample(volume: np.ndarray, factor: int, chunk: int = 32) -> np.ndarray:
+    """
+    Block mean of factor x factor pixels of every slice
+    :param volume:
+    :param factor:
+    :param chunk: number of the slices processed at once, limits the temporary memory
+    :return: volume(slice, x // factor, y // factor), dtype of the volume
+    """
+    z_n, x_n, y_n = volume.shape
+    xc, yc = x_n // factor, y_n // factor
+    level = np.empty((z_n, xc, yc), volume.dtype)
+    for z0 in range(0, z_n, chunk):
+        block = np.asarray(volume[z0: z0 + chunk])[:, : xc * factor, : yc * factor]
+        block = block.reshape(block.shape[0], xc, factor, yc, factor).mean(axis=(2, 4))
+        level[z0: z0 + chunk] = block.astype(volume.dtype) if volume.dtype.kind == 'f' else np.rint(block)
+    return level
+
+
+def build_pyramid(volume: np.ndarray, factors=(2, 4), progress: Callable[[int, int], None] = None) \
+        -> Dict[int, np.ndarray]:
+    """
+    :param volume:
+    :param factors: downsampling factors, increasing; every level is built from the previous one
+    :param progress: callback(finished, total)
+    :return: {factor: level}
+    """
+    levels = {}
+    source, source_factor = volume, 1
+    for i, factor in enumerate(factors):
+        assert factor % source_factor == 0
+        levels[factor] = downsample(source, factor // source_factor)
+        source, source_factor = levels[factor], factor
+        if progress is not None:
+            progress(i + 1, len(factors))
+    return levels
+
+
+def upsample(mask: np.ndarray, factor: int, shape: Tuple[int, int, int]) -> np.ndarray:
+    """
+    Nearest upsampling of a level to the shape of the volume, the border not covered by the level is False
+    """
+    up = np.zeros(shape, mask.dtype)
+    expanded = mask.repeat(factor, axis=1).repeat(factor, axis=2)
+    up[:, : expanded.shape[1], : expanded.shape[2]] = expanded
+    return up
+
+
+def _dilate(mask: np.ndarray) -> np.ndarray:
+    """
+    Binary dilation by the 6-neighborhood
+    """
+    out = mask.copy()
+    for axis in range(3):
+        lo = [slice(None)] * 3
+        hi = [slice(None)] * 3
+        lo[axis], hi[axis] = slice(None, -1), slice(1, None)
+        out[tuple(lo)] |= mask[tuple(hi)]
+        out[tuple(hi)] |= mask[tuple(lo)]
+    return out
+
+
+def get_level_image(level: np.ndarray, factor: int, plane: Plane, index: int) -> Tuple[np.ndarray, Tuple[int, int]]:
+    """
+    Image of the plane from a level of the pyramid
+    :param level:
+    :param factor:
+    :param plane:
+    :param index: index along the axis of the plane in the volume
+    :return: image, (horizontal scale, vertical scale) to the volume
+    """
+    image = get_image(level, plane, index if Plane.AXIAL == plane else index // factor)
+    scale = tuple(factor if axis in (1, 2) else 1 for axis in DISPLAY_AXES[plane])
+    return image, scale
+
+
+def coarse_to_fine_grow(volume: np.ndarray, level: np.ndarray, factor: int, seed: Tuple[int, int, int],
+                        threshold: float, connectivity: int = 6, band: int = 1,
+                        coarse_callback: Callable[[np.ndarray], None] = None) -> np.ndarray:
+    """
+    预览分割：在低分辨率上生长，仅在边界附近以全分辨率细化
+    Grow the region on the coarse level, upsample the mask, then refine at full resolution only in a
+    band around the coarse boundary. Structures thinner than the level are missed away from the boundary.
+    :param volume:
+    :param level: the level of the pyramid
+    :param factor: the factor of the level
+    :param seed: (index, x, y) in the volume
+    :param threshold:
+    :param connectivity:
+    :param band: width of the refined band, in coarse voxels
+    :param coarse_callback: called with the upsampled coarse mask before the refinement
+    :return: overlay, np.int8
+    """
+    coarse_seed = (seed[0], min(seed[1] // factor, level.shape[1] - 1), min(seed[2] // factor, level.shape[2] - 1))
+    coarse = region_grow.region_grow(level, coarse_seed, threshold, connectivity).astype(bool)
+    if not coarse.any():
+        # The seed is lost by the averaging, grow at full resolution
+        return region_grow.region_grow(volume, seed, threshold, connectivity)
+    if coarse_callback is not None:
+        coarse_callback(upsample(coarse, factor, volume.shape))
+
+    # The band: coarse voxels within `band` of the boundary on both sides
+    outer, inner = coarse, coarse
+    for _ in range(band):
+        outer = _dilate(outer)
+        inner = ~_dilate(~inner)
+    certain = upsample(inner, factor, volume.shape)
+    uncertain = upsample(outer & ~inner, factor, volume.shape)
+    # The border of the volume not covered by the level is refined too
+    uncertain[:, level.shape[1] * factor:, :] = True
+    uncertain[:, :, level.shape[2] * factor:] = True
+
+    candidates = certain
+    candidates[uncertain] = np.asarray(volume)[uncertain] >= threshold
+    if not candidates[seed]:
+        return region_grow.region_grow(volume, seed, threshold, connectivity)
+    return region_grow.connected_component(candidates, seed, connectivity).astype(np.int8)
@@ -0,0 +1,284 @@
+"""
+@Author: Daryl Xu
+
+3D region growing: the volume is thresholded in one vectorized step, then the connected
+component containing the seed is kept. scipy.ndimage is used for the labelling when it is
+installed, otherwise a scan-line (run based) flood fill is used.
+"""
+import threading
+from collections import deque
+from typing import Callable, Tuple, Optional
+
+import numpy as np
+
+# scipy.ndimage is imported on first use, False: not imported yet, None: not installed
+_ndimage = False
+
+CONNECTIVITIES = (6, 18, 26)
+
+
+def _structure(connectivity: int) -> np.ndarray:
+    """
+    3x3x3 structuring element of the connectivity
+    """
+    offsets = np.indices((3, 3, 3)) - 1
+    rank = np.abs(offsets).sum(axis=0)
+    max_rank = {6: 1, 18: 2, 26: 3}[connectivity]
+    return rank <= max_rank
+
+
+def _get_ndimage():
+    global _ndimage
+    if _ndimage is False:
+        try:
+            from scipy import ndimage
+        except ImportError:
+            ndimage = None
+        _ndimage = ndimage
+    return _ndimage
+
+
+def _label_component_scipy(mask: np.ndarray, seed: Tuple[int, int, int], connectivity: int) -> np.ndarray:
+    labels, _ = _get_ndimage().label(mask, structure=_structure(connectivity))
+    return labels == labels[seed]
+
+
+def _get_runs(mask: np.ndarray):
+    """
+    Runs of True along the last axis
+    :return: row key(z * rows + x), start, end(exclusive) of every run, sorted by (key, start)
+    """
+    z_n, x_n, y_n = mask.shape
+    padded = np.zeros((z_n, x_n, y_n + 2), np.int8)
+    padded[:, :, 1:-1] = mask
+    diff = np.diff(padded, axis=2)
+    z, x, start = np.nonzero(diff == 1)
+    _, _, end = np.nonzero(diff == -1)
+    return z * x_n + x, start, end
+
+
+def _label_component_runs(mask: np.ndarray, seed: Tuple[int, int, int], connectivity: int) -> np.ndarray:
+    """
+    Scan-line flood fill over the runs of the mask, the python loop is over the runs instead of the voxels
+    """
+    z_n, x_n, _ = mask.shape
+    keys, starts, ends = _get_runs(mask)
+    seed_key = seed[0] * x_n + seed[1]
+    lo, hi = np.searchsorted(keys, seed_key), np.searchsorted(keys, seed_key, 'right')
+    seed_run = lo + np.nonzero((starts[lo:hi] <= seed[2]) & (ends[lo:hi] > seed[2]))[0][0]
+
+    # Neighbor rows (dz, dx) and whether a diagonal step along the run axis is allowed
+    neighbors = []
+    for dz in (-1, 0, 1):
+        for dx in (-1, 0, 1):
+            rank = abs(dz) + abs(dx)
+            if rank == 0 or rank > {6: 1, 18: 2, 26: 2}[connectivity]:
+                continue
+            neighbors.append((dz, dx, rank + 1 <= {6: 1, 18: 2, 26: 3}[connectivity]))
+
+    visited = np.zeros(len(keys), bool)
+    visited[seed_run] = True
+    queue = deque([seed_run])
+    while queue:
+        run = queue.popleft()
+        z, x = divmod(int(keys[run]), x_n)
+        start, end = starts[run], ends[run]
+        for dz, dx, diagonal in neighbors:
+            nz, nx = z + dz, x + dx
+            if not (0 <= nz < z_n and 0 <= nx < x_n):
+                continue
+            key = nz * x_n + nx
+            lo, hi = np.searchsorted(keys, key), np.searchsorted(keys, key, 'right')
+            if lo == hi:
+                continue
+            margin = 1 if diagonal else 0
+            hits = lo + np.nonzero((starts[lo:hi] < end + margin) & (ends[lo:hi] > start - margin)
+                                   & ~visited[lo:hi])[0]
+            visited[hits] = True
+            queue.extend(hits.tolist())
+
+    component = np.zeros(mask.shape, bool)
+    flat = component.reshape(z_n * x_n, -1)
+    for key, start, end in zip(keys[visited], starts[visited], ends[visited]):
+        flat[key, start:end] = True
+    return component
+
+
+def connected_component(mask: np.ndarray, seed: Tuple[int, int, int], connectivity: int = 6) -> np.ndarray:
+    """
+    The connected component of the mask containing the seed
+    :param mask: bool array
+    :param seed: (index, x, y)
+    :param connectivity: 6, 18 or 26
+    :return: bool array, all False if the seed is not in the mask
+    """
+    if connectivity not in CONNECTIVITIES:
+        raise ValueError(f'connectivity should be one of {CONNECTIVITIES}')
+    if not mask[seed]:
+        return np.zeros(mask.shape, bool)
+    if _get_ndimage() is not None:
+        return _label_component_scipy(mask, seed, connectivity)
+    return _label_component_runs(mask, seed, connectivity)
+
+
+def region_grow(volume: np.ndarray, seed: Tuple[int, int, int], threshold: float, connectivity: int = 6,
+                bbox: Optional[Tuple[Tuple[int, int], Tuple[int, int], Tuple[int, int]]] = None,
+                progress: Callable[[int, int], None] = None) -> np.ndarray:
+    """
+    区域生长，保留包含种子点且强度不低于阈值的连通区域
+    Grow the region from the seed, the voxels not lower than the threshold and connected to the seed are kept
+    :param volume:
+    :param seed: (index, x, y)
+    :param threshold:
+    :param connectivity: 6, 18 or 26
+    :param bbox: ((z0, z1), (x0, x1), (y0, y1)), limit the growing in the box, the seed must be in the box
+    :param progress: callback(finished, total) after every phase(thresholding, labelling, writing the overlay)
+    :return: overlay, np.int8 array with the shape of the volume
+    """
+    if bbox is None:
+        bbox = tuple((0, n) for n in volume.shape)
+    box = tuple(slice(max(lo, 0), min(hi, n)) for (lo, hi), n in zip(bbox, volume.shape))
+    local_seed = tuple(c - s.start for c, s in zip(seed, box))
+    if not all(0 <= c < s.stop - s.start for c, s in zip(local_seed, box)):
+        raise ValueError('the seed is out of the bounding box')
+
+    mask = np.asarray(volume[box]) >= threshold
+    if progress is not None:
+        progress(1, 3)
+    component = connected_component(mask, local_seed, connectivity)
+    if progress is not None:
+        progress(2, 3)
+
+    overlay = np.zeros(volume.shape, np.int8)
+    overlay[box] = component
+    if progress is not None:
+        progress(3, 3)
+    return overlay
+
+
+def get_bbox(mask: np.ndarray) -> Tuple[slice, ...]:
+    """
+    Bounding box of the True voxels, the mask must not be empty
+    """
+    box = []
+    for axis in range(mask.ndim):
+        others = tuple(i for i in range(mask.ndim) if i != axis)
+        indices = np.nonzero(mask.any(axis=others))[0]
+        box.append(slice(int(indices[0]), int(indices[-1]) + 1))
+    return tuple(box)
+
+
+def estimate_slice_2d(image: np.ndarray, seed: Tuple[int, int], threshold: float) -> np.ndarray:
+    """
+    Quick estimation of the region on one slice: the 2D component of the thresholded slice under the seed,
+    or the largest one if the seed is not above the threshold in the slice
+    :param image: the slice
+    :param seed: (x, y)
+    :param threshold:
+    :return: np.int8 mask of the slice
+    """
+    from utils.fine_tune import threshold_components
+    image = np.asarray(image)
+    keep = np.zeros((1,) + image.shape, bool)
+    keep[0, seed[0], seed[1]] = True
+    return threshold_components(image[None], threshold, keep)[0].astype(np.int8)
+
+
+class IncrementalRegionGrow:
+    """
+    阈值滑块移动时增量更新分割结果
+    Region growing from one seed with a changing threshold. The component at the lowest threshold
+    (the envelope) is computed once, every later threshold is computed inside its bounding box:
+    a raised threshold shrinks the previous mask, a lowered one grows inside the envelope.
+    """
+    def __init__(self, volume: np.ndarray, seed: Tuple[int, int, int], lowest: float, connectivity: int = 6):
+        """
+        :param volume:
+        :param seed: (index, x, y)
+        :param lowest: lowest threshold of the slider
+        :param connectivity:
+        """
+        self.volume = volume
+        self.seed = seed
+        self.lowest = lowest
+        self.connectivity = connectivity
+        self._lock = threading.Lock()
+        self._box = None
+        self._values = None
+        self._envelope = None
+        # (threshold, mask in the box) of the latest result
+        self._last = None
+
+    @property
+    def prepared(self) -> bool:
+        return self._envelope is not None
+
+    def prepare(self):
+        """
+        Compute the envelope, call it in a background thread
+        """
+        with self._lock:
+            if self._envelope is not None:
+                return
+            volume = np.ascontiguousarray(self.volume)
+            envelope = volume >= self.lowest
+            envelope = connected_component(envelope, self.seed, self.connectivity)
+            if not envelope.any():
+                envelope[self.seed] = True
+            self._box = get_bbox(envelope)
+            self._values = volume[self._box]
+            self._envelope = envelope[self._box]
+            self._local_seed = tuple(c - s.start for c, s in zip(self.seed, self._box))
+
+    def _to_overlay(self, mask: np.ndarray) -> np.ndarray:
+        overlay = np.zeros(self.volume.shape, np.int8)
+        overlay[self._box] = mask
+        return overlay
+
+    def grow(self, threshold: float) -> np.ndarray:
+        """
+        :param threshold:
+        :return: overlay of the whole volume
+        """
+        if threshold < self.lowest:
+            return region_grow(self.volume, self.seed, threshold, self.connectivity)
+        self.prepare()
+        with self._lock:
+            last = self._last
+        if last is not None and threshold >= last[0]:
+            # Shrink: only the voxels of the previous mask are candidates
+            candidates = last[1] & (self._values >= threshold)
+        else:
+            candidates = self._envelope & (self._values >= threshold)
+        if candidates[self._local_seed]:
+            mask = connected_component(candidates, self._local_seed, self.connectivity)
+        else:
+            mask = np.zeros(candidates.shape, bool)
+        with self._lock:
+            self._last = (threshold, mask)
+        return self._to_overlay(mask)
+
+    def estimate_slice(self, index: int, threshold: float) -> np.ndarray:
+        """
+        Quick estimation of the mask on one slice for the preview, an upper bound of the exact result.
+        :param index: index of the slice
+        :param threshold:
+        :return: mask of the slice
+        """
+        if threshold < self.lowest:
+            return (np.asarray(self.volume[index]) >= threshold).astype(np.int8)
+        if not self.prepared:
+            # The envelope is not computed yet
+            return estimate_slice_2d(self.volume[index], self.seed[1:], threshold)
+        mask = np.zeros(self.volume.shape[1:], np.int8)
+        with self._lock:
+            last = self._last
+        if not self._box[0].start <= index < self._box[0].stop:
+            return mask
+        i = index - self._box[0].start
+        if last is not None and threshold >= last[0]:
+            candidates = last[1][i] & (self._values[i] >= threshold)
+        else:
+            candidates = self._envelope[i] & (self._values[i] >= threshold)
+        mask[self._box[1:]] = candidates
+        return mask
@@ -0,0 +1,114 @@
+"""
+@Author: Daryl Xu
+
+Render the slices into display buffers, and cache the rendered buffers
+"""
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Tuple, Callable, Hashable
+
+import numpy as np
+
+from utils import profiling
+
+
+def apply_levels(arr: np.ndarray, levels: Tuple[float, float]) -> np.ndarray:
+    """
+    Map the intensity to uint8 by the window(levels)
+    :param arr:
+    :param levels: (low, high)
+    :return:
+    """
+    low, high = levels
+    scale = 255. / max(high - low, 1e-6)
+    out = np.subtract(arr, low, dtype=np.float32)
+    out *= scale
+    np.clip(out, 0, 255, out=out)
+    return out.astype(np.uint8)
+
+
+def render_overlay(mask: np.ndarray, lut: np.ndarray) -> np.ndarray:
+    """
+    :param mask: slice of the overlay
+    :param lut: RGBA of the background and the foreground
+    :return: RGBA uint8 image
+    """
+    return lut[(np.asarray(mask) != 0).astype(np.intp)]
+
+
+class RenderCache:
+    """
+    渲染结果缓存
+    LRU cache of the rendered buffers with a memory budget. The keys contain everything the
+    rendering depends on (slice index, levels, overlay version), so a stale buffer is never hit.
+    """
+    def __init__(self, max_bytes: int = 256 * 1024 * 1024, workers: int = 2):
+        self.max_bytes = max_bytes
+        self._items: OrderedDict = OrderedDict()
+        self._nbytes = 0
+        self._pending = set()
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=workers)
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key: Hashable):
+        with self._lock:
+            value = self._items.get(key)
+            if value is not None:
+                self._items.move_to_end(key)
+                self.hits += 1
+            else:
+                self.misses += 1
+        profiling.count('render_cache_hits' if value is not None else 'render_cache_misses')
+        return value
+
+    def put(self, key: Hashable, value: np.ndarray):
+        with self._lock:
+            self._pending.discard(key)
+            old = self._items.pop(key, None)
+            if old is not None:
+                self._nbytes -= old.nbytes
+            self._items[key] = value
+            self._nbytes += value.nbytes
+            while self._nbytes > self.max_bytes and self._items:
+                _, evicted = self._items.popitem(last=False)
+                self._nbytes -= evicted.nbytes
+
+    def get_or_render(self, key: Hashable, render: Callable[[], np.ndarray]) -> np.ndarray:
+        value = self.get(key)
+        if value is None:
+            value = render()
+            self.put(key, value)
+        return value
+
+    def prefetch(self, key: Hashable, render: Callable[[], np.ndarray]):
+        """
+        Render in the background if the key is not cached
+        """
+        with self._lock:
+            if key in self._items or key in self._pending:
+                return
+            self._pending.add(key)
+        self._executor.submit(self._prefetch, key, render)
+
+    def _prefetch(self, key: Hashable, render: Callable[[], np.ndarray]):
+        try:
+            self.put(key, render())
+        finally:
+            with self._lock:
+                self._pending.discard(key)
+
+    def invalidate(self, predicate: Callable[[Hashable], bool]):
+        """
+        Remove the buffers whose key matches
+        """
+        with self._lock:
+            for key in [key for key in self._items if predicate(key)]:
+                self._nbytes -= self._items.pop(key).nbytes
+
+    def clear(self):
+        with self._lock:
+            self._items.clear()
+            self._nbytes = 0
@@ -0,0 +1,255 @@
+"""
+@Author: Daryl Xu
+
+Index of the DICOM series in a directory tree, for the folders exported by a PACS which mix several
+studies and series. The tree is walked in parallel and only the headers are read(stop_before_pixels),
+the files are grouped by StudyInstanceUID/SeriesInstanceUID.
+The headers are kept in a SQLite file with the mtime and the size of every file, a rescan reads only
+the new and the modified files.
+"""
+import contextlib
+import os
+import sqlite3
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import Callable, Dict, Iterable, Iterator, List, NamedTuple, Optional, Tuple
+
+from constant import SERIES_INDEX_PATH
+
+# Changed when the columns change, the old table is dropped
+SCHEMA_VERSION = 2
+TAGS = ['StudyInstanceUID', 'SeriesInstanceUID', 'SOPInstanceUID', 'PatientName', 'PatientID', 'StudyDate', 'StudyDescription',
+        'SeriesDescription', 'Modality', 'SeriesNumber', 'InstanceNumber', 'Rows', 'Columns']
+# Columns of a file after the path, mtime and size; a file which is not a DICOM image has no study_uid
+COLUMNS = ['study_uid', 'series_uid', 'sop_uid', 'patient_name', 'patient_id', 'study_date', 'study_description',
+           'series_description', 'modality', 'series_number', 'instance_number', 'rows', 'cols']
+# Max number of the parameters of a SQLite statement
+_MAX_VARIABLES = 900
+
+
+class SeriesInfo(NamedTuple):
+    study_uid: str
+    series_uid: str
+    patient_name: str
+    patient_id: str
+    study_date: str
+    study_description: str
+    series_description: str
+    modality: str
+    series_number: int
+    rows: int
+    cols: int
+    # Sorted by the instance number, the loader sorts them by the slice location
+    files: List[str]
+
+    @property
+    def name(self) -> str:
+        return ' '.join(v for v in (self.patient_name, str(self.series_number), self.series_description) if v)
+
+
+def read_index_header(path: str) -> tuple:
+    """
+    :return: values of COLUMNS, all None if the file is not a DICOM image
+    """
+    import pydicom
+    try:
+        dcm = pydicom.dcmread(path, stop_before_pixels=True, force=True, specific_tags=TAGS)
+        if 'SeriesInstanceUID' not in dcm or 'Rows' not in dcm:
+            return (None,) * len(COLUMNS)
+        return (str(dcm.get('StudyInstanceUID', '')), str(dcm.SeriesInstanceUID), str(dcm.get('SOPInstanceUID', '')),
+                str(dcm.get('PatientName', '')),
+                str(dcm.get('PatientID', '')), str(dcm.get('StudyDate', '')), str(dcm.get('StudyDescription', '')),
+                str(dcm.get('SeriesDescription', '')), str(dcm.get('Modality', '')),
+                int(dcm.get('SeriesNumber', 0) or 0), int(dcm.get('InstanceNumber', 0) or 0),
+                int(dcm.Rows), int(dcm.get('Columns', 0) or 0))
+    except Exception:
+        # Not DICOM or broken, recorded to be skipped until it is modified
+        return (None,) * len(COLUMNS)
+
+
+def _scan_dir(directory: str) -> Tuple[List[Tuple[str, int, int]], List[str]]:
+    """
+    :return: (path, mtime_ns, size) of the files, sub directories
+    """
+    files, dirs = [], []
+    try:
+        with os.scandir(directory) as it:
+            for entry in it:
+                try:
+                    if entry.is_dir(follow_symlinks=False):
+                        dirs.append(entry.path)
+                    elif entry.is_file():
+                        stat = entry.stat()
+                        files.append((entry.path, stat.st_mtime_ns, stat.st_size))
+                except OSError:
+                    continue
+    except OSError:
+        pass
+    return files, dirs
+
+
+def walk_files(root: str, executor: ThreadPoolExecutor) -> List[Tuple[str, int, int]]:
+    """
+    List the files of the tree, the directories are listed in parallel
+    :return: (path, mtime_ns, size)
+    """
+    files = []
+    pending = {executor.submit(_scan_dir, root)}
+    while pending:
+        future = next(as_completed(pending))
+        pending.remove(future)
+        found, dirs = future.result()
+        files.extend(found)
+        pending.update(executor.submit(_scan_dir, d) for d in dirs)
+    return files
+
+
+def _get_prefix_range(root: str) -> Tuple[str, str]:
+    """
+    The paths under the directory are in [low, high)
+    """
+    low = os.path.join(root, '')
+    return low, low[:-1] + chr(ord(low[-1]) + 1)
+
+
+def group_series(rows: Iterable[tuple]) -> List[SeriesInfo]:
+    """
+    :param rows: (path, *COLUMNS)
+    :return: series sorted by the patient, the study date and the series number; a copy of an instance(same
+        SOPInstanceUID, e.g. the same study exported twice) is listed once
+    """
+    groups: Dict[Tuple[str, str], Dict[str, tuple]] = {}
+    for row in sorted((row for row in rows if row[1] is not None), key=lambda row: row[0]):
+        # Sorted by the path, the first copy is kept; an instance without SOPInstanceUID is never a copy
+        instances = groups.setdefault((row[1], row[2]), {})
+        instances.setdefault(row[3] or row[0], row)
+    series = []
+    for instances in groups.values():
+        members = sorted(instances.values(), key=lambda row: (row[11], row[0]))
+        _, study_uid, series_uid, _, patient_name, patient_id, study_date, study_description, series_description, \
+            modality, series_number, _, rows_, cols = members[0]
+        series.append(SeriesInfo(study_uid, series_uid, patient_name, patient_id, study_date, study_description,
+                                 series_description, modality, series_number, rows_, cols,
+                                 [row[0] for row in members]))
+    series.sort(key=lambda s: (s.patient_name, s.study_date, s.study_uid, s.series_number, s.series_uid))
+    return series
+
+
+class SeriesIndex:
+    """
+    序列索引
+    A connection is opened by every call, the index can be used from the worker threads
+    """
+    def __init__(self, path: str = SERIES_INDEX_PATH):
+        self.path = path
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        with self._connect() as db:
+            version = db.execute('PRAGMA user_version').fetchone()[0]
+            if version != SCHEMA_VERSION:
+                db.execute('DROP TABLE IF EXISTS files')
+                db.execute(f'PRAGMA user_version = {SCHEMA_VERSION}')
+            db.execute(f'CREATE TABLE IF NOT EXISTS files (path TEXT PRIMARY KEY, mtime_ns INTEGER, size INTEGER, '
+                       f'{", ".join(COLUMNS)})')
+
+    @contextlib.contextmanager
+    def _connect(self) -> Iterator[sqlite3.Connection]:
+        """
+        Committed and closed at the end
+        """
+        db = sqlite3.connect(self.path, timeout=30)
+        try:
+            with db:
+                yield db
+        finally:
+            db.close()
+
+    def get_series(self, root: str) -> List[SeriesInfo]:
+        """
+        The series of the directory as indexed by the last scan, nothing is read from the directory
+        """
+        low, high = _get_prefix_range(os.path.abspath(root))
+        with self._connect() as db:
+            rows = db.execute(f'SELECT path, {", ".join(COLUMNS)} FROM files WHERE path >= ? AND path < ?',
+                              (low, high)).fetchall()
+        return group_series(rows)
+
+    def _get_rows(self, db: sqlite3.Connection, root: Optional[str], paths: List[str]) -> Dict[str, tuple]:
+        """
+        :return: {path: (path, mtime_ns, size, *COLUMNS)}
+        """
+        query = f'SELECT path, mtime_ns, size, {", ".join(COLUMNS)} FROM files WHERE '
+        if root is not None:
+            rows = db.execute(query + 'path >= ? AND path < ?', _get_prefix_range(root)).fetchall()
+        else:
+            rows = []
+            for i in range(0, len(paths), _MAX_VARIABLES):
+                chunk = paths[i: i + _MAX_VARIABLES]
+                rows += db.execute(query + f'path IN ({", ".join("?" * len(chunk))})', chunk).fetchall()
+        return {row[0]: row for row in rows}
+
+    def scan(self, root: str = None, files: List[str] = None, workers: Optional[int] = None,
+             progress: Callable[[int, int], None] = None, check_cancelled: Callable[[], None] = None) \
+            -> List[SeriesInfo]:
+        """
+        Index the directory tree or the files, the headers of the files not modified since the last scan are
+        not read again, the files removed from the directory are removed from the index
+        :param root: directory
+        :param files: files, if no directory given
+        :param workers: max number of the threads
+        :param progress: callback(finished, total) of reading the headers, called in the caller's thread
+        :param check_cancelled: called in the caller's thread, raises to stop the scan
+        :return: the series of the directory or of the files
+        """
+        workers = workers or min(32, (os.cpu_count() or 1) + 4)
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            if root is not None:
+                root = os.path.abspath(root)
+                found = walk_files(root, executor)
+            else:
+                found = []
+                for path in files:
+                    stat = os.stat(path)
+                    found.append((os.path.abspath(path), stat.st_mtime_ns, stat.st_size))
+            if check_cancelled is not None:
+                check_cancelled()
+
+            with self._connect() as db:
+                indexed = self._get_rows(db, root, [path for path, _, _ in found])
+            rows = []
+            changed = []
+            for path, mtime_ns, size in found:
+                row = indexed.pop(path, None)
+                if row is not None and row[1] == mtime_ns and row[2] == size:
+                    rows.append((path,) + row[3:])
+                else:
+                    changed.append((path, mtime_ns, size))
+
+            updates = []
+            futures = {executor.submit(read_index_header, path): (path, mtime_ns, size)
+                       for path, mtime_ns, size in changed}
+            try:
+                for finished, future in enumerate(as_completed(futures), 1):
+                    path, mtime_ns, size = futures[future]
+                    values = future.result()
+                    updates.append((path, mtime_ns, size) + values)
+                    rows.append((path,) + values)
+                    if check_cancelled is not None:
+                        check_cancelled()
+                    if progress is not None:
+                        progress(finished, len(futures))
+            except BaseException:
+                for f in futures:
+                    f.cancel()
+                raise
+            finally:
+                # The headers read are kept even if the scan is cancelled
+                with self._connect() as db:
+                    db.executemany(f'INSERT OR REPLACE INTO files VALUES ({", ".join("?" * (len(COLUMNS) + 3))})',
+                                   updates)
+                    # Left of the directory are the files removed
+                    db.executemany('DELETE FROM files WHERE path = ?', ((path,) for path in indexed))
+        return group_series(rows)
+
+    def clear(self):
+        with self._connect() as db:
+            db.execute('DELETE FROM files')
@@ -0,0 +1,310 @@
+"""
+@Author: Daryl Xu
+
+Several series open at once, one of them attached to the store. The inactive series keep their
+overlays, history, seeds and the values of the widgets, their volumes are released under a global
+memory budget, the least recently used first:
+the decoded volume is replaced by the memory-mapped entry of the volume cache if there is one,
+otherwise spilled to a memory-mapped file, or dropped and decoded again from the DICOM files when
+the series is activated.
+The eviction runs in a background thread after a switch, the switch itself copies nothing.
+Every process spills into its own sub directory of the spill directory.
+"""
+import itertools
+import logging
+import os
+import shutil
+import tempfile
+import threading
+from collections import OrderedDict
+from typing import Callable, Dict, List, Optional, Tuple
+
+import numpy as np
+
+from constant import OVERLAY_HISTORY_MAX_BYTES, SESSION_MAX_BYTES, SESSION_SPILL_DIR
+from utils.histogram import VolumeHistogram
+from utils.history import OverlayHistory
+from utils.lazy_volume import LazyVolume
+from utils.overlay import SparseOverlay
+from utils.overlay_index import OverlayIndex
+
+_keys = itertools.count(1)
+
+
+def get_resident_nbytes(volume) -> int:
+    """
+    Memory held by the volume, a memory-mapped volume is paged by the system and holds nothing
+    """
+    if volume is None or isinstance(volume, np.memmap):
+        return 0
+    if isinstance(volume, LazyVolume):
+        return volume.resident_nbytes
+    return volume.nbytes
+
+
+class SeriesState:
+    """
+    序列会话
+    The data of a series, detached from the store while the series is inactive
+    """
+    def __init__(self, files: List[str], volume, spacing: Tuple[float, float, float],
+                 histogram: Optional[VolumeHistogram], name: str = None):
+        self.key = next(_keys)
+        self.name = name or (os.path.basename(os.path.dirname(files[0])) if files else str(self.key))
+        self.files = files
+        self.volume = volume
+        self.spacing = spacing
+        self.histogram = histogram
+        self.overlay: Optional[SparseOverlay] = None
+        self.history = OverlayHistory(OVERLAY_HISTORY_MAX_BYTES)
+        self.seed: Optional[Tuple[int, int, int]] = None
+        self.cursor: Tuple[int, int, int] = tuple(n // 2 for n in volume.shape)
+        self.pyramid: Dict[int, np.ndarray] = {}
+        self.overlay_index = OverlayIndex(volume.shape[0])
+        # Shape and dtype, kept when the volume is dropped
+        self.shape = tuple(volume.shape)
+        self.dtype = np.dtype(volume.dtype)
+        # Path of the file the volume was spilled to
+        self.spill_path: Optional[str] = None
+        # Values of the widgets(threshold, algorithm etc.), saved and restored by the window
+        self.extras: dict = {}
+
+    @property
+    def loaded(self) -> bool:
+        return self.volume is not None
+
+    @property
+    def resident_nbytes(self) -> int:
+        return get_resident_nbytes(self.volume) + \
+            sum(get_resident_nbytes(level) for level in self.pyramid.values())
+
+
+class SessionManager:
+    """
+    会话管理
+    The series in LRU order, the active one last. The manager does not import Qt, the store notifies
+    the widgets when a series is attached.
+    """
+    def __init__(self, store, max_bytes: int = SESSION_MAX_BYTES, spill_dir: str = SESSION_SPILL_DIR,
+                 find_cached: Callable[[List[str]], Optional[np.ndarray]] = None,
+                 reload: Callable[[List[str]], np.ndarray] = None):
+        """
+        :param store: store.Store
+        :param max_bytes: memory budget of the volumes and the pyramids of all the series
+        :param spill_dir: directory of the spill files, the files of the process are in a sub directory named
+            by its pid, created on the first spill
+        :param find_cached: fn(files) -> memory-mapped volume of the series or None, the decoded volume is
+            replaced by it
+        :param reload: fn(files) -> volume, decode a dropped volume again; volumes are never dropped if None
+        """
+        self.store = store
+        self.max_bytes = max_bytes
+        self.spill_root = spill_dir
+        self.spill_dir = os.path.join(spill_dir, str(os.getpid()))
+        self._find_cached = find_cached
+        self._reload = reload
+        self._series: 'OrderedDict[int, SeriesState]' = OrderedDict()
+        self._active: Optional[SeriesState] = None
+        # Guards the series and their volumes, evict() runs in a background thread
+        self._lock = threading.RLock()
+        # One eviction at a time
+        self._evict_lock = threading.Lock()
+
+    @property
+    def series(self) -> List[SeriesState]:
+        """
+        The series in the order they were opened
+        """
+        with self._lock:
+            return sorted(self._series.values(), key=lambda series: series.key)
+
+    @property
+    def active(self) -> Optional[SeriesState]:
+        return self._active
+
+    @property
+    def resident_nbytes(self) -> int:
+        with self._lock:
+            return sum(series.resident_nbytes for series in self._series.values())
+
+    def _detach(self):
+        if self._active is not None:
+            self.store.detach_series(self._active)
+
+    def open(self, files: List[str], volume, spacing: Tuple[float, float, float],
+             histogram: Optional[VolumeHistogram], name: str = None) -> SeriesState:
+        """
+        Open a loaded series and attach it to the store, the current series stays open.
+        Call evict() after, in a background thread.
+        """
+        self._detach()
+        series = SeriesState(files, volume, spacing, histogram, name)
+        series.overlay = SparseOverlay(volume.shape)
+        with self._lock:
+            self._series[series.key] = series
+            self._active = series
+        self.store.attach_series(series)
+        return series
+
+    def activate(self, key: int) -> SeriesState:
+        """
+        Attach the series to the store, a dropped volume is decoded again.
+        Call evict() after, in a background thread.
+        """
+        series = self._series[key]
+        if series is self._active:
+            return series
+        if not series.loaded:
+            volume = self._reload(series.files)
+            with self._lock:
+                series.volume = volume
+                series.overlay_index.rebind(volume)
+        self._detach()
+        with self._lock:
+            self._series.move_to_end(key)
+            self._active = series
+        self.store.attach_series(series)
+        return series
+
+    def close(self, key: int) -> Optional[SeriesState]:
+        """
+        Close the series, the most recently used one is activated if the active series is closed
+        :return: the active series, None if nothing is open
+        """
+        with self._lock:
+            series = self._series.pop(key)
+        if series is self._active:
+            self._active = None
+            if self._series:
+                self.activate(next(reversed(self._series)))
+            else:
+                self.store.attach_series(None)
+        self._release(series)
+        return self._active
+
+    def close_all(self):
+        for key in list(self._series):
+            self.close(key)
+
+    def evict(self):
+        """
+        Release the volumes of the inactive series, the least recently used first, until the budget is met.
+        Thread-safe, a series activated or closed while its volume is copied keeps its volume.
+        """
+        with self._evict_lock:
+            with self._lock:
+                candidates = [series for series in self._series.values() if series is not self._active]
+                total = self.resident_nbytes
+            for series in candidates:
+                if total <= self.max_bytes:
+                    break
+                before = series.resident_nbytes
+                if not before:
+                    continue
+                self._evict_series(series)
+                total -= before - series.resident_nbytes
+
+    def _is_inactive(self, series: SeriesState) -> bool:
+        return series is not self._active and self._series.get(series.key) is series
+
+    def _evict_series(self, series: SeriesState):
+        with self._lock:
+            if not self._is_inactive(series):
+                return
+            # The pyramid is built again when the series is activated
+            series.pyramid = {}
+            volume = series.volume
+            if isinstance(volume, LazyVolume):
+                volume.release()
+                return
+        if not get_resident_nbytes(volume):
+            return
+        replacement, spill_path = None, None
+        cached = self._find_cached(series.files) if self._find_cached is not None else None
+        if cached is not None and cached.shape == series.shape and cached.dtype == series.dtype:
+            replacement = cached
+        else:
+            try:
+                replacement = self._spill(volume)
+                spill_path = replacement.filename
+            except OSError as e:
+                if self._reload is None:
+                    logging.warning(f'series {series.name}: failed to spill the volume: {e}')
+                    return
+                logging.info(f'series {series.name}: volume dropped, {e}')
+
+        with self._lock:
+            if not self._is_inactive(series) or series.volume is not volume:
+                # Activated or closed while the volume was copied
+                if spill_path is not None:
+                    del replacement
+                    self._remove(spill_path)
+                return
+            series.volume = replacement
+            series.overlay_index.rebind(replacement)
+            series.spill_path = spill_path
+        if spill_path is not None:
+            logging.info(f'series {series.name}: volume spilled to {spill_path}')
+        elif replacement is not None:
+            logging.info(f'series {series.name}: volume replaced by the cached one')
+
+    def _spill(self, volume: np.ndarray) -> np.memmap:
+        os.makedirs(self.spill_dir, exist_ok=True)
+        fd, path = tempfile.mkstemp(suffix='.npy', dir=self.spill_dir)
+        os.close(fd)
+        try:
+            spilled = np.lib.format.open_memmap(path, 'w+', volume.dtype, volume.shape)
+            for i in range(volume.shape[0]):
+                spilled[i] = volume[i]
+            spilled.flush()
+            del spilled
+            return np.load(path, mmap_mode='r')
+        except OSError:
+            self._remove(path)
+            raise
+
+    @staticmethod
+    def _remove(path: str):
+        try:
+            os.remove(path)
+        except OSError as e:
+            # A file still mapped can not be removed on Windows, it is removed by clear_spill()
+            logging.warning(f'failed to remove the spill file {path}: {e}')
+
+    def _release(self, series: SeriesState):
+        if isinstance(series.volume, LazyVolume):
+            series.volume.close()
+        series.volume = None
+        series.pyramid = {}
+        if series.spill_path is not None:
+            self._remove(series.spill_path)
+            series.spill_path = None
+
+    def clear_spill(self):
+        """
+        Remove the spill files left by the previous sessions of this process id and of the processes
+        not running any more, the files of the other running viewers are kept
+        """
+        if self._series:
+            return
+        try:
+            names = os.listdir(self.spill_root)
+        except OSError:
+            return
+        for name in names:
+            path = os.path.join(self.spill_root, name)
+            if name.isdigit() and (path == self.spill_dir or not _is_running(int(name))):
+                shutil.rmtree(path, ignore_errors=True)
+
+
+def _is_running(pid: int) -> bool:
+    if os.name == 'nt':
+        # Not checked, os.kill() would terminate the process; the files of a crashed viewer are left
+        return True
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
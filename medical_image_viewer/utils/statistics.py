@@ -0,0 +1,64 @@
+"""
+@Author: Daryl Xu
+
+Intensity statistics around the seed, computed on small clipped windows of the volume
+"""
+from typing import NamedTuple, Tuple
+
+import numpy as np
+
+
+class SeedStatistics(NamedTuple):
+    mean: float
+    std: float
+    # suggested threshold and the range of the threshold slider
+    threshold: float
+    low: float
+    high: float
+
+
+def get_window(volume: np.ndarray, seed: Tuple[int, int, int], radius: Tuple[int, int, int]) -> np.ndarray:
+    """
+    Get the window centered at the seed, clipped by the border of the volume
+    :param volume: ndarray-like volume, only the window is read
+    :param seed: (index, x, y)
+    :param radius: radius of the window along every axis
+    :return:
+    """
+    slices = tuple(slice(max(c - r, 0), min(c + r + 1, n)) for c, r, n in zip(seed, radius, volume.shape))
+    return np.asarray(volume[slices])
+
+
+def estimate_region_statistics(volume: np.ndarray, seed: Tuple[int, int, int],
+                               radius: Tuple[int, int, int] = (3, 24, 24), ratio: float = 3,
+                               max_iter: int = 5) -> SeedStatistics:
+    """
+    Estimate the intensity statistics of the region containing the seed in a bounded window.
+    Starting from the 26-neighborhood, the voxels within mean ± ratio * std are selected repeatedly
+    until the selection is stable, so no full segmentation is needed.
+    :param volume:
+    :param seed: (index, x, y)
+    :param radius: radius of the window along every axis
+    :param ratio:
+    :param max_iter:
+    :return:
+    """
+    window = get_window(volume, seed, radius).astype(np.float32)
+    neighborhood = get_window(volume, seed, (1, 1, 1)).astype(np.float32)
+    mean, std = float(neighborhood.mean()), float(neighborhood.std())
+    # Avoid an empty band for a flat neighborhood
+    min_std = max(float(window.std()) * 0.05, 1e-3)
+
+    selected = None
+    for _ in range(max_iter):
+        band = max(std, min_std) * ratio
+        mask = np.abs(window - mean) <= band
+        if selected is not None and np.array_equal(mask, selected):
+            break
+        selected = mask
+        values = window[mask]
+        if values.size == 0:
+            break
+        mean, std = float(values.mean()), float(values.std())
+
+    return SeedStatistics(mean, std, mean - std * 1.5, mean - 3 * std, mean + 3 * std)
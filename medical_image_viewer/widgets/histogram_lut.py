@@ -1,11 +1,88 @@
 """
 @Author: Daryl Xu
 """
+import numpy as np
 from pyqtgraph import HistogramLUTItem, GraphicsView
+from PySide2.QtCore import Slot
+from PySide2.QtWidgets import QWidget, QVBoxLayout, QComboBox
 
+from constant import WINDOW_PRESETS
 
-class MivHistogramLUTWidget(GraphicsView):
-    def __init__(self, image_item):
+# The first item of the presets, the range of the volume
+FULL_RANGE = '全部'
+
+
+class MivHistogramLUTWidget(QWidget):
+    """
+    The histogram is not linked to the image item, the image view renders the slices with the
+    levels set here, so the levels stay fixed while scrolling.
+    The histogram of the volume is computed once(while loading or in the background) and kept by the state.
+    """
+    def __init__(self, image_view):
         super().__init__()
-        self.item = HistogramLUTItem(image_item)
-        self.setCentralItem(self.item)
+        self.combo_preset = QComboBox()
+        self.combo_preset.addItems([FULL_RANGE] + list(WINDOW_PRESETS))
+        self.view = GraphicsView()
+        self.item = HistogramLUTItem()
+        self.view.setCentralItem(self.item)
+        layout = QVBoxLayout()
+        layout.setContentsMargins(0, 0, 0, 0)
+        layout.addWidget(self.combo_preset)
+        layout.addWidget(self.view)
+        self.setLayout(layout)
+
+        self._image_view = image_view
+        image_view.levelsInitialized.connect(self._levels_initialized)
+        image_view.state.histogramChanged.connect(self._histogram_changed)
+        self.item.sigLevelsChanged.connect(self._levels_changed)
+        self.combo_preset.activated.connect(self._preset_selected)
+
+    def _get_range(self):
+        histogram = self._image_view.state.histogram
+        if histogram is None or histogram.empty:
+            return None
+        return histogram.min, histogram.max
+
+    @Slot()
+    def _histogram_changed(self):
+        histogram = self._image_view.state.histogram
+        if histogram is None or histogram.empty:
+            self.item.plot.clear()
+            return
+        x, counts = histogram.get_histogram(256)
+        self.item.plot.setData(x, counts)
+        self.item.setHistogramRange(histogram.min, histogram.max)
+
+    @Slot(object)
+    def _levels_initialized(self, slice_: np.ndarray):
+        self.combo_preset.setCurrentIndex(0)
+        value_range = self._get_range()
+        if value_range is not None:
+            self._histogram_changed()
+            low, high = value_range
+        else:
+            # The histogram of the volume is not computed yet
+            counts, edges = np.histogram(slice_, bins=256)
+            self.item.plot.setData(edges[:-1], counts)
+            low, high = float(edges[0]), float(edges[-1])
+            self.item.setHistogramRange(low, high)
+        self.item.setLevels(low, high)
+
+    @Slot(int)
+    def _preset_selected(self, index: int):
+        name = self.combo_preset.itemText(index)
+        if name in WINDOW_PRESETS:
+            center, width = WINDOW_PRESETS[name]
+            low, high = center - width / 2, center + width / 2
+        else:
+            value_range = self._get_range()
+            if value_range is None:
+                return
+            low, high = value_range
+        value_range = self._get_range() or (low, high)
+        self.item.setHistogramRange(min(low, value_range[0]), max(high, value_range[1]))
+        self.item.setLevels(low, high)
+
+    @Slot()
+    def _levels_changed(self):
+        self._image_view.set_levels(self.item.getLevels())
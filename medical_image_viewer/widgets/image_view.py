@@ -2,36 +2,74 @@
 @Author: Daryl Xu
 """
 import logging
-import math
+from typing import Optional, Tuple
 
 import numpy as np
 from numpy import ndarray
 import pyqtgraph as pg
 from PySide2.QtCore import Slot, QRect
+from PySide2.QtGui import QTransform
 from PySide2.QtWidgets import QWidget, QVBoxLayout, QSlider, QLabel, QHBoxLayout, QComboBox, QMessageBox
 from PySide2 import QtCore
-from lymphangioma_segmentation.image import Pixel
-from lymphangioma_segmentation import segmentation as seg
 from pyqtgraph.GraphicsScene.mouseEvents import MouseClickEvent
 
-from store import State, UpdateMode
-from utils import public
+from state import State
+from store import UpdateMode
+from utils import public, render, pyramid, profiling, fine_tune, brush
+from utils import plane as plane_
+from utils.plane import Plane
+from utils.render import RenderCache
 from constant import ViewMode, Algorithm
+from widgets.overlay_item import MivOverlayItem
+from worker import Worker
+
+
+# Number of the slices rendered ahead in the direction of scrolling
+PREFETCH_SLICES = 4
 
 
 class MivImageView(QWidget):
     # signal
     pixelSelected = QtCore.Signal(tuple, float)
+    # The levels are initialized from the given slice
+    levelsInitialized = QtCore.Signal(object)
+    roiCreated = QtCore.Signal()
+    # The ROI was created, moved or resized
+    roiChanged = QtCore.Signal()
 
-    def __init__(self, state: State):
+    def __init__(self, state: State, plane: Plane = Plane.AXIAL):
         super().__init__()
         self.state = state
+        self.plane = plane
         self.ui = UiForm(self)
 
         self._mode = ViewMode.VIEW
         self.roi: pg.ROI
+        self._roi_worker: Worker = None
+        # True while this view writes the overlay, it updates the changed rectangle itself
+        self._editing = False
+        # Brush radius in pixels, the brush and the polygon erase instead of painting if brush_erase is set
+        self.brush_radius = 5
+        self.brush_erase = False
+        # (index of the slice, last position) of the running stroke
+        self._stroke: Tuple[int, Tuple[float, float]] = None
+        self._polygon = []
+        # Slices finished by the running segmentation, {index: mask}
+        self._partial_overlay = {}
+        # Fixed window of the display, the slices are not autoscaled
+        self._levels: Tuple[float, float] = None
+        self._last_index = 0
+        # Factor of the pyramid level displayed
+        self._factor = 1
+        self._render_cache = RenderCache()
+        self._overlay_lut = public.get_look_up_table().astype(np.uint8)
         self.ui.image_item.mouseClickEvent = self._image_item_clicked
+        self.ui.image_item.mouseDragEvent = self._image_item_dragged
         self.ui.slice_slider.valueChanged.connect(self._show_current_slice)
+        self.ui.slice_slider.valueChanged.connect(self._slider_moved)
+        self.state.cursorChanged.connect(self._cursor_changed)
+        self.state.overlayUpdated.connect(self._overlay_updated)
+        self.ui.view_box.sigRangeChanged.connect(self._view_range_changed)
 
     @property
     def view_mode(self):
@@ -44,45 +82,171 @@ class MivImageView(QWidget):
             QMessageBox.warning(self, '注意', '请选择要调整的区域')
             return False
 
-    def segment_roi(self, algorithm: Algorithm, threshold: float):
+    def _get_roi_rect(self) -> Optional[Tuple[int, int, int, int]]:
+        """
+        The pixels covered by the ROI, (h0, v0, h1, v1) in the image of the plane
+        """
+        return fine_tune.get_rect(tuple(self.roi.pos()), tuple(self.roi.size()), self._get_plane_shape())
+
+    def get_roi_box(self, radius: int = 0) -> Optional[Tuple[Tuple[int, int], Tuple[int, int], Tuple[int, int]]]:
+        """
+        The voxels under the ROI, in the slices within the radius of the current one
+        :return: ((z0, z1), (x0, x1), (y0, y1)), None if there is no ROI
+        """
+        if not hasattr(self, 'roi'):
+            return None
+        rect = self._get_roi_rect()
+        if rect is None:
+            return None
+        h0, v0, h1, v1 = rect
+        box = [None] * 3
+        box[self.plane.value] = self._get_slice_range(radius)
+        h_axis, v_axis = plane_.DISPLAY_AXES[self.plane]
+        box[h_axis], box[v_axis] = (h0, h1), (v0, v1)
+        return tuple(box)
+
+    def _get_slice_range(self, radius: int) -> Tuple[int, int]:
+        """
+        The slices within the radius of the current one, (start, stop)
+        """
+        index = self.ui.slice_slider.value()
+        return max(index - radius, 0), min(index + radius + 1, self.slice_count)
+
+    def segment_roi(self, algorithm: Algorithm, threshold: float, radius: int = 0):
+        """
+        Segment the pixels under the ROI, in the slices within the radius of the current one
+        :param algorithm:
+        :param threshold:
+        :param radius: number of the slices on each side, only the current slice for GROW_EVERY_SLICE
+        """
         if not self._check_roi():
             return
-        current_slice = self.get_current_slice()
-        roi_arr = self.roi.getArrayRegion(current_slice, self.ui.image_item)
+        if Algorithm.GROW_EVERY_SLICE == algorithm and Plane.AXIAL != self.plane:
+            QMessageBox.warning(self, '注意', '该算法仅支持在横断面上微调')
+            return
+        # The ROI may be moved while the task is running
+        rect = self._get_roi_rect()
+        if rect is None:
+            return
+        start, stop = self._get_slice_range(radius if Algorithm.BY_THRESHOLD == algorithm else 0)
+        volume, overlay = self.state.volume, self.state.overlay
+        plane = self.plane
+
+        def task(worker: Worker):
+            # Integer slices of the volume, no resampling for an axis-aligned ROI
+            block = plane_.get_block(volume, plane, start, stop, rect)
+            if Algorithm.GROW_EVERY_SLICE == algorithm:
+                from lymphangioma_segmentation import segmentation as seg
+                return seg.fine_tune_roi(block[0], np.ascontiguousarray(volume), np.asarray(overlay))[None]
+            keep = plane_.get_block(overlay, plane, start, stop, rect) != 0
+            return fine_tune.threshold_components(block, threshold, keep)
+
+        if self._roi_worker is not None:
+            self._roi_worker.cancel()
+        worker = Worker(task)
+        worker.signals.finished.connect(lambda masks: self._roi_segmented(worker, volume, masks, start, rect))
+        worker.signals.failed.connect(lambda msg: self._roi_failed(worker, msg))
+        self._roi_worker = worker
+        worker.start()
+
+    def _roi_segmented(self, worker: Worker, volume: np.ndarray, masks: np.ndarray, start: int,
+                       rect: Tuple[int, int, int, int]):
+        if worker is not self._roi_worker:
+            return
+        self._roi_worker = None
+        # The masks of another volume are dropped
+        if self.state.volume is not volume:
+            return
+        self._update_mask_under_roi(masks, UpdateMode.APPEND, start, rect)
 
-        if Algorithm.GROW_EVERY_SLICE == algorithm:
-            mask = seg.fine_tune_roi(roi_arr, self.state.volume, self.state.overlay)
-        else:
-            mask = seg.fine_tune_roi1(roi_arr, threshold)
-        self._update_mask_under_roi(mask, UpdateMode.APPEND)
+    def _roi_failed(self, worker: Worker, msg: str):
+        if worker is not self._roi_worker:
+            return
+        self._roi_worker = None
+        QMessageBox.warning(self, '警告', f'分割失败：{msg}')
 
-    def erase_roi(self):
+    def erase_roi(self, radius: int = 0):
+        """
+        Erase the pixels under the ROI, in the slices within the radius of the current one
+        """
         if not self._check_roi():
             return
-        w_, h_ = self.roi.size()
-        w, h = int(math.ceil(w_)), int(math.ceil(h_))
-        mask = np.zeros((int(w), int(h)), np.int8)
-        self._update_mask_under_roi(mask, UpdateMode.OVER_WRITE)
-
-    def _update_mask_under_roi(self, mask, update_mode: UpdateMode):
+        rect = self._get_roi_rect()
+        if rect is None:
+            return
+        h0, v0, h1, v1 = rect
+        start, stop = self._get_slice_range(radius)
+        masks = np.zeros((stop - start, h1 - h0, v1 - v0), np.int8)
+        self._update_mask_under_roi(masks, UpdateMode.OVER_WRITE, start, rect)
+
+    @profiling.timed('update_mask_under_roi')
+    def _update_mask_under_roi(self, masks: np.ndarray, update_mode: UpdateMode, start: int,
+                               rect: Tuple[int, int, int, int]):
         """
         更新overlay ROI选中的区域
-        Update the area in overlay where selected by ROI
-        :param mask:
+        Update the area in overlay where selected by ROI, in one batched edit of the slices
+        :param masks: (slices, horizontal, vertical)
         :param update_mode: update mode
+        :param start: index of the first slice along the axis of the plane
+        :param rect: (h0, v0, h1, v1) of the ROI
         :return:
         """
-        w_, h_ = self.roi.size()
-        w, h = int(math.ceil(w_)), int(math.ceil(h_))
-        assert mask.shape == (w, h)
-        x, y = self.roi.pos()
-        position = Pixel(int(y), int(x), self.ui.slice_slider.value())
-        self.state.update_overlay(position, mask, update_mode)
-        self.refresh()
+        h0, v0, _, _ = rect
+        block_start, block = plane_.stack_to_block(self.plane, start, h0, v0, masks)
+        # The overlay of this view is updated in the rectangle below, not by the signal
+        self._editing = True
+        try:
+            self.state.update_overlay_block(block_start, block, update_mode)
+        finally:
+            self._editing = False
+        index = self.ui.slice_slider.value()
+        if start <= index < start + len(masks):
+            self._update_overlay_rect(index, rect)
+
+    def _update_overlay_rect(self, index: int, rect: Tuple[int, int, int, int]):
+        """
+        Render the overlay of the current slice again only in the rectangle, the image is not touched
+        """
+        h0, v0, h1, v1 = rect
+        rgba = self.ui.image_item_overlay.image
+        empty, version = self._get_overlay_version(index)
+        if empty or index in self._partial_overlay or rgba is None or \
+                rgba.shape[:2] != self._get_plane_shape():
+            self._show_overlay(index)
+            return
+        region = plane_.get_region(self.state.overlay, self.plane, index, rect)
+        rgba[h0: h1, v0: v1] = render.render_overlay(region, self._overlay_lut)
+        # The buffer is cached again for the new version of the overlay
+        self.invalidate_overlay(index)
+        self._render_cache.put(('overlay', index, version), rgba)
+        self.ui.image_item_overlay.update_rect(rect)
+
+    @Slot()
+    def _overlay_updated(self):
+        """
+        The overlay was changed elsewhere(another plane, undo etc.), only the overlay of the slice is shown again
+        """
+        if self._editing or not self.state.has_volume or self.state.overlay is None:
+            return
+        index = self.ui.slice_slider.value()
+        if index < self.slice_count:
+            self._show_overlay(index)
+
+    def _get_plane_shape(self) -> Tuple[int, int]:
+        h_axis, v_axis = plane_.DISPLAY_AXES[self.plane]
+        shape = self.state.volume.shape
+        return shape[h_axis], shape[v_axis]
 
     def get_current_slice(self) -> ndarray:
+        """
+        Image of the plane at the current index, indexed by (horizontal, vertical)
+        """
         index = self.ui.slice_slider.value()
-        return self.state.volume[index]
+        return plane_.get_image(self.state.volume, self.plane, index)
+
+    @property
+    def slice_count(self) -> int:
+        return self.state.volume.shape[self.plane.value]
 
     def set_view_mode(self, mode: ViewMode):
         """
@@ -93,46 +257,179 @@ class MivImageView(QWidget):
         if mode == self._mode:
             return
         self._mode = mode
+        self._clear_polygon()
         self.ui.view_mode_selector.setCurrentText(mode.value)
 
+    def set_levels(self, levels: Tuple[float, float]):
+        """
+        Set the window of the display, the cached slices of the other levels are dropped
+        :param levels: (low, high)
+        :return:
+        """
+        levels = (float(levels[0]), float(levels[1]))
+        if levels == self._levels:
+            return
+        self._levels = levels
+        self._render_cache.invalidate(lambda key: key[0] == 'image' and key[2] != levels)
+        if self.state.has_volume:
+            self._show_current_slice(self.ui.slice_slider.value())
+
+    def invalidate_overlay(self, index: int):
+        """
+        Drop the rendered overlay of the slice
+        """
+        self._render_cache.invalidate(lambda key: key[0] == 'overlay' and key[1] == index)
+
+    def reset_display(self):
+        """
+        Called when a new volume is loaded
+        """
+        if self._roi_worker is not None:
+            self._roi_worker.cancel()
+            self._roi_worker = None
+        self._levels = None
+        self._render_cache.clear()
+        self.clear_partial_overlay()
+        self.clear_overlay()
+
+    def _render_image(self, index: int, levels: Tuple[float, float], factor: int = 1) -> ndarray:
+        profiling.count('slices_rendered')
+        if factor > 1:
+            image, _ = pyramid.get_level_image(self.state.get_level(factor), factor, self.plane, index)
+        else:
+            image = plane_.get_image(self.state.volume, self.plane, index)
+        return render.apply_levels(image, levels)
+
+    def _get_display_factor(self) -> int:
+        """
+        The coarsest level of the pyramid not finer than the screen when zoomed out
+        """
+        pixel_size = min(self.ui.view_box.viewPixelSize())
+        factor = 1
+        for f in self.state.pyramid_factors:
+            if f <= pixel_size:
+                factor = max(factor, f)
+        return factor
+
+    @Slot()
+    def _view_range_changed(self):
+        if not self.state.has_volume:
+            return
+        if self._get_display_factor() != self._factor:
+            self._show_current_slice(self.ui.slice_slider.value())
+
+    def _prefetch(self, index: int):
+        """
+        Render the next slices in the direction of scrolling in the background
+        """
+        if Plane.AXIAL != self.plane and not isinstance(self.state.volume, np.ndarray):
+            # A plane of a lazy volume decodes every slice, never do it in advance
+            return
+        if not self.state.fully_loaded and Plane.AXIAL != self.plane:
+            # Rendered again when more slices are decoded
+            return
+        direction = -1 if index < self._last_index else 1
+        self._last_index = index
+        levels, factor = self._levels, self._factor
+        start, stop = self.state.loaded_slices if Plane.AXIAL == self.plane else (0, self.slice_count)
+        for i in range(index + direction, index + direction * (PREFETCH_SLICES + 1), direction):
+            if start <= i < stop:
+                self._render_cache.prefetch(('image', i, levels, factor),
+                                            lambda i=i: self._render_image(i, levels, factor))
+
     @Slot(int)
+    @profiling.timed('show_current_slice')
     def _show_current_slice(self, index: int):
         """
         :param index: value of the slider
         :return:
         """
-        self.ui.image_item.setImage(self.state.volume[index])
-        self.ui.image_item.setImage(self.state.volume[index])
+        if self._levels is None:
+            slice_ = np.asarray(self.get_current_slice())
+            histogram = self.state.histogram
+            # The range of the volume computed while loading, the slice is not scanned
+            self._levels = (histogram.min, histogram.max) if histogram is not None and not histogram.empty else \
+                (float(slice_.min()), float(slice_.max()))
+            self.levelsInitialized.emit(slice_)
+        levels = self._levels
+        factor = self._factor = self._get_display_factor()
+        image = self._render_cache.get_or_render(('image', index, levels, factor),
+                                                 lambda: self._render_image(index, levels, factor))
+        self.ui.image_item.setImage(image, autoLevels=False, levels=(0, 255))
+        # A coarse level is stretched to the size of the volume
+        h_scale, v_scale = (1, 1) if factor == 1 else pyramid.get_level_image(
+            self.state.get_level(factor), factor, self.plane, index)[1]
+        self.ui.image_item.setTransform(QTransform.fromScale(h_scale, v_scale))
 
         self._show_overlay(index)
+        self._prefetch(index)
 
         # Update the slice index
-        self.ui.slice_label.setText(f'{index + 1} / {self.state.volume.shape[0]}')
+        self.ui.slice_label.setText(f'{index + 1} / {self.slice_count}')
 
     def _add_overlay(self, overlay: np.ndarray):
         self.state.set_overlay(overlay)
 
-    def _show_overlay(self, index):
+    def _get_overlay_version(self, index: int) -> Tuple[bool, int]:
+        """
+        :return: whether the overlay of the slice is empty, version of the overlay rendered for the slice
+        """
         overlay = self.state.overlay
-        if overlay is not None:
-            self.ui.image_item_overlay.setImage(overlay[index])
+        if Plane.AXIAL == self.plane:
+            empty = overlay is None or overlay.slice_count(index) == 0
+            return empty, overlay.version(index) if not empty else None
+        # A coronal or sagittal plane crosses every slice
+        empty = overlay is None or overlay.count == 0
+        return empty, overlay.generation if not empty else None
+
+    def _show_overlay(self, index):
+        if index in self._partial_overlay:
+            rgba = render.render_overlay(self._partial_overlay[index], self._overlay_lut)
+        else:
+            overlay = self.state.overlay
+            empty, version = self._get_overlay_version(index)
+            if empty:
+                self.ui.image_item_overlay.clear()
+                return
+            rgba = self._render_cache.get_or_render(
+                ('overlay', index, version),
+                lambda: render.render_overlay(plane_.get_image(overlay, self.plane, index), self._overlay_lut))
+        self.ui.image_item_overlay.setImage(rgba, autoLevels=False)
+
+    @Slot(int, object)
+    def show_partial_overlay(self, index: int, mask: np.ndarray):
+        """
+        Show the slice finished by the running segmentation, the state is not changed
+        :param index: index of the slice
+        :param mask:
+        :return:
+        """
+        self._partial_overlay[index] = mask
+        if index == self.ui.slice_slider.value():
+            self._show_overlay(index)
+
+    def clear_partial_overlay(self):
+        self._partial_overlay = {}
 
     def clear_overlay(self):
         self.ui.image_item_overlay.clear()
 
     def _image_item_clicked(self, event: MouseClickEvent):
-        if ViewMode.VIEW == self._mode:
-            return
-
         index = self.ui.slice_slider.value()
-        position = event.pos()
-        x, y = int(position[0]), int(position[1])
-        if ViewMode.PIXEL_SELECTION == self._mode:
-            logging.debug(f'the position: ({x}, {y})')
-            value = self.state.volume[index][x, y]
+        # The item is scaled when a coarse level is shown, its local position is not the pixel of the plane
+        h, v = self._get_view_position(event)
+        shape = self._get_plane_shape()
+        x, y = min(max(int(np.floor(h)), 0), shape[0] - 1), min(max(int(np.floor(v)), 0), shape[1] - 1)
+        voxel = plane_.to_voxel(self.plane, index, x, y)
+        if ViewMode.VIEW == self._mode:
+            # Move the crosshair, the other planes follow
+            self.state.set_cursor(voxel)
+        elif ViewMode.PIXEL_SELECTION == self._mode:
+            logging.debug(f'the position: ({x}, {y}), voxel: {voxel}')
+            value = self.state.volume[voxel[0]][voxel[1], voxel[2]]
             logging.debug(f'value of the clicked pixel: {value}')
             # The pixel's index and intensity of the pixel
-            self.pixelSelected.emit((index, x, y), value)
+            self.pixelSelected.emit(voxel, float(value))
         elif ViewMode.ROI_SELECTION == self._mode:
             # TODO create a ROI widget on self.image_item
             roi = pg.ROI((x, y), pg.Point(20, 40))
@@ -143,10 +440,130 @@ class MivImageView(QWidget):
             roi.addScaleHandle([1, 1], [0, 0])
             roi.addScaleHandle([0, 0], [1, 1])
             self.ui.view_box.addItem(roi)
+            roi.sigRegionChangeFinished.connect(self.roiChanged)
+            self.roiCreated.emit()
+            self.roiChanged.emit()
+        elif ViewMode.BRUSH == self._mode:
+            point = (h, v)
+            self.state.begin_stroke()
+            self._stroke = (index, point)
+            self._paint_stroke([point])
+            self._end_stroke()
+        elif ViewMode.POLYGON == self._mode:
+            # Click to add a vertex, double click to close and fill the polygon
+            if event.double():
+                self._fill_polygon(index)
+                return
+            self._polygon.append((h, v))
+            vertices = np.array(self._polygon + self._polygon[:1])
+            self.ui.polygon_curve.setData(vertices[:, 0], vertices[:, 1])
+
+    def _get_view_position(self, event) -> Tuple[float, float]:
+        """
+        Position in the image of the plane, the displayed image may be a scaled level of the pyramid
+        """
+        point = self.ui.view_box.mapSceneToView(event.scenePos())
+        return point.x(), point.y()
+
+    def _image_item_dragged(self, event):
+        """
+        Paint with the brush, the other modes pan the view
+        """
+        if ViewMode.BRUSH != self._mode or event.button() != QtCore.Qt.LeftButton or not self.state.has_volume:
+            event.ignore()
+            return
+        event.accept()
+        point = self._get_view_position(event)
+        if event.isStart():
+            start = self.ui.view_box.mapSceneToView(event.buttonDownScenePos())
+            self.state.begin_stroke()
+            self._stroke = (self.ui.slice_slider.value(), (start.x(), start.y()))
+        if self._stroke is None:
+            return
+        self._paint_stroke([self._stroke[1], point])
+        self._stroke = (self._stroke[0], point)
+        if event.isFinish():
+            self._end_stroke()
+
+    def _paint_stroke(self, points):
+        """
+        Paint the segment of the stroke, only the touched rectangle of the overlay is drawn again
+        """
+        result = brush.rasterize_stroke(np.array(points), self.brush_radius, self._get_plane_shape())
+        if result is not None:
+            self._edit_rect(self._stroke[0], *result)
+
+    def _end_stroke(self):
+        self._stroke = None
+        # Recorded as one step of the history, the overlay of this view is already up to date
+        self._editing = True
+        try:
+            self.state.end_stroke()
+        finally:
+            self._editing = False
+
+    def _edit_rect(self, index: int, rect: Tuple[int, int, int, int], mask: np.ndarray):
+        self._editing = True
+        try:
+            self.state.paint_overlay(index, rect, mask, self.brush_erase, self.plane)
+        finally:
+            self._editing = False
+        if index == self.ui.slice_slider.value():
+            self._update_overlay_rect(index, rect)
+
+    @profiling.timed('fill_polygon')
+    def _fill_polygon(self, index: int):
+        vertices = self._polygon
+        self._clear_polygon()
+        result = brush.rasterize_polygon(np.array(vertices), self._get_plane_shape())
+        if result is not None:
+            self._edit_rect(index, *result)
+
+    def _clear_polygon(self):
+        self._polygon = []
+        self.ui.polygon_curve.setData([], [])
+
+    @Slot(int)
+    def _slider_moved(self, index: int):
+        cursor = list(self.state.cursor)
+        cursor[self.plane.value] = index
+        self.state.set_cursor(tuple(cursor))
+
+    @Slot(tuple)
+    def _cursor_changed(self, cursor: Tuple[int, int, int]):
+        index = cursor[self.plane.value]
+        if index != self.ui.slice_slider.value():
+            self.ui.slice_slider.setValue(index)
+        h_axis, v_axis = plane_.DISPLAY_AXES[self.plane]
+        # Lines through the center of the voxel
+        self.ui.line_vertical.setValue(cursor[h_axis] + 0.5)
+        self.ui.line_horizontal.setValue(cursor[v_axis] + 0.5)
+
+    def _update_slider_range(self):
+        if Plane.AXIAL == self.plane:
+            # Only the decoded slices can be shown while the volume is loaded in the background
+            start, stop = self.state.loaded_slices
+            self.ui.slice_slider.setRange(start, max(start, stop - 1))
+        else:
+            self.ui.slice_slider.setRange(0, self.slice_count - 1)
+
+    def update_loaded(self):
+        """
+        More slices of the volume were decoded in the background
+        """
+        if not self.state.has_volume:
+            return
+        self._update_slider_range()
+        if Plane.AXIAL != self.plane:
+            # Every coronal/sagittal image crosses the slices decoded meanwhile
+            self._render_cache.invalidate(lambda key: key[0] == 'image')
+            self._show_current_slice(self.ui.slice_slider.value())
 
     def refresh(self):
         # TODO what about overwrite update?
-        self.ui.slice_slider.setRange(0, self.state.volume.shape[0] - 1)
+        self._update_slider_range()
+        # Anisotropic voxels are stretched by the view, the data is not resampled
+        self.ui.view_box.setAspectLocked(True, ratio=1 / plane_.get_aspect(self.plane, self.state.spacing))
         index = self.ui.slice_slider.value()
         self._show_current_slice(index)
 
@@ -167,10 +584,19 @@ class UiForm:
         self.image_item = pg.ImageItem()  # 显示图像的控件
         self.view_box.addItem(self.image_item)
 
-        self.image_item_overlay = pg.ImageItem()
-        self.image_item_overlay.setLookupTable(public.get_look_up_table())  # 配置overlay控件的颜色查找表
+        self.image_item_overlay = MivOverlayItem()  # overlay以RGBA图像显示，颜色查找表见public.get_look_up_table
         self.view_box.addItem(self.image_item_overlay)
 
+        # 十字线 | crosshair shared by the planes
+        self.line_vertical = pg.InfiniteLine(angle=90, movable=False, pen=(255, 255, 0, 120))
+        self.line_horizontal = pg.InfiniteLine(angle=0, movable=False, pen=(255, 255, 0, 120))
+        self.view_box.addItem(self.line_vertical, ignoreBounds=True)
+        self.view_box.addItem(self.line_horizontal, ignoreBounds=True)
+
+        # 正在绘制的多边形 | vertices of the polygon being drawn
+        self.polygon_curve = pg.PlotCurveItem(pen=pg.mkPen((0, 255, 0), width=1))
+        self.view_box.addItem(self.polygon_curve, ignoreBounds=True)
+
         # self.graphic_view.addItem(self.image_item)
 
         self.text_top_right = pg.TextItem()
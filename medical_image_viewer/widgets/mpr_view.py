@@ -0,0 +1,103 @@
+"""
+@Author: Daryl Xu
+
+Axial, coronal and sagittal views of the volume, synchronized by the crosshair in the state
+"""
+from typing import Tuple
+
+import numpy as np
+from PySide2 import QtCore
+from PySide2.QtCore import Slot
+from PySide2.QtWidgets import QWidget, QGridLayout
+
+from constant import ViewMode, Algorithm
+from state import State
+from utils.plane import Plane
+from widgets.image_view import MivImageView
+
+
+class MivMprView(QWidget):
+    """
+    多平面重建视图
+    The interface follows MivImageView, the ROI operations go to the view where the ROI was drawn last
+    """
+    # signal
+    pixelSelected = QtCore.Signal(tuple, float)
+    levelsInitialized = QtCore.Signal(object)
+    roiChanged = QtCore.Signal()
+
+    def __init__(self, state: State):
+        super().__init__()
+        self.state = state
+        self.axial = MivImageView(state, Plane.AXIAL)
+        self.coronal = MivImageView(state, Plane.CORONAL)
+        self.sagittal = MivImageView(state, Plane.SAGITTAL)
+        self.views = (self.axial, self.coronal, self.sagittal)
+        self._active_view = self.axial
+
+        self.root_layout = QGridLayout()
+        self.root_layout.addWidget(self.axial, 0, 0, 2, 1)
+        self.root_layout.addWidget(self.coronal, 0, 1)
+        self.root_layout.addWidget(self.sagittal, 1, 1)
+        self.root_layout.setColumnStretch(0, 2)
+        self.root_layout.setColumnStretch(1, 1)
+        self.setLayout(self.root_layout)
+
+        for view in self.views:
+            view.pixelSelected.connect(self.pixelSelected)
+            view.roiCreated.connect(self._roi_created)
+            view.roiChanged.connect(self.roiChanged)
+        self.axial.levelsInitialized.connect(self.levelsInitialized)
+
+    @property
+    def ui(self):
+        # The widgets of the axial view (view mode selector etc.) are used by the main window
+        return self.axial.ui
+
+    @property
+    def active_view(self) -> MivImageView:
+        return self._active_view
+
+    @Slot()
+    def _roi_created(self):
+        self._active_view = self.sender()
+
+    def get_roi_box(self, radius: int = 0):
+        return self._active_view.get_roi_box(radius)
+
+    def segment_roi(self, algorithm: Algorithm, threshold: float, radius: int = 0):
+        self._active_view.segment_roi(algorithm, threshold, radius)
+
+    def erase_roi(self, radius: int = 0):
+        self._active_view.erase_roi(radius)
+
+    def set_view_mode(self, mode: ViewMode):
+        for view in self.views:
+            view.set_view_mode(mode)
+
+    def set_brush(self, radius: int, erase: bool):
+        for view in self.views:
+            view.brush_radius = radius
+            view.brush_erase = erase
+
+    def set_levels(self, levels: Tuple[float, float]):
+        for view in self.views:
+            view.set_levels(levels)
+
+    def show_partial_overlay(self, index: int, mask: np.ndarray):
+        self.axial.show_partial_overlay(index, mask)
+
+    def clear_partial_overlay(self):
+        self.axial.clear_partial_overlay()
+
+    def reset_display(self):
+        for view in self.views:
+            view.reset_display()
+
+    def refresh(self):
+        for view in self.views:
+            view.refresh()
+
+    def update_loaded(self):
+        for view in self.views:
+            view.update_loaded()
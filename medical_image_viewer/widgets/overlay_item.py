@@ -0,0 +1,60 @@
+"""
+@Author: Daryl Xu
+"""
+from typing import Tuple
+
+import numpy as np
+import pyqtgraph as pg
+from PySide2 import QtCore
+
+
+class MivOverlayItem(pg.GraphicsObject):
+    """
+    overlay图层
+    RGBA image drawn over the slice, indexed by (horizontal, vertical) like pg.ImageItem.
+    The QImage shares the buffer of the item, an edited rectangle is copied into the buffer and only
+    the rectangle is repainted, the whole image is not converted again.
+    """
+    def __init__(self):
+        super().__init__()
+        # RGBA given to setImage, (horizontal, vertical, 4)
+        self.image: np.ndarray = None
+        # BGRA rows of the QImage(Format_ARGB32), (vertical, horizontal, 4)
+        self._buffer: np.ndarray = None
+        self._qimage = None
+
+    def setImage(self, rgba: np.ndarray, **kwargs):
+        """
+        :param rgba: uint8 (horizontal, vertical, 4), kept by the item
+        :param kwargs: ignored, the arguments of pg.ImageItem.setImage
+        """
+        if self._buffer is None or self._buffer.shape[:2] != rgba.shape[1::-1]:
+            self.prepareGeometryChange()
+            self._buffer = np.empty((rgba.shape[1], rgba.shape[0], 4), np.uint8)
+            self._qimage = pg.functions.makeQImage(self._buffer, alpha=True, copy=False, transpose=False)
+        self.image = rgba
+        self._buffer[...] = rgba.transpose(1, 0, 2)[..., [2, 1, 0, 3]]
+        self.update()
+
+    def update_rect(self, rect: Tuple[int, int, int, int]):
+        """
+        Copy the rectangle of the image(changed in place) into the QImage and repaint it
+        :param rect: (h0, v0, h1, v1)
+        """
+        h0, v0, h1, v1 = rect
+        self._buffer[v0: v1, h0: h1] = self.image[h0: h1, v0: v1].transpose(1, 0, 2)[..., [2, 1, 0, 3]]
+        self.update(QtCore.QRectF(h0, v0, h1 - h0, v1 - v0))
+
+    def clear(self):
+        self.image = None
+        self.update()
+
+    def boundingRect(self) -> QtCore.QRectF:
+        if self._buffer is None:
+            return QtCore.QRectF()
+        return QtCore.QRectF(0, 0, self._buffer.shape[1], self._buffer.shape[0])
+
+    def paint(self, painter, *args):
+        if self.image is None:
+            return
+        painter.drawImage(self.boundingRect(), self._qimage)
@@ -0,0 +1,101 @@
+"""
+@Author: Daryl Xu
+
+The diagnostics window: timings of the recent actions and the counters
+"""
+from PySide2.QtCore import Slot, QTimer
+from PySide2.QtWidgets import QVBoxLayout, QHBoxLayout, QDialog, QTableWidget, QTableWidgetItem, QPushButton, \
+    QCheckBox, QTextBrowser, QFileDialog, QHeaderView, QAbstractItemView
+
+from utils.profiling import profiler
+
+COLUMNS = ['操作', '次数', '总计(ms)', '平均(ms)', '最长(ms)']
+
+
+class DiagnosticsWindow(QDialog):
+    def __init__(self):
+        super().__init__()
+        self._layout = QVBoxLayout()
+        self.setLayout(self._layout)
+        self.setWindowTitle('诊断')
+        self.resize(640, 480)
+
+        self.check_enabled = QCheckBox('记录耗时')
+        self.check_enabled.setChecked(profiler.enabled)
+        self.btn_clear = QPushButton('清空')
+        self.btn_capture = QPushButton('分析下一次操作')
+        self.btn_capture.setToolTip('用cProfile记录下一次操作的函数调用，选中表格中的一项时记录该项的下一次耗时')
+        self.btn_export = QPushButton('导出Chrome trace')
+        tool_layout = QHBoxLayout()
+        for widget in (self.check_enabled, self.btn_clear, self.btn_capture, self.btn_export):
+            tool_layout.addWidget(widget)
+        tool_layout.addStretch()
+
+        self.table = QTableWidget(0, len(COLUMNS))
+        self.table.setHorizontalHeaderLabels(COLUMNS)
+        self.table.horizontalHeader().setSectionResizeMode(0, QHeaderView.Stretch)
+        self.table.setEditTriggers(QTableWidget.NoEditTriggers)
+        self.table.setSelectionBehavior(QAbstractItemView.SelectRows)
+        self.table.setSelectionMode(QAbstractItemView.SingleSelection)
+        self.text_detail = QTextBrowser()
+
+        self._layout.addLayout(tool_layout)
+        self._layout.addWidget(self.table, 2)
+        self._layout.addWidget(self.text_detail, 1)
+
+        self.check_enabled.toggled.connect(profiler.set_enabled)
+        self.btn_clear.clicked.connect(self._clear)
+        self.btn_capture.clicked.connect(self._capture_next)
+        self.btn_export.clicked.connect(self._export)
+        # The spans are recorded without notification, poll while the window is open
+        self._timer = QTimer(self)
+        self._timer.setInterval(1000)
+        self._timer.timeout.connect(self.refresh)
+
+        self.show()
+
+    def showEvent(self, event):
+        self._timer.start()
+        self.refresh()
+        super().showEvent(event)
+
+    def hideEvent(self, event):
+        # Also called when the dialog is closed
+        self._timer.stop()
+        super().hideEvent(event)
+
+    @Slot()
+    def refresh(self):
+        summary = profiler.summary()
+        self.table.setRowCount(len(summary))
+        for row, item in enumerate(summary):
+            values = [item['name'], str(item['count'])] + \
+                     [f'{item[key] * 1000:.1f}' for key in ('total', 'mean', 'max')]
+            for column, value in enumerate(values):
+                self.table.setItem(row, column, QTableWidgetItem(value))
+
+        lines = [f'{name}: {value}' for name, value in sorted(profiler.counters.items())]
+        if profiler.last_capture is not None:
+            lines += ['', f'cProfile: {profiler.last_capture_name}', profiler.format_capture()]
+        text = '\n'.join(lines)
+        if text != self.text_detail.toPlainText():
+            self.text_detail.setPlainText(text)
+
+    @Slot()
+    def _clear(self):
+        profiler.clear()
+        self.refresh()
+
+    @Slot()
+    def _capture_next(self):
+        path, _ = QFileDialog.getSaveFileName(self, '保存cProfile结果（可取消）', 'action.prof', 'pstats (*.prof)')
+        rows = self.table.selectionModel().selectedRows()
+        name = self.table.item(rows[0].row(), 0).text() if rows else None
+        profiler.capture_next(path or None, name)
+        self.check_enabled.setChecked(True)
+
+    @Slot()
+    def _export(self):
+        path, _ = QFileDialog.getSaveFileName(self, '导出', 'trace.json', 'Chrome trace (*.json)')
+        if path:
+            profiler.export_chrome_trace(path)
@@ -0,0 +1,117 @@
+"""
+@Author: Daryl Xu
+
+The series picker: the series of a directory or of the selected files, one of them is opened.
+The series indexed by the last scan are listed at once, the directory is scanned again in the background.
+"""
+from typing import List, Optional
+
+from PySide2.QtCore import Slot
+from PySide2.QtWidgets import QVBoxLayout, QHBoxLayout, QDialog, QTableWidget, QTableWidgetItem, QPushButton, \
+    QLabel, QHeaderView, QAbstractItemView
+
+from utils.series_index import SeriesIndex, SeriesInfo
+from worker import Worker
+
+COLUMNS = ['患者', '检查日期', '检查描述', '序列号', '序列描述', '模态', '尺寸', '层数']
+
+
+class SeriesPickerDialog(QDialog):
+    def __init__(self, index: SeriesIndex, root: str = None, files: List[str] = None, parent=None):
+        """
+        :param index:
+        :param root: directory to scan
+        :param files: files to group, if no directory given; the dialog is closed at once if they are one series
+        :param parent:
+        """
+        super().__init__(parent)
+        self._index = index
+        self._series: List[SeriesInfo] = []
+        self._auto_open = root is None
+        self._layout = QVBoxLayout()
+        self.setLayout(self._layout)
+        self.setWindowTitle('选择序列')
+        self.resize(800, 400)
+
+        self.table = QTableWidget(0, len(COLUMNS))
+        self.table.setHorizontalHeaderLabels(COLUMNS)
+        self.table.horizontalHeader().setSectionResizeMode(4, QHeaderView.Stretch)
+        self.table.setEditTriggers(QTableWidget.NoEditTriggers)
+        self.table.setSelectionBehavior(QAbstractItemView.SelectRows)
+        self.table.setSelectionMode(QAbstractItemView.SingleSelection)
+        self.label_status = QLabel()
+        self.btn_open = QPushButton('打开')
+        self.btn_cancel = QPushButton('取消')
+        button_layout = QHBoxLayout()
+        button_layout.addWidget(self.label_status)
+        button_layout.addStretch()
+        button_layout.addWidget(self.btn_open)
+        button_layout.addWidget(self.btn_cancel)
+        self._layout.addWidget(self.table)
+        self._layout.addLayout(button_layout)
+
+        self.table.itemSelectionChanged.connect(self._selection_changed)
+        self.table.itemDoubleClicked.connect(self.accept)
+        self.btn_open.clicked.connect(self.accept)
+        self.btn_cancel.clicked.connect(self.reject)
+
+        if root is not None:
+            self._set_series(index.get_series(root))
+        self._selection_changed()
+        self._worker = self._scan(root, files)
+
+    @property
+    def selected_series(self) -> Optional[SeriesInfo]:
+        rows = self.table.selectionModel().selectedRows()
+        return self._series[rows[0].row()] if rows else None
+
+    def _scan(self, root: Optional[str], files: Optional[List[str]]) -> Worker:
+        def task(worker: Worker):
+            def progress(finished: int, total: int):
+                if finished % 64 == 0 or finished == total:
+                    worker.progress(finished, total)
+            return self._index.scan(root, files, progress=progress, check_cancelled=worker.check_cancelled)
+        worker = Worker(task)
+        worker.signals.progress.connect(self._scan_progress)
+        worker.signals.finished.connect(self._scan_finished)
+        worker.signals.failed.connect(lambda msg: self.label_status.setText(f'扫描失败：{msg}'))
+        self.label_status.setText('正在扫描...')
+        return worker.start()
+
+    def _set_series(self, series: List[SeriesInfo]):
+        selected = self.selected_series
+        self._series = series
+        self.table.setRowCount(len(series))
+        for row, info in enumerate(series):
+            values = [info.patient_name, info.study_date, info.study_description, str(info.series_number),
+                      info.series_description, info.modality, f'{info.rows}x{info.cols}', str(len(info.files))]
+            for column, value in enumerate(values):
+                self.table.setItem(row, column, QTableWidgetItem(value))
+        # The selection is kept when the list is updated by the scan
+        keys = [(info.study_uid, info.series_uid) for info in series]
+        if selected is not None and (selected.study_uid, selected.series_uid) in keys:
+            self.table.selectRow(keys.index((selected.study_uid, selected.series_uid)))
+        elif series and selected is None:
+            self.table.selectRow(0)
+
+    @Slot(int, int)
+    def _scan_progress(self, finished: int, total: int):
+        self.label_status.setText(f'正在读取文件头 {finished} / {total}')
+
+    @Slot(object)
+    def _scan_finished(self, series: List[SeriesInfo]):
+        self._set_series(series)
+        self.label_status.setText(f'共 {len(series)} 个序列')
+        if not series:
+            self.label_status.setText('没有找到DICOM序列')
+        elif self._auto_open and len(series) == 1:
+            self.accept()
+
+    @Slot()
+    def _selection_changed(self):
+        self.btn_open.setEnabled(self.selected_series is not None)
+
+    def done(self, result: int):
+        # The scan stops, the headers read so far are kept in the index
+        self._worker.cancel()
+        super().done(result)
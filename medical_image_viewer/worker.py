@@ -0,0 +1,81 @@
+"""
+@Author: Daryl Xu
+
+Run the time-consuming tasks (segmentation etc.) in the thread pool
+"""
+import logging
+import threading
+
+from PySide2 import QtCore
+from PySide2.QtCore import QObject, QRunnable, QThreadPool
+
+
+class Cancelled(Exception):
+    pass
+
+
+class WorkerSignals(QObject):
+    # (finished, total)
+    progress = QtCore.Signal(int, int)
+    # (slice index, mask of the slice)
+    partial = QtCore.Signal(int, object)
+    finished = QtCore.Signal(object)
+    failed = QtCore.Signal(str)
+    cancelled = QtCore.Signal()
+
+
+class Worker(QRunnable):
+    """
+    后台任务
+    Run fn(worker, *args, **kwargs) in the thread pool. The task reports progress and
+    partial results through the worker, and should call check_cancelled() regularly.
+    The signals are delivered to the GUI thread.
+    """
+    def __init__(self, fn, *args, **kwargs):
+        super().__init__()
+        # The python object is kept by the caller, Qt must not delete it
+        self.setAutoDelete(False)
+        self.signals = WorkerSignals()
+        self._fn = fn
+        self._args = args
+        self._kwargs = kwargs
+        self._cancel_event = threading.Event()
+
+    @property
+    def is_cancelled(self) -> bool:
+        return self._cancel_event.is_set()
+
+    def cancel(self):
+        self._cancel_event.set()
+
+    def check_cancelled(self):
+        """
+        Called by the task, stop the task by raising Cancelled
+        """
+        if self._cancel_event.is_set():
+            raise Cancelled
+
+    def progress(self, finished: int, total: int):
+        self.signals.progress.emit(finished, total)
+
+    def partial(self, index: int, mask):
+        self.signals.partial.emit(index, mask)
+
+    def run(self):
+        try:
+            result = self._fn(self, *self._args, **self._kwargs)
+        except Cancelled:
+            self.signals.cancelled.emit()
+        except Exception as e:
+            logging.exception(e)
+            self.signals.failed.emit(str(e))
+        else:
+            # A task without the cancellation points is dropped after it has finished
+            if self.is_cancelled:
+                self.signals.cancelled.emit()
+            else:
+                self.signals.finished.emit(result)
+
+    def start(self):
+        QThreadPool.globalInstance().start(self)
+        return self
@@ -3,8 +3,10 @@ import PyInstaller.__main__
 
 PyInstaller.__main__.run([
     'medical_image_viewer/main.py',
-    '--onefile',
+    # A one-file bundle unpacks itself to a temporary directory on every start
+    '--onedir',
     '--windowed',
+    '--exclude-module=tkinter',
     # '-i path/to/icon.ico',
     '-nmedical-image-viewer-1.0.0-beta.2'
 ])
@@ -0,0 +1,9 @@
+"""
+@Author: Daryl Xu
+
+The modules of the viewer are imported as the viewer does, from its directory
+"""
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'medical_image_viewer'))
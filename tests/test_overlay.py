@@ -0,0 +1,39 @@
+"""
+@Author: Daryl Xu
+
+The sparse overlay against a dense array
+"""
+import numpy as np
+
+from utils.overlay import SparseOverlay
+
+
+def test_regions_match_dense():
+    rng = np.random.default_rng(0)
+    shape = (4, 40, 30)
+    dense = np.zeros(shape, np.int8)
+    overlay = SparseOverlay(shape)
+    for _ in range(300):
+        index = int(rng.integers(shape[0]))
+        x0, y0 = int(rng.integers(shape[1])), int(rng.integers(shape[2]))
+        # Rectangles crossing the border are clipped
+        arr = (rng.random((int(rng.integers(1, 12)), int(rng.integers(1, 12)))) < rng.random()).astype(np.int8)
+        if rng.random() < 0.2:
+            arr[...] = 0
+        overlay.set_region(index, x0, y0, arr)
+        dense[index, x0: x0 + arr.shape[0], y0: y0 + arr.shape[1]] = arr[: shape[1] - x0, : shape[2] - y0]
+
+        assert overlay.count == np.count_nonzero(dense)
+        assert np.array_equal(overlay.get_slice(index), dense[index])
+        w, h = int(rng.integers(1, 20)), int(rng.integers(1, 20))
+        assert np.array_equal(overlay.get_region(index, x0, y0, w, h), dense[index, x0: x0 + w, y0: y0 + h])
+    assert np.array_equal(np.asarray(overlay), dense)
+
+
+def test_region_keeps_the_box_tight():
+    overlay = SparseOverlay((1, 100, 100))
+    overlay.set_region(0, 10, 10, np.ones((2, 2)))
+    overlay.set_region(0, 80, 80, np.ones((2, 2)))
+    overlay.set_region(0, 10, 10, np.zeros((2, 2)))
+    x0, y0, shape, _, count = overlay.get_entries([0])[0]
+    assert (x0, y0, shape, count) == (80, 80, (2, 2), 4)
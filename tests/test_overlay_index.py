@@ -0,0 +1,48 @@
+"""
+@Author: Daryl Xu
+
+The statistics of the overlay index against the dense arrays
+"""
+import numpy as np
+import pytest
+
+from utils.overlay import SparseOverlay
+from utils.overlay_index import OverlayIndex
+
+SPACING = (2., 0.5, 0.5)
+
+
+@pytest.fixture
+def data():
+    rng = np.random.default_rng(0)
+    volume = rng.normal(100, 20, (8, 32, 32))
+    mask = np.zeros(volume.shape, bool)
+    mask[2:6, 0:12, 3:20] = True
+    mask[4, 25:30, 25:30] = True
+    overlay = SparseOverlay(volume.shape)
+    for i in range(volume.shape[0]):
+        overlay.set_slice(i, mask[i].astype(np.int8))
+    index = OverlayIndex(volume.shape[0])
+    index.sync(overlay, volume)
+    return volume, mask, index
+
+
+def test_statistics(data):
+    volume, mask, index = data
+    region = index.get_statistics(SPACING)
+    assert region.count == mask.sum()
+    assert region.bbox == (2, 6, 0, 30, 3, 30)
+    assert region.mean == pytest.approx(volume[mask].mean())
+    assert region.std == pytest.approx(volume[mask].std())
+    assert region.centroid == pytest.approx(tuple(np.argwhere(mask).mean(axis=0)))
+
+
+@pytest.mark.parametrize('box', [((0, 8), (-5, 15), (-5, 15)), ((3, 5), (5, 28), (10, 40)), ((-2, 3), (20, 40), (0, 5))])
+def test_roi_statistics(data, box):
+    volume, mask, index = data
+    clipped = tuple(slice(max(lo, 0), hi) for lo, hi in box)
+    expected = mask[clipped]
+    roi = index.get_roi_statistics(box, SPACING)
+    assert roi.count == expected.sum()
+    if roi.count:
+        assert roi.mean == pytest.approx(volume[clipped][expected].mean())
@@ -0,0 +1,45 @@
+"""
+@Author: Daryl Xu
+
+The cProfile capture of a single action
+"""
+import threading
+
+from utils.profiling import Profiler
+
+
+def test_capture_next_action_of_the_thread():
+    profiler = Profiler()
+
+    @profiler.timed('action')
+    def action():
+        with profiler.span('step'):
+            pass
+
+    def background():
+        action()
+
+    profiler.capture_next()
+    thread = threading.Thread(target=background)
+    thread.start()
+    thread.join()
+    with profiler.span('step'):
+        pass
+    assert profiler.last_capture is None
+    action()
+    assert profiler.last_capture_name == 'action'
+
+
+def test_capture_next_named_span():
+    profiler = Profiler()
+    def background():
+        with profiler.span('other'):
+            pass
+
+    profiler.capture_next(name='step')
+    thread = threading.Thread(target=background)
+    thread.start()
+    thread.join()
+    with profiler.span('step'):
+        pass
+    assert profiler.last_capture_name == 'step'
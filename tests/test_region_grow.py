@@ -0,0 +1,69 @@
+"""
+@Author: Daryl Xu
+
+The region growing engine against the reference implementation and its two labelling paths against each other
+"""
+import numpy as np
+import pytest
+
+from utils import region_grow
+
+
+@pytest.fixture
+def volume() -> np.ndarray:
+    rng = np.random.default_rng(0)
+    volume = rng.normal(0, 20, (24, 64, 64)).astype(np.int16)
+    volume[6:18, 16:48, 20:40] += 200
+    volume[8:12, 30:34, 30:34] -= 300
+    return volume
+
+
+SEED, THRESHOLD = (12, 24, 24), 120
+
+
+def test_region_grow_equals_region_grow_3d(volume):
+    segmentation = pytest.importorskip('lymphangioma_segmentation.segmentation')
+    from lymphangioma_segmentation.image import Pixel
+
+    expected = segmentation.region_grow_3d(volume, Pixel(SEED[1], SEED[2], SEED[0]), THRESHOLD)
+    result = region_grow.region_grow(volume, SEED, THRESHOLD)
+    assert np.array_equal(expected.astype(bool), result.astype(bool))
+
+
+@pytest.mark.parametrize('connectivity', region_grow.CONNECTIVITIES)
+def test_runs_equal_scipy(connectivity):
+    pytest.importorskip('scipy.ndimage')
+    rng = np.random.default_rng(connectivity)
+    # Sparse noise, the components touch each other diagonally
+    mask = rng.random((16, 24, 24)) < 0.3
+    for seed in map(tuple, np.argwhere(mask)[::500]):
+        assert np.array_equal(region_grow._label_component_runs(mask, seed, connectivity),
+                              region_grow._label_component_scipy(mask, seed, connectivity))
+
+
+@pytest.mark.parametrize('connectivity', region_grow.CONNECTIVITIES)
+def test_bbox_limits_the_growing(volume, connectivity):
+    bbox = ((8, 14), (20, 40), (22, 30))
+    result = region_grow.region_grow(volume, SEED, THRESHOLD, connectivity, bbox)
+    box = tuple(slice(lo, hi) for lo, hi in bbox)
+    outside = np.ones(volume.shape, bool)
+    outside[box] = False
+    assert not result[outside].any()
+    # The component of the box alone, with the labelling path scipy does not take
+    local_seed = tuple(c - lo for c, (lo, _) in zip(SEED, bbox))
+    expected = region_grow._label_component_runs(volume[box] >= THRESHOLD, local_seed, connectivity)
+    assert np.array_equal(result[box].astype(bool), expected)
+
+
+def test_seed_out_of_bbox(volume):
+    with pytest.raises(ValueError):
+        region_grow.region_grow(volume, SEED, THRESHOLD, bbox=((0, 4), (0, 64), (0, 64)))
+
+
+def test_estimate_slice_before_prepare(volume):
+    preview = region_grow.IncrementalRegionGrow(volume, SEED, 60)
+    estimated = preview.estimate_slice(SEED[0], THRESHOLD).astype(bool)
+    assert estimated[SEED[1:]]
+    # The block is convex, the exact result of the slice is inside its 2D component
+    exact = region_grow.region_grow(volume, SEED, THRESHOLD)[SEED[0]].astype(bool)
+    assert not (exact & ~estimated).any()
@@ -0,0 +1,60 @@
+"""
+@Author: Daryl Xu
+
+Grouping the indexed files by series
+"""
+import os
+import shutil
+
+import numpy as np
+import pydicom
+import pytest
+from pydicom.dataset import FileMetaDataset
+from pydicom.uid import ExplicitVRLittleEndian, generate_uid
+
+from utils.series_index import SeriesIndex
+
+
+def write_slice(path, study_uid: str, series_uid: str, series_number: int, instance: int):
+    meta = FileMetaDataset()
+    meta.MediaStorageSOPClassUID = pydicom.uid.MRImageStorage
+    meta.MediaStorageSOPInstanceUID = generate_uid()
+    meta.TransferSyntaxUID = ExplicitVRLittleEndian
+    dcm = pydicom.Dataset()
+    dcm.file_meta = meta
+    dcm.StudyInstanceUID = study_uid
+    dcm.SeriesInstanceUID = series_uid
+    dcm.SOPInstanceUID = meta.MediaStorageSOPInstanceUID
+    dcm.SeriesNumber = series_number
+    dcm.InstanceNumber = instance
+    dcm.Rows = dcm.Columns = 4
+    dcm.BitsAllocated = dcm.BitsStored = 16
+    dcm.HighBit = 15
+    dcm.PixelRepresentation = 1
+    dcm.SamplesPerPixel = 1
+    dcm.PhotometricInterpretation = 'MONOCHROME2'
+    dcm.PixelData = np.zeros((4, 4), np.int16).tobytes()
+    dcm.save_as(str(path), enforce_file_format=True)
+
+
+# The text file is read with force=True
+@pytest.mark.filterwarnings('ignore:Expected implicit VR')
+def test_scan_groups_series_and_skips_copies(tmp_path):
+    root = tmp_path / 'export'
+    study = generate_uid()
+    series = [generate_uid(), generate_uid()]
+    for s, series_uid in enumerate(series):
+        (root / f'series{s}').mkdir(parents=True)
+        for i in range(3):
+            write_slice(root / f'series{s}' / f'{i}.dcm', study, series_uid, s + 1, i + 1)
+    (root / 'README.txt').write_text('not DICOM')
+    # The same series exported twice
+    shutil.copytree(root / 'series0', root / 'series0 copy')
+
+    index = SeriesIndex(str(tmp_path / 'index.sqlite'))
+    found = index.scan(str(root), workers=2)
+    assert [info.series_uid for info in found] == series
+    assert all(len(info.files) == 3 for info in found)
+    # One copy of every instance, the first by the path
+    assert len({os.path.dirname(path) for path in found[0].files}) == 1
+    assert index.get_series(str(root)) == found
@@ -0,0 +1,60 @@
+"""
+@Author: Daryl Xu
+
+The strokes of the store in the history
+"""
+import numpy as np
+import pytest
+
+from store import Store
+
+STAMP = np.ones((3, 3), bool)
+
+
+@pytest.fixture
+def store() -> Store:
+    store = Store()
+    store.set_volume(np.zeros((4, 16, 16), np.int16), [''] * 4)
+    store.set_overlay(np.zeros((4, 16, 16), np.int8))
+    return store
+
+
+def test_stroke_is_one_step(store):
+    store.begin_stroke()
+    store.paint_overlay(1, (0, 0, 3, 3), STAMP)
+    store.paint_overlay(1, (5, 5, 8, 8), STAMP)
+    store.end_stroke()
+    assert store.overlay_count == 18
+    assert store.undo()
+    assert store.overlay_count == 0
+    assert store.redo()
+    assert store.overlay_count == 18
+
+
+def test_undo_blocked_during_stroke(store):
+    store.paint_overlay(1, (0, 0, 3, 3), STAMP)
+    store.begin_stroke()
+    store.paint_overlay(1, (5, 5, 8, 8), STAMP)
+    assert not store.undo()
+    store.end_stroke()
+    assert store.undo() and store.overlay_count == 9
+    assert store.undo() and store.overlay_count == 0
+
+
+def test_begin_stroke_ends_the_open_stroke(store):
+    store.begin_stroke()
+    store.paint_overlay(1, (0, 0, 3, 3), STAMP)
+    store.begin_stroke()
+    store.paint_overlay(2, (0, 0, 3, 3), STAMP)
+    store.end_stroke()
+    assert store.undo() and store.overlay_count == 9
+    assert store.undo() and store.overlay_count == 0
+
+
+def test_new_volume_drops_the_stroke(store):
+    store.begin_stroke()
+    store.paint_overlay(1, (0, 0, 3, 3), STAMP)
+    store.set_volume(np.zeros((4, 16, 16), np.int16), [''] * 4)
+    store.set_overlay(np.zeros((4, 16, 16), np.int8))
+    store.paint_overlay(1, (0, 0, 3, 3), STAMP)
+    assert store.undo() and store.overlay_count == 0